@@ -1,15 +1,36 @@
+import time
+STARTUP_TIME = time.perf_counter()  # Reference point for --startup-profile
+
 import os
+import sys
 import tkinter as tk
-from tkinter import filedialog, Canvas, Frame
+from tkinter import filedialog, messagebox, simpledialog, Canvas
 from tkinter import ttk  # Import ttk for the progress bar
 from tkinter import Menu
-from PIL import Image, ImageTk, ImageOps
 import threading
 import json
-import yaml
-import csv
-import subprocess
 import tkinter.font as font
+import zlib
+from collections import OrderedDict, deque
+from gallery_grid import VirtualGrid
+from scheduler import MainThreadScheduler
+from dataset import Dataset
+from preview_cache import PreviewCache
+from tag_colors import TagColorDB
+from caption_journal import CaptionJournal
+from history import History, apply_delta
+from image_hash import MAX_THRESHOLD
+from fs_monitor import FolderMonitor
+from folder_scan import IMAGE_EXTENSIONS, iter_folder
+from completion_popup import CompletionPopup
+from load_queue import LoadQueue
+from tag_completion import TagCompleter
+from tag_query import QueryEngine, QueryError, parse, quote_tag, term_matches, terms
+from view_model import ViewModel
+from manifest import Manifest, stat_files
+
+# PIL, yaml, csv, numpy and the thumbnail pipeline are imported where they're first needed,
+# so the window comes up before any of them is loaded
 
 class ImageGalleryApp:
     color_mapping = {
@@ -41,9 +62,19 @@ class ImageGalleryApp:
         "lightgreen": "character",
         "orange": "meta"
     }
-    def __init__(self, root):
+    sort_fields = (  # Gallery orders besides load order, ImageMetadata columns
+        ("Load Order", ""),
+        ("Width", "width"),
+        ("Height", "height"),
+        ("Pixels", "pixels"),
+        ("Aspect Ratio", "aspect"),
+        ("File Size", "filesize"),
+    )
+    def __init__(self, root, startup_profile=None):
         self.root = root
+        self.startup_profile = startup_profile  # StartupProfile when started with --startup-profile
         self.root.title("Image Gallery")
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
 
         self.create_menu_bar()
         self.initialize_variables()
@@ -52,24 +83,42 @@ class ImageGalleryApp:
         self.setup_right_frame()
         self.setup_key_bindings()
         self.setup_filter_and_tag_options()
+        self.setup_autocomplete()
+        self.setup_view()
         self.initialize_color_schemes()
 
         settings = self.load_settings()
         self.apply_initial_settings(settings)
+        if self.startup_profile is not None:
+            self.startup_profile.mark("window built")
+            self.startup_profile.watch_first_frame(self.root)
 
     def create_menu_bar(self):
         self.menu_bar = tk.Menu(self.root)
         self.root.config(menu=self.menu_bar)
         self.create_file_menu()
+        self.create_edit_menu()
         self.create_tools_menu()
 
     def create_file_menu(self):
         self.file_menu = tk.Menu(self.menu_bar, tearoff=0)
         self.file_menu.add_command(label="Open", command=self.load_folder)
         self.file_menu.add_separator()
-        self.file_menu.add_command(label="Quit", command=self.root.quit)
+        self.file_menu.add_command(label="Quit", command=self.quit)
         self.menu_bar.add_cascade(label="File", menu=self.file_menu)
 
+    def create_edit_menu(self):
+        self.edit_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.edit_menu.add_command(label="Undo", command=self.undo, accelerator="Ctrl+Z", state="disabled")
+        self.edit_menu.add_command(label="Redo", command=self.redo, accelerator="Ctrl+Y", state="disabled")
+        self.menu_bar.add_cascade(label="Edit", menu=self.edit_menu)
+
+    def update_edit_menu(self):
+        undo = self.history.undo_stack[-1] if self.history.can_undo() else None
+        redo = self.history.redo_stack[-1] if self.history.can_redo() else None
+        self.edit_menu.entryconfig(0, label=f"Undo {undo.label}" if undo else "Undo", state="normal" if undo else "disabled")
+        self.edit_menu.entryconfig(1, label=f"Redo {redo.label}" if redo else "Redo", state="normal" if redo else "disabled")
+
     def create_tools_menu(self):
         self.tools_menu = tk.Menu(self.menu_bar, tearoff=0)
         self.add_tools_menu_commands()
@@ -92,22 +141,18 @@ class ImageGalleryApp:
             self.remove_by_color_menu.add_command(label=f"Remove {color_name}", command=lambda c=color_name: self.remove_tags_by_color(c))
 
     def remove_tags_by_color(self, color_name):
-        # Iterate through all image labels
-        for label in self.image_labels:
-            if label in self.tag_map:
-                # Filter out tags that do not match the color
-                tags_to_keep = [tag for tag in self.tag_map[label] if self.tag_colors.get(tag, "black") != color_name]
-                self.tag_map[label] = tags_to_keep
-                
-                # Update the tags file for the image
-                image_path = label.image_path
-                caption_path = image_path.rsplit('.', 1)[0] + '.txt'
-                with open(caption_path, 'w') as file:
-                    file.write(', '.join(tags_to_keep))
-                
-                # Update the tags display if the selected image's tags were changed
-                if label == self.selected_label:
-                    self.display_tags(image_path, self.count_tag_frequencies())
+        # Iterate through all images
+        self.run_bulk(self.dataset.image_ids(), lambda image_id: self._remove_tags_by_color(image_id, color_name), f"Remove {color_name} tags")
+
+    def _remove_tags_by_color(self, image_id, color_name):
+        if image_id in self.dataset:
+            # Filter out tags that do not match the color
+            tags_to_keep = [tag for tag in self.dataset.get_tags(image_id) if self.tag_colors.get(tag, "black") != color_name]
+            self.set_image_tags(image_id, tags_to_keep)
+            
+            # Update the tags display if the selected image's tags were changed
+            if image_id == self.selected_id and self.bulk_transaction is None:
+                self.view.mark("tags")
 
     def add_tools_menu_commands(self):
         self.tools_menu.add_command(label="Remove Duplicate tags in Visible Images", command=self.remove_duplicates_visible)
@@ -116,16 +161,61 @@ class ImageGalleryApp:
         self.tools_menu.add_command(label="Sort Tags for Selected Image", command=self.sort_tags_selected)
         self.tools_menu.add_command(label="Sort Tags for Visible Images", command=self.sort_tags_visible)
         self.tools_menu.add_command(label="Sort Tags for All Images", command=self.sort_tags_all)
+        self.tools_menu.add_separator()
+        self.tools_menu.add_command(label="Find Duplicate Images", command=self.find_duplicate_images)
+        self.tools_menu.add_command(label="Aspect Ratio Buckets", command=self.show_aspect_histogram)
+        self.sort_field = tk.StringVar(value="")
+        self.sort_descending = tk.BooleanVar(value=True)
+        self.sort_menu = tk.Menu(self.tools_menu, tearoff=0)
+        for label, field in self.sort_fields:
+            self.sort_menu.add_radiobutton(label=label, value=field, variable=self.sort_field, command=lambda: self.view.mark("gallery"))
+        self.sort_menu.add_separator()
+        self.sort_menu.add_checkbutton(label="Descending", variable=self.sort_descending, command=lambda: self.view.mark("gallery"))
+        self.tools_menu.add_cascade(label="Sort Images By", menu=self.sort_menu)
+        self.tools_menu.add_separator()
+        self.tools_menu.add_command(label="Statistics", command=self.show_statistics)
     
     def initialize_variables(self):
-        self.image_labels = []
-        self.tag_freq = {}
-        self.tag_colors = {}
-        self.selected_label = None
-        self.selection_lock = threading.Lock()
-        self.selection_debounce = None
-        self.tag_map = {}
+        self.dataset = Dataset()  # Paths and tags of the loaded folder, keyed by stable image ids
+        self.thumbnails = {}  # Image id -> encoded thumbnail, small enough to keep for every image
+        self.thumbnail_photos = OrderedDict()  # Image id -> PhotoImage, only for recently shown images
+        self.thumbnail_photo_limit = 256
+        self.thumbnail_cache = None  # Opened on the first folder load
+        self.thumbnail_pipeline = None
+        self.metadata = None  # ImageMetadata of the loaded folder, numpy is imported on the first load
+        self.preview_cache = None  # Created with the settings, see apply_initial_settings
+        self.preview_prefetch = 3  # Neighbours decoded ahead on each side of the selection
+        self.preview_generation = 0  # Bumped on every selection, stale preview decodes are dropped
+        self.preview_settle_ms = 120  # Full quality decode only starts once the selection stops moving
+        self.preview_settle_job = None
+        self.tag_colors = TagColorDB()  # Replaced by the compiled scheme in change_color_scheme
+        self.selected_id = None
+        self.context_menu_id = None
+        self.load_generation = 0
+        self.scheduler = MainThreadScheduler(self.root)
+        self.view = ViewModel(self.root)  # Coalesces tag panel and gallery refreshes, see setup_view
+        self.filter_generation = 0
+        self.query_engine = QueryEngine(self.tag_category)  # Evaluates the filter boxes, see tag_query
+        self.tag_completer = TagCompleter()  # Suggestions for the tag and filter entries
+        self.completion_loading = False
         self.color_schemes = {}  # Initialize color_schemes
+        self.caption_journal = CaptionJournal()  # Write-behind caption files, flushed on quit
+        self.history = History()  # Undo/redo of tag edits, depth comes from the settings
+        self.bulk_transaction = None  # Transaction the running bulk action records into
+        self.bulk_cancels = set()  # Cancel events of the bulk operations still running
+        self.replaying = False  # True while an undo or redo is being applied
+        self.folder_path = None
+        self.folder_monitor = None  # Watches the loaded folder once it's fully loaded
+        self.caption_ids = {}  # Caption path -> image id, to map caption changes back to images
+        self.file_stats = {}  # Image id -> (size, mtime_ns, caption size, caption mtime_ns) as of the last stat
+        self.manifest = None  # Manifest of the loaded folder, see display_images_threaded
+        self.manifest_dirty = set()  # Ids whose caption changed since the manifest was saved
+        self.manifest_stats = None
+        self.load_queue = LoadQueue()  # Thumbnails still to decode, replaced on every folder load
+        self.folder_walked = None  # False while a folder is walked, True until its thumbnails are done
+        self.thumbnail_request_thread = None
+        self.thumbnail_request_lock = threading.Lock()
+        self.color_scheme_generation = 0  # Bumped on every scheme change, older background loads are dropped
     
     def setup_main_frames(self):
         self.main_frame = tk.Frame(self.root)
@@ -134,14 +224,13 @@ class ImageGalleryApp:
     def setup_grid_canvas(self):
         self.grid_canvas = Canvas(self.main_frame, borderwidth=0, highlightthickness=0)
         self.scrollbar = tk.Scrollbar(self.main_frame, orient="vertical", command=self.grid_canvas.yview)
-        self.scrollable_frame = Frame(self.grid_canvas, borderwidth=0)
-        self.grid_canvas.config(width=300)
         self.grid_canvas.pack_propagate(False)
-        self.scrollable_frame.config(width=300)
-        self.scrollable_frame.pack_propagate(False)
-        self.scrollable_frame.bind("<Configure>", lambda e: self.grid_canvas.configure(scrollregion=self.grid_canvas.bbox("all")))
-        self.grid_canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.grid_canvas.configure(yscrollcommand=self.scrollbar.set)
+        # Only the on-screen rows exist as widgets, they get rebound to images while scrolling
+        self.gallery = VirtualGrid(self.grid_canvas, self.scrollbar, self.get_thumbnail_photo,
+                                   on_click=lambda image_id, e: self.select_image(image_id),
+                                   on_context=self.show_image_context_menu,
+                                   on_viewport=lambda *viewport: self.load_queue.focus(*viewport))
+        self.create_image_context_menu()
         self.grid_canvas.bind_all("<MouseWheel>", self._on_mousewheel)
         self.grid_canvas.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(side="left", fill="y")
@@ -158,6 +247,7 @@ class ImageGalleryApp:
         self.preview_frame.pack(side="top", fill="both", expand=False)
         self.preview_image_label = tk.Label(self.preview_frame)
         self.preview_image_label.pack(fill="both", expand=True)
+        self.preview_image_label.bind("<Button-3>", lambda e: self.show_image_context_menu(self.selected_id, e))
     
     def setup_tags_frame(self):
         self.tags_frame = tk.Frame(self.right_frame)
@@ -166,6 +256,30 @@ class ImageGalleryApp:
         self.tags_text.pack(side="left", fill="both", expand=True)
         self.tags_text.bind("<1>", lambda e: "break")
         self.tags_text.bind("<B1-Motion>", lambda e: "break")
+
+        # Tags are drawn as text ranges instead of a Label per tag. Every range carries the
+        # shared "chip" tag, which holds the mouse bindings, and a "chip:N" tag that says
+        # which tag it shows. Fonts and per-color text tags are created once and reused.
+        self.tag_font = font.Font(size=10)
+        self.tag_font_bold = font.Font(weight="bold", size=12)
+        self.tags_text.tag_configure("regular", font=self.tag_font)
+        self.tags_text.tag_configure("bold", font=self.tag_font_bold)
+        self.tags_text.tag_configure("hover", foreground="blue")
+        self.tags_text.tag_configure("suspect", underline=True)
+        self.tags_text.tag_configure("suggestion", font=font.Font(size=10, slant="italic"))
+        self.tags_text.tag_configure("note", font=font.Font(size=9), foreground="gray")
+        self.tag_color_styles = set()  # Colors that already have a "color:..." text tag
+        self.displayed_tags = []  # Tag shown by "chip:N"
+        self.suggested_tags = []  # Tag shown by "suggestion:N", see display_tags
+        self.tags_text.tag_bind("chip", "<Button-1>", lambda e: self.on_tag_chip(e, self.add_tag_to_filter_and_apply))
+        self.tags_text.tag_bind("chip", "<Button-3>", lambda e: self.on_tag_chip(e, lambda tag: self.tag_right_click_menu(e, tag)))
+        self.tags_text.tag_bind("chip", "<Enter>", self.hover_tag_chip)
+        self.tags_text.tag_bind("chip", "<Motion>", self.hover_tag_chip)
+        self.tags_text.tag_bind("chip", "<Leave>", lambda e: self.tags_text.tag_remove("hover", "1.0", "end"))
+        self.tags_text.tag_bind("suggestion", "<Button-1>", lambda e: self.on_tag_chip(e, self.add_suggested_tag, "suggestion:"))
+        self.tags_text.tag_bind("suggestion", "<Enter>", lambda e: self.hover_tag_chip(e, "suggestion:"))
+        self.tags_text.tag_bind("suggestion", "<Motion>", lambda e: self.hover_tag_chip(e, "suggestion:"))
+        self.tags_text.tag_bind("suggestion", "<Leave>", lambda e: self.tags_text.tag_remove("hover", "1.0", "end"))
     
     def setup_key_bindings(self):
         self.root.bind("<Left>", lambda e: self.move_focus("left"))
@@ -176,23 +290,28 @@ class ImageGalleryApp:
         self.root.bind("<Tab>", self.handle_tab_press)
         self.root.bind("<Return>", self.handle_return_press)
         self.root.bind("<Delete>", self.handle_delete_press)
+        self.root.bind("<Control-z>", lambda e: self.undo())
+        self.root.bind("<Control-y>", lambda e: self.redo())
+        self.root.bind("<Control-Z>", lambda e: self.redo())  # Ctrl+Shift+Z
+        self.root.bind("<Escape>", lambda e: self.cancel_bulk())
         self.progress_bar = ttk.Progressbar(self.grid_canvas, orient="horizontal", mode="determinate")
         self.progress_bar.pack(side="top", fill="x")
         self.progress_bar.pack_forget()
+        self.cancel_button = ttk.Button(self.grid_canvas, text="Cancel", command=self.cancel_bulk)
 
     def handle_delete_press(self, event):
         focused_widget = self.root.focus_get()
         # Check if the focused widget is not a text box
         if not isinstance(focused_widget, (tk.Entry, tk.Text)):
-            if self.selected_label:
-                self.delete_image(self.selected_label)
+            if self.selected_id is not None:
+                self.delete_image(self.selected_id)
 
     def handle_return_press(self, event):
         focused_widget = self.root.focus_get()
 
         # Check which widget is focused and perform the relevant action
         if focused_widget == self.pos_filter_entry or focused_widget == self.neg_filter_entry:
-            self.apply_filters()
+            self.view.mark("gallery")
         elif focused_widget == self.tag_entry:
             self.add_tag()
         elif focused_widget == self.remove_tag_entry:
@@ -207,7 +326,56 @@ class ImageGalleryApp:
         self.add_tag_entry()
         self.file_menu.add_checkbutton(label="Dark Mode", onvalue=True, offvalue=False, variable=self.dark_mode_enabled, command=self.toggle_dark_mode)
     
+    def setup_view(self):
+        # Handlers mark what they changed instead of repainting, see ViewModel. Tag counts are
+        # kept up to date by the dataset itself, a change to them only means the tag panel
+        # shows stale numbers.
+        self.view.register("tags", self.render_tag_panel)
+        self.view.register("frequencies", dependents=("tags",))
+        self.view.register("gallery", self.apply_filters)
+
+    def render_tag_panel(self):
+        if self.selected_id in self.dataset:
+            self.display_tags(self.dataset.paths[self.selected_id], self.count_tag_frequencies())
+        else:
+            self.clear_tags_frame()
+            self.tags_text.config(state='disabled')
+
+    def setup_autocomplete(self):
+        # Tag suggestions under the entry boxes. The scheme vocabularies are loaded the first
+        # time one of them gets focus, until then only the folder's own tags are suggested.
+        complete = lambda prefix: self.tag_completer.complete(self.dataset, prefix)
+        self.completion_popups = [
+            CompletionPopup(self.tag_entry, complete),
+            CompletionPopup(self.remove_tag_entry, complete),
+            CompletionPopup(self.pos_filter_entry, complete, quote_tag),
+            CompletionPopup(self.neg_filter_entry, complete, quote_tag),
+        ]
+        for popup in self.completion_popups:
+            popup.entry.bind("<FocusIn>", lambda e: self.load_completion_vocabularies(), add="+")
+
+    def load_completion_vocabularies(self):
+        if self.completion_loading:
+            return
+        self.completion_loading = True
+        paths = [path for path in self.color_schemes.values() if path and path.endswith('.csv')]
+        threading.Thread(target=self.load_completion_vocabularies_threaded, args=(paths,), daemon=True).start()
+
+    def load_completion_vocabularies_threaded(self, paths):
+        # Compiled into a memory-mapped prefix index under cache/ on first use, like the color schemes
+        from tag_completion import Vocabulary
+        vocabularies = []
+        for path in paths:
+            try:
+                vocabularies.append(Vocabulary.load(path, os.path.join('cache', 'completion')))
+            except Exception as e:
+                print(f"Error loading tag vocabulary '{path}': {e}")
+        self.scheduler.post(self.tag_completer.set_vocabularies, vocabularies)
+
     def apply_initial_settings(self, settings):
+        self.preview_cache = PreviewCache(max_bytes=settings.get('preview_cache_mb', 256) * 1024 * 1024)
+        self.preview_prefetch = settings.get('preview_prefetch', self.preview_prefetch)
+        self.history.depth = settings.get('undo_depth', self.history.depth)
         self.dark_mode_enabled.set(settings.get('dark_mode_enabled', False))
         last_color_scheme = settings.get('last_color_scheme', 'None')
         if self.dark_mode_enabled.get():
@@ -219,6 +387,20 @@ class ImageGalleryApp:
         self.color_schemes = {"None": None}  # Default option
         self.load_color_schemes()  # Load available color schemes
 
+    def quit(self):
+        self.save_manifest()
+        self.load_generation += 1  # Background work of the folder sees it's no longer wanted
+        if self.folder_monitor:
+            self.folder_monitor.stop()
+        self.caption_journal.close()  # Every pending caption is on disk before the window goes away
+        if self.thumbnail_pipeline:
+            self.thumbnail_pipeline.shutdown()
+        if self.thumbnail_cache:
+            self.thumbnail_cache.close()
+        self.preview_cache.shutdown()
+        self.tag_completer.set_vocabularies([])
+        self.root.quit()
+
     def clear_text_focus(self):
         self.root.focus_set()
 
@@ -226,86 +408,263 @@ class ImageGalleryApp:
         folder_path = filedialog.askdirectory()
         if folder_path:
             self.display_images(folder_path)
-            self.tag_map = {}  # Reset the tag map for the new folder
             # Update last opened folder in settings
             settings = self.load_settings()
             self.save_settings(settings)
 
-    def show_progress_bar(self):
+    def show_progress_bar(self, cancellable=False):
         self.progress_bar.pack(side="top", fill="x")
+        if cancellable:
+            self.cancel_button.pack(side="top", anchor="e")
     
     def hide_progress_bar(self):
         self.progress_bar.pack_forget()
+        self.cancel_button.pack_forget()
+
+    def set_progress(self, value, maximum):
+        # Called through scheduler.progress, so it runs at most once per tick
+        self.progress_bar["maximum"] = maximum
+        self.progress_bar["value"] = value
+
+    def run_bulk(self, image_ids, action, label, on_done=None):
+        # Runs a per-image tag edit over many images in two phases. First the new tags of
+        # every image are computed in memory as a scheduler task, the window keeps handling
+        # input between time slices. Then the changed captions are written by the caption
+        # journal's thread pool off the UI thread. Everything the action changes is recorded
+        # as one undo step named label, and the views are refreshed once after the first
+        # phase instead of by each action. Cancelling in either phase rolls the whole step
+        # back, a folder reload stops the task.
+        image_ids = list(image_ids)
+        generation = self.load_generation
+        total = len(image_ids)
+        transaction = self.history.begin(label)
+        cancel = threading.Event()
+        self.bulk_cancels.add(cancel)
+        self.caption_journal.hold()  # Nothing is written until every caption is computed
+        self.view.suspend()  # The views are repainted once the new tags are all in
+        self.update_edit_menu()
+
+        def task():
+            for done, image_id in enumerate(image_ids, 1):
+                if generation != self.load_generation or cancel.is_set():
+                    return
+                self.bulk_transaction = transaction
+                try:
+                    action(image_id)
+                finally:
+                    self.bulk_transaction = None
+                self.scheduler.progress(self.set_progress, done, total)
+                yield
+
+        def computed():
+            self.view.resume()
+            transaction.open = False
+            if not transaction:
+                self.history.discard(transaction)  # Nothing changed, no point in an undo step
+            if cancel.is_set() or generation != self.load_generation:
+                self.caption_journal.release()
+                finish(written=False)
+                return
+            threading.Thread(target=write, daemon=True).start()
+
+        def write():
+            progress = lambda done, count: self.scheduler.progress(self.set_progress, done, count)
+            written = self.caption_journal.flush(progress, cancel.is_set)
+            self.caption_journal.release()
+            self.scheduler.post(finish, written)
+
+        def finish(written):
+            self.bulk_cancels.discard(cancel)
+            if not self.bulk_cancels:
+                self.hide_progress_bar()
+            if not written and transaction and generation == self.load_generation:
+                # Cancelled: the edits made so far are undone, captions already written get
+                # their old text back
+                self.history.discard(transaction)
+                self.replay(transaction, forward=False)
+            self.update_edit_menu()
+            if on_done and generation == self.load_generation:
+                on_done()
+
+        self.show_progress_bar(cancellable=True)
+        self.scheduler.run_task(task(), computed)
+
+    def cancel_bulk(self):
+        for cancel in self.bulk_cancels:
+            cancel.set()
 
     def replace_underscores(self, image_path, tag):
-        if self.selected_label in self.tag_map:
-            tags = self.tag_map[self.selected_label]
+        if self.selected_id in self.dataset:
+            tags = self.dataset.get_tags(self.selected_id)
             updated_tags = [t.replace('_', ' ') if t == tag else t for t in tags]
 
             # Update the tag map
-            self.tag_map[self.selected_label] = updated_tags
-
-            # Update the tags file for the image
-            caption_path = image_path.rsplit('.', 1)[0] + '.txt'
-            if os.path.exists(caption_path):
-                with open(caption_path, 'w') as file:
-                    file.write(', '.join(updated_tags))
+            self.set_image_tags(self.selected_id, updated_tags)
 
             # Update the tags display
-            self.display_tags(image_path, self.count_tag_frequencies())
+            self.view.mark("tags")
+
+    def create_image_context_menu(self):
+        # One menu shared by every thumbnail and the preview, context_menu_id says which image it acts on
+        self.image_context_menu = tk.Menu(self.root, tearoff=0)
+        self.image_context_menu.add_command(label="Clear Filters", command=lambda: self.clear_filters())
+        self.image_context_menu.add_command(label="Delete Image", command=lambda: self.delete_image(self.context_menu_id))
+        self.image_context_menu.add_command(label="Sort Tags", command=lambda: self.sort_tags_selected())
+        self.image_context_menu.add_command(label="Open Image", command=lambda: self.open_in_default_app(self.dataset.paths[self.context_menu_id]))
+        self.image_context_menu.add_command(label="Open Caption File", command=lambda: self.open_caption_file(self.dataset.paths[self.context_menu_id]))
+        self.image_context_menu.add_command(label="Open Containing Folder", command=lambda: self.open_folder_in_default_app(self.dataset.paths[self.context_menu_id]))
+
+    def show_image_context_menu(self, image_id, event):
+        if image_id is None:
+            return
+        self.context_menu_id = image_id
+        self.image_context_menu.tk_popup(event.x_root, event.y_root)
 
-    def create_context_menu(self, label):
-        context_menu = tk.Menu(self.root, tearoff=0)
-        context_menu.add_command(label="Clear Filters", command=lambda: self.clear_filters())
-        context_menu.add_command(label="Delete Image", command=lambda: self.delete_image(label))
-        context_menu.add_command(label="Sort Tags", command=lambda: self.sort_tags_selected())
-        context_menu.add_command(label="Open Image", command=lambda: self.open_in_default_app(label.image_path))
-        context_menu.add_command(label="Open Caption File", command=lambda: self.open_caption_file(label.image_path))
-        context_menu.add_command(label="Open Containing Folder", command=lambda: self.open_folder_in_default_app(label.image_path))
-
-        return context_menu
-
-    def delete_image(self, label_to_delete):
-        # Get current index of the label to delete
-        if not self.image_labels:
+    def delete_image(self, image_id_to_delete):
+        # Get current index of the image to delete
+        if image_id_to_delete not in self.dataset:
             return
 
-        visible_labels = [label for label in self.image_labels if label.winfo_ismapped()]
+        visible_ids = self.gallery.items
 
-        if not visible_labels:
+        if not visible_ids:
             return
 
-        current_index = visible_labels.index(label_to_delete) if label_to_delete in visible_labels else -1
+        current_index = self.gallery.index_of(image_id_to_delete)
+        self.remove_image_files(image_id_to_delete)
 
+        # Select the next image
+        next_index = current_index + 1 if current_index < len(visible_ids) - 1 else current_index - 1
+        next_id = visible_ids[next_index] if 0 <= next_index < len(visible_ids) else None
+        self.selected_id = next_id  # Keeps the filter pass from jumping to the first image
+        self.view.mark("frequencies")
+        self.apply_filters(on_done=lambda: self.select_image(next_id))
+
+    def delete_images(self, image_ids):
+        for image_id in image_ids:
+            if image_id in self.dataset:
+                self.remove_image_files(image_id)
+        if self.selected_id not in self.dataset:
+            self.selected_id = None
+        self.view.mark("gallery", "frequencies")
+
+    def remove_image_files(self, image_id):
         # Delete the image and caption files
-        image_path = label_to_delete.image_path
+        image_path = self.dataset.paths[image_id]
         caption_path = image_path.rsplit('.', 1)[0] + '.txt'
         if os.path.exists(image_path):
             os.remove(image_path)
+        self.caption_journal.discard(caption_path)
         if os.path.exists(caption_path):
             os.remove(caption_path)
 
-        # Remove the label and rearrange the remaining labels
-        label_to_delete.grid_forget()
-        label_to_delete.destroy()
-        self.image_labels.remove(label_to_delete)
-        self.rearrange_labels()
+        # Drop the image from the gallery, the grid closes the gap on the next filter pass
+        self.dataset.remove_image(image_id)
+        self.preview_cache.discard(image_path)
+        self.thumbnails.pop(image_id, None)
+        self.thumbnail_photos.pop(image_id, None)
+        self.load_queue.discard(image_id)
+        self.metadata.discard(image_id)
+
+    def find_duplicate_images(self):
+        # Near duplicates by perceptual hash, see image_hash. The hashes are stored with the
+        # cached thumbnails, images without any (cached before hashes existed, or evicted)
+        # have their thumbnail decoded again first.
+        if not len(self.dataset) or self.thumbnail_pipeline is None:
+            messagebox.showinfo("Find Duplicate Images", "Open a folder first.")
+            return
+        threshold = simpledialog.askinteger("Find Duplicate Images", f"Maximum number of differing hash bits (0-{MAX_THRESHOLD}):",
+                                            initialvalue=6, minvalue=0, maxvalue=MAX_THRESHOLD, parent=self.root)
+        if threshold is None:
+            return
+        images = [(image_id, self.dataset.paths[image_id], self.file_stats.get(image_id)) for image_id in self.dataset.image_ids()]
+        cancel = threading.Event()
+        self.bulk_cancels.add(cancel)
+        self.show_progress_bar(cancellable=True)
+        threading.Thread(target=self.find_duplicates_threaded, args=(images, threshold, self.load_generation, cancel), daemon=True).start()
+
+    def find_duplicates_threaded(self, images, threshold, generation, cancel):
+        from image_hash import find_duplicates
+        cancelled = lambda: cancel.is_set() or generation != self.load_generation
+        hashes = self.thumbnail_cache.get_hashes((image_path, stats[1], stats[0]) for _, image_path, stats in images if stats)
+        missing = [image_path for _, image_path, _ in images if image_path not in hashes]
+        done = len(images) - len(missing)
+        for results in self.thumbnail_pipeline.run(missing, cancelled, need_info=True):
+            for image_path, mode, size, raw, blob, image_hashes, metadata in results:
+                if image_hashes:
+                    hashes[image_path] = image_hashes
+            done += len(results)
+            self.scheduler.progress(self.set_progress, done, len(images))
+        self.thumbnail_cache.flush()
+        if cancelled():
+            self.scheduler.post(self.show_duplicate_images, generation, cancel, None)
+            return
 
-        # Select the next image
-        # self.select_next_image_after_deletion(current_index)
-        next_index = current_index + 1 if current_index < len(visible_labels) - 1 else current_index - 1
-        self.select_image(None, visible_labels[next_index])
-        self.apply_filters()
-
-    def rearrange_labels(self):
-        # Rearrange the remaining labels to fill in the gap
-        row, col = 0, 0
-        for label in self.image_labels:
-            label.grid(row=row, column=col, padx=2, pady=2)
-            col += 1
-            if col >= 3:  # Assuming 3 columns, adjust as needed
-                col = 0
-                row += 1
+        hashed = [(image_id, hashes[image_path]) for image_id, image_path, _ in images if image_path in hashes]
+        clusters = find_duplicates([dhash for _, (dhash, _) in hashed], [phash for _, (_, phash) in hashed], threshold)
+        self.scheduler.post(self.show_duplicate_images, generation, cancel, [[hashed[i][0] for i in cluster] for cluster in clusters])
+
+    def show_duplicate_images(self, generation, cancel, clusters):
+        self.bulk_cancels.discard(cancel)
+        if not self.bulk_cancels:
+            self.hide_progress_bar()
+        if clusters is None or generation != self.load_generation:
+            return
+        clusters = [[image_id for image_id in cluster if image_id in self.dataset] for cluster in clusters]
+        clusters = [cluster for cluster in clusters if len(cluster) > 1]
+        if not clusters:
+            messagebox.showinfo("Find Duplicate Images", "No near duplicates found.")
+            return
+
+        # The largest file of a group is the one kept by default
+        file_size = lambda image_id: (self.file_stats.get(image_id) or (0,))[0]
+        for cluster in clusters:
+            cluster.sort(key=file_size, reverse=True)
+
+        def describe(image_id):
+            image_path = self.dataset.paths[image_id]
+            return f"{os.path.relpath(image_path, self.folder_path)}\n{file_size(image_id) / 1024:,.0f} KB"
+
+        def select(image_id):
+            if image_id in self.dataset and image_id in self.gallery.positions:
+                self.select_image(image_id)
+                self.gallery.scroll_to(image_id)
+
+        from duplicate_review import DuplicateReview
+        DuplicateReview(self.root, clusters, describe, self.get_thumbnail_photo, select, self.delete_images,
+                        title=f"Duplicate Images ({len(clusters)} groups)")
+
+    def show_aspect_histogram(self):
+        # Aspect ratio buckets of the images passing the current filter, double clicking one
+        # adds it to the positive filter
+        if self.metadata is None or not self.gallery.items:
+            messagebox.showinfo("Aspect Ratio Buckets", "Open a folder first.")
+            return
+        buckets, unknown = self.metadata.histogram(self.gallery.items)
+        largest = max(count for _, _, count in buckets) or 1
+
+        popup = tk.Toplevel(self.root)
+        popup.wm_title(f"Aspect Ratio Buckets ({len(self.gallery.items):,} images)")
+        listbox = tk.Listbox(popup, width=56, height=len(buckets) + 1, font=("Courier", 10))
+        listbox.pack(fill="both", expand=True)
+        for low, high, count in buckets:
+            label = f"{low:.2f}+" if high == float('inf') else f"{low:.2f}-{high:.2f}"
+            listbox.insert(tk.END, f"{label:>10} {count:>8,}  {'#' * round(30 * count / largest)}")
+        if unknown:
+            listbox.insert(tk.END, f"{'unknown':>10} {unknown:>8,}")
+
+        def filter_bucket(event):
+            selection = listbox.curselection()
+            if not selection or selection[0] >= len(buckets):
+                return
+            low, high, _ = buckets[selection[0]]
+            term = f"aspect>={low:.4g}" if high == float('inf') else f"aspect:{low:.4g}-{high:.4g}"
+            current_filter = self.pos_filter_entry.get()
+            self.pos_filter_entry.delete(0, tk.END)
+            self.pos_filter_entry.insert(0, f"{current_filter}, {term}" if current_filter else term)
+            self.view.mark("gallery")
+
+        listbox.bind("<Double-Button-1>", filter_bucket)
 
     def open_folder_in_default_app(self, path):
         if os.path.exists(path):
@@ -317,95 +676,407 @@ class ImageGalleryApp:
 
     def open_caption_file(self, image_path):
         caption_path = image_path.rsplit('.', 1)[0] + '.txt'
+        self.caption_journal.flush()  # The editor should see the latest edits
         if os.path.exists(caption_path):
             os.startfile(caption_path)
 
-    def display_images_threaded(self, folder_path):
-        self.scrollable_frame.after(0, self.show_progress_bar)
-        self.image_labels.clear()
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
+    def display_images_threaded(self, folder_path, generation):
+        # The folder is walked as a stream and every image is compared against the manifest
+        # of the previous load. Unchanged images get their tags from the manifest, new or
+        # changed ones have their caption read here. Either way they go into the grid right
+        # away, thumbnails are decoded separately through the load queue so the rows on
+        # screen come first, wherever the user scrolled or filtered to in the meantime.
+        # Image metadata is read from the thumbnail cache, images it has none for (or an
+        # entry from before metadata was stored) are queued for a decode as well.
+        started = time.perf_counter()
+        manifest = Manifest.load(folder_path, os.path.join('cache', 'manifests'))
+        entries = []  # For the new manifest
+        seen = stale = 0
+
+        def add_images(batch):
+            if generation != self.load_generation:
+                return  # A newer folder was opened in the meantime
+            requests = []
+            for image_path, stats, tags, cached, metadata in batch:
+                image_id = self.dataset.add_image(image_path, tags)
+                self.caption_ids[image_path.rsplit('.', 1)[0] + '.txt'] = image_id
+                self.file_stats[image_id] = stats
+                if metadata is not None:
+                    self.metadata.set(image_id, metadata)
+                if not cached or metadata is None:
+                    requests.append((image_id, image_path))
+                self.gallery.append(image_id)
+            self.request_thumbnails(requests)
+            self.scheduler.progress(self.update_load_progress, generation)
+
+        for chunk in iter_folder(folder_path):
+            if generation != self.load_generation:
+                return
+            batch = []
+            metadata = self.thumbnail_cache.get_metadata((entry[0], entry[2], entry[1]) for entry in chunk)
+            for entry in chunk:
+                tags = manifest.lookup(*entry)
+                cached = tags is not None
+                if not cached:
+                    tags = self.read_tags(entry[0])  # Off the UI thread, the caption may be on a slow share
+                    stale += 1
+                batch.append((entry[0], entry[1:], tags, cached, metadata.get(entry[0])))
+                entries.append(entry + (tags,))
+            seen += len(chunk)
+            self.scheduler.post(add_images, batch)
+
+        self.manifest_stats = {
+            "images": seen,
+            "from manifest": seen - stale,
+            "captions read": stale,
+            "load ms": round((time.perf_counter() - started) * 1000),
+        }
+        try:
+            manifest.save(entries)
+        except OSError as e:
+            print(f"Error saving manifest for '{folder_path}': {e}")
+        self.scheduler.post(self.set_manifest, manifest, generation)
+        self.scheduler.post(self.start_folder_monitor, folder_path, generation)
+        self.scheduler.post(self.finish_folder_walk, generation)
+
+    def finish_folder_walk(self, generation):
+        if generation == self.load_generation:
+            self.folder_walked = True
+            self.update_load_progress(generation)
+            self.view.mark("frequencies")
+            self.build_cooccurrence()
+
+    def build_cooccurrence(self):
+        # Tag co-occurrence counts for the suggestions under the tag panel, see
+        # tag_cooccurrence. The tags are copied here and counted on a worker thread, edits made
+        # meanwhile are recorded by the new object already and added once the counts arrive.
+        from tag_cooccurrence import Cooccurrence, snapshot
+        cooccurrence = self.dataset.cooccurrence = Cooccurrence()
+        args = (cooccurrence, snapshot(self.dataset), self.load_generation)
+        threading.Thread(target=self.build_cooccurrence_threaded, args=args, daemon=True).start()
+
+    def build_cooccurrence_threaded(self, cooccurrence, tags, generation):
+        from tag_cooccurrence import count_pairs
+        started = time.perf_counter()
+        try:
+            matrix = count_pairs(*tags)
+        except MemoryError as e:
+            print(f"Error counting tag co-occurrences: {e}")
+            return
+        self.scheduler.post(self.set_cooccurrence, cooccurrence, matrix, round((time.perf_counter() - started) * 1000), generation)
 
-        images = self.gather_images(folder_path)
-        total_images = len(images)
-        
-        def update_progress(value):
-            self.progress_bar["value"] = value
-            self.progress_bar["maximum"] = total_images
-            self.progress_bar.update_idletasks()
-
-        def add_image_label(i, img, image_path, row, col):
-            label = tk.Label(self.scrollable_frame, image=img, borderwidth=2, relief="flat", highlightthickness=2, highlightbackground="black")
-            label.image = img
-            label.image_path = image_path
-            label.grid(row=row, column=col, padx=2, pady=2)
-            label.bind("<Button-1>", lambda e, path=image_path: self.select_image(e, path))
-
-            # Bind the context menu
-            context_menu = self.create_context_menu(label)
-            label.bind("<Button-3>", lambda e: context_menu.tk_popup(e.x_root, e.y_root))
-
-            self.image_labels.append(label)
-
-            # Read tags and store in the tag map
-            tags = self.read_tags(image_path)
-            self.tag_map[label] = tags
-
-        row, col = 0, 0
-        for i, image_file in enumerate(images):
-            image_path = os.path.join(folder_path, image_file)
-            img = Image.open(image_path)
-            img.thumbnail((120, 120))
-            img = ImageTk.PhotoImage(img)
-
-            self.scrollable_frame.after(0, lambda i=i, img=img, image_path=image_path, row=row, col=col: add_image_label(i, img, image_path, row, col))
-            self.scrollable_frame.after(0, lambda idx=i: update_progress(idx + 1))
-
-            col += 1
-            if col >= 3:
-                col = 0
-                row += 1
-
-        self.scrollable_frame.after(0, self.hide_progress_bar)
-    
-    def gather_images(self, folder_path):
-        all_images = []
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                if file.endswith(('.png', '.jpg', '.jpeg')):
-                    all_images.append(os.path.join(root, file))
-        return all_images
-
-    def load_image(self, folder_path, image_file, row, col, current_index, total_images):
-        image_path = os.path.join(folder_path, image_file)
-        img = Image.open(image_path)
-        img.thumbnail((100, 100))  # Set thumbnail size
-        img = ImageTk.PhotoImage(img)
-    
-        def add_image_label():
-            label = tk.Label(self.scrollable_frame, image=img, borderwidth=2, relief="flat")
-            label.image = img  # Keep a reference
-            label.image_path = image_path  # Store the image path
-            label.grid(row=row, column=col, padx=5, pady=5, sticky='nsew')
-    
-            label.bind("<Button-1>", lambda e, path=image_path: self.select_image(e, path))
-            self.image_labels.append(label)
+    def set_cooccurrence(self, cooccurrence, matrix, build_ms, generation):
+        if generation == self.load_generation and self.dataset.cooccurrence is cooccurrence:
+            cooccurrence.set_matrix(*matrix, build_ms=build_ms)
+            self.view.mark("tags")
+
+    def update_load_progress(self, generation):
+        # The bar counts images with their thumbnail done (or not needed yet) and stays up
+        # until the walk is over and the load queue has drained
+        if generation != self.load_generation or self.folder_walked is None:
+            return
+        total = len(self.dataset)
+        self.set_progress(total - len(self.load_queue), total)
+        if self.folder_walked and not self.load_queue:
+            self.folder_walked = None  # Done, later decodes of single rows leave the bar alone
+            self.hide_progress_bar()
+
+    def set_manifest(self, manifest, generation):
+        if generation == self.load_generation:
+            self.manifest = manifest
+
+    def save_manifest(self):
+        # The manifest written at load time goes stale for every caption edited since, those
+        # would be read again on the next open. Restat just those and save it again.
+        if self.manifest is None or not self.manifest_dirty:
+            return
+        self.caption_journal.flush()
+        for image_id in self.manifest_dirty:
+            if image_id in self.dataset:
+                self.file_stats[image_id] = stat_files(self.dataset.paths[image_id]) or self.file_stats.get(image_id)
+        self.manifest_dirty = set()
+        paths, get_tags = self.dataset.paths, self.dataset.get_tags
+        entries = [(paths[image_id],) + self.file_stats[image_id] + (get_tags(image_id),)
+                   for image_id in self.dataset.image_ids() if self.file_stats.get(image_id)]
+        try:
+            self.manifest.save(entries)
+        except OSError as e:
+            print(f"Error saving manifest: {e}")
+
+    def start_folder_monitor(self, folder_path, generation):
+        if generation != self.load_generation:
+            return
+        on_changes = lambda paths: self.read_folder_changes(paths, generation)
+        self.folder_monitor = FolderMonitor(folder_path, IMAGE_EXTENSIONS + ('.txt',), on_changes).start()
+
+    def read_folder_changes(self, paths, generation):
+        # Runs on the monitor thread: everything that touches the disk happens here, the
+        # dataset itself is only changed by apply_folder_changes on the main thread
+        if generation != self.load_generation:
+            return
+        if paths is None:
+            paths = self.rescan_folder(generation)
+            if paths is None:
+                return
+        images = [path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS)]
+        removed = [path for path in images if not os.path.exists(path)]
+        present = [path for path in images if os.path.exists(path)]
+
+        # Captions of known images that changed on their own, captions of new images are read
+        # below. The journal's own writes show up here too and are skipped, each caption read
+        # carries the journal version it was read at, see apply_caption_changes.
+        captions = {}
+        for path in paths:
+            image_id = self.caption_ids.get(path) if path.endswith('.txt') else None
+            if image_id is None:
+                continue
+            if generation != self.load_generation:
+                return
+            version = self.caption_journal.version(path)
+            try:
+                stat = os.stat(path)
+                if self.caption_journal.own_write(path, (stat.st_mtime_ns, stat.st_size)):
+                    continue
+            except OSError:
+                pass  # Deleted, read_tags gives the image no tags
+            captions[image_id] = (self.read_tags(self.dataset.paths[image_id]), version)
+
+        # Rewritten or new images get their thumbnail decoded again, the cache key includes the mtime
+        updated = []
+        for results in self.thumbnail_pipeline.run(present, lambda: generation != self.load_generation, need_info=True):
+            updated.extend((image_path, self.read_tags(image_path), blob, metadata) for image_path, mode, size, raw, blob, hashes, metadata in results)
+        self.thumbnail_cache.flush()
+        self.scheduler.post(self.apply_folder_changes, generation, removed, updated, captions)
+
+    def rescan_folder(self, generation):
+        # Events were lost: a fresh walk compared with the stats of the loaded files gives the
+        # images and captions that were added, removed or changed since, or None if the
+        # folder was closed meanwhile. Captions the journal wrote show up as changed here,
+        # read_folder_changes skips them. dict.copy() is a single C call, safe to make from
+        # this thread while the main thread keeps changing the dicts.
+        known_stats = self.file_stats.copy()
+        known_ids = self.dataset.ids.copy()
+        known_paths = list(self.dataset.paths)  # Only ever grows
+        current = {}
+        for chunk in iter_folder(self.folder_path):
+            if generation != self.load_generation:
+                return None
+            current.update((entry[0], entry[1:]) for entry in chunk)
+
+        paths = {image_path for image_path in current if image_path not in known_ids}  # New
+        for image_path, image_id in known_ids.items():
+            stats, fresh = known_stats.get(image_id), current.get(image_path)
+            if fresh is None:
+                paths.add(image_path)  # Removed
+                continue
+            if stats is None or fresh[:2] != stats[:2]:
+                paths.add(image_path)
+            if stats is None or fresh[2:] != stats[2:]:
+                paths.add(known_paths[image_id].rsplit('.', 1)[0] + '.txt')
+        return paths
+
+    def apply_folder_changes(self, generation, removed, updated, captions):
+        if generation != self.load_generation:
+            return
+        changed = False  # Images came or went, the filter has to run again
+        for image_path in removed:
+            image_id = self.dataset.image_id(image_path)
+            if image_id is not None:
+                self.dataset.remove_image(image_id)
+                self.caption_ids.pop(image_path.rsplit('.', 1)[0] + '.txt', None)
+                self.thumbnails.pop(image_id, None)
+                self.thumbnail_photos.pop(image_id, None)
+                self.load_queue.discard(image_id)
+                self.metadata.discard(image_id)
+                self.preview_cache.discard(image_path)
+                changed = True
+
+        for image_path, tags, blob, metadata in updated:
+            image_id = self.dataset.image_id(image_path)
+            if image_id is None:
+                image_id = self.dataset.add_image(image_path, tags)
+                self.caption_ids[image_path.rsplit('.', 1)[0] + '.txt'] = image_id
+                changed = True
+            self.thumbnails[image_id] = blob
+            if metadata is not None:
+                self.metadata.set(image_id, metadata)
+            self.thumbnail_photos.pop(image_id, None)
+            self.load_queue.discard(image_id)
+            self.load_queue.retry(image_id)
+            self.preview_cache.discard(image_path)
+            self.gallery.invalidate(image_id)
+            self.manifest_dirty.add(image_id)
+
+        if captions:
+            # A bulk edit or undo that's still running would have its steps recorded against
+            # tags changed under it, the captions wait until it's done
+            self.scheduler.after_tasks(self.apply_caption_changes, generation, captions)
+        if changed:
+            self.view.mark("gallery", "frequencies")
+        if self.selected_id in self.dataset:
+            image_path = self.dataset.paths[self.selected_id]
+            if any(path == image_path for path, _, _, _ in updated):
+                self.show_preview(self.selected_id)
     
-        self.scrollable_frame.after(0, add_image_label)
+    def apply_caption_changes(self, generation, captions):
+        if generation != self.load_generation:
+            return
+        retagged = False
+        for image_id, (tags, version) in captions.items():
+            if image_id not in self.dataset:
+                continue
+            caption_path = self.dataset.paths[image_id].rsplit('.', 1)[0] + '.txt'
+            if self.caption_journal.version(caption_path) != version or self.caption_journal.pending(caption_path) is not None:
+                continue  # Edited here since it was read, or our edit is about to overwrite the file anyway
+            self.manifest_dirty.add(image_id)
+            if tags != self.dataset.get_tags(image_id):
+                self.dataset.set_tags(image_id, tags)
+                retagged = True
+
+        if retagged:
+            # Recorded deltas can't be replayed on top of tags changed behind our back
+            self.history.clear()
+            self.update_edit_menu()
+            self.view.mark("gallery", "frequencies")
+
+    def get_thumbnail_photo(self, image_id):
+        # PhotoImages only exist for recently shown thumbnails, the grid asks for them as slots get bound
+        photo = self.thumbnail_photos.get(image_id)
+        if photo is not None:
+            self.thumbnail_photos.move_to_end(image_id)
+            return photo
+        data = self.thumbnails.get(image_id)
+        if data is None:
+            data = self.load_cached_thumbnail(image_id)
+            if data is None:
+                return None
+        from PIL import ImageTk
+        from thumbnail_cache import ThumbnailCache
+        photo = ImageTk.PhotoImage(ThumbnailCache.decode(data))
+        self.cache_thumbnail_photo(image_id, photo)
+        return photo
+
+    def load_cached_thumbnail(self, image_id):
+        # Images served from the manifest only fetch their thumbnail once they're shown. A
+        # cache miss (evicted, or the cache was deleted) is decoded in the background.
+        stats = self.file_stats.get(image_id)
+        if stats is None or image_id not in self.dataset or image_id in self.load_queue:
+            return None
+        image_path = self.dataset.paths[image_id]
+        data = self.thumbnail_cache.get(image_path, stats[1], stats[0])
+        if data is not None:
+            self.thumbnails[image_id] = data
+            return data
+        self.request_thumbnails([(image_id, image_path)])
+        return None
+
+    def request_thumbnails(self, requests):
+        # Queues (image id, path) pairs for decoding, the order they're decoded in is up to the load queue
+        with self.thumbnail_request_lock:
+            for image_id, image_path in requests:
+                self.load_queue.add(image_id, image_path)
+            if self.thumbnail_request_thread is None and self.load_queue:
+                self.thumbnail_request_thread = threading.Thread(target=self.decode_requested_thumbnails, args=(self.load_queue, self.load_generation), daemon=True)
+                self.thumbnail_request_thread.start()
+
+    def decode_requested_thumbnails(self, load_queue, generation):
+        # Paths are pulled from the queue only when the pipeline has room for another small
+        # batch, so after a scroll or a filter change the next decodes are already the new
+        # rows on screen, with just a few batches in flight ahead of them
+        cancelled = lambda: generation != self.load_generation
+        pipeline = self.thumbnail_pipeline
+        batch_size = 4
+        sent = deque()  # (image id, path) in the order the pipeline got them
+
+        def requested_paths():
+            while not cancelled():
+                requests = load_queue.take(pipeline.workers)
+                if not requests:
+                    return
+                for request in requests:
+                    sent.append(request)
+                    yield request[1]
+
+        while True:
+            with self.thumbnail_request_lock:
+                if not load_queue or cancelled():
+                    if self.thumbnail_request_thread is threading.current_thread():
+                        self.thumbnail_request_thread = None
+                    self.thumbnail_cache.flush()
+                    return
+            for results in pipeline.run(requested_paths(), cancelled, batch_size, pipeline.workers + 1, need_info=True):
+                batch = [sent.popleft() for _ in range(min(batch_size, len(sent)))]
+                decoded = {image_path: result for image_path, *result in results}
+                thumbnails = []
+                for image_id, image_path in batch:
+                    result = decoded.get(image_path)
+                    if result is None:
+                        load_queue.mark_failed(image_id)  # Not retried every time its row is shown
+                    else:
+                        thumbnails.append((image_id,) + tuple(result))
+                self.scheduler.post(self.set_thumbnails, generation, thumbnails)
+                self.scheduler.progress(self.update_load_progress, generation)
+
+    def set_thumbnails(self, generation, thumbnails):
+        if generation != self.load_generation:
+            return
+        from PIL import ImageTk
+        from thumbnail_loader import buffer_to_image
+        for image_id, mode, size, raw, blob, hashes, metadata in thumbnails:
+            if image_id not in self.dataset:
+                continue  # Deleted while it was decoding
+            self.thumbnails[image_id] = blob
+            if metadata is not None:
+                self.metadata.set(image_id, metadata)
+            self.thumbnail_photos.pop(image_id, None)
+            # Freshly decoded thumbnails that are on screen skip the blob decode
+            if raw is not None and self.gallery.is_live_index(self.gallery.index_of(image_id)):
+                self.cache_thumbnail_photo(image_id, ImageTk.PhotoImage(buffer_to_image(mode, size, raw)))
+            self.gallery.invalidate(image_id)
+
+    def cache_thumbnail_photo(self, image_id, photo):
+        self.thumbnail_photos[image_id] = photo
+        while len(self.thumbnail_photos) > self.thumbnail_photo_limit:
+            self.thumbnail_photos.popitem(last=False)
 
     def display_images(self, folder_path):
+        # Reset everything that belongs to the previous folder
+        self.caption_journal.flush()  # Captions are read back from disk below
+        self.save_manifest()
+        self.load_generation += 1  # Before stopping the monitor, a burst it's handling gives up
+        if self.folder_monitor:
+            self.folder_monitor.stop()
+            self.folder_monitor = None
+        self.folder_path = folder_path
+        self.folder_walked = False
+        self.dataset = Dataset()
+        self.caption_ids = {}
+        self.file_stats = {}
+        self.manifest = None
+        self.manifest_dirty = set()
+        with self.thumbnail_request_lock:
+            self.load_queue = LoadQueue()
+            self.thumbnail_request_thread = None  # A running one stops by itself, its generation is stale
+        self.history.clear()  # Deltas refer to image and tag ids of the old dataset
+        self.update_edit_menu()
+        self.preview_cache.clear()
+        self.thumbnails = {}
+        self.thumbnail_photos.clear()
+        self.selected_id = None
+        self.gallery.clear()
+        self.view.mark("tags")
+        self.show_progress_bar()
+        if self.thumbnail_cache is None:
+            from thumbnail_cache import ThumbnailCache
+            from thumbnail_loader import ThumbnailPipeline
+            cache_mb = self.load_settings().get('thumbnail_cache_mb', 512)
+            self.thumbnail_cache = ThumbnailCache(os.path.join('cache', 'thumbnails.sqlite'), max_bytes=cache_mb * 1024 * 1024)
+            self.thumbnail_pipeline = ThumbnailPipeline(self.thumbnail_cache)
+        from image_metadata import ImageMetadata
+        self.metadata = ImageMetadata()
+
         # Start the threaded image loading
-        threading.Thread(target=self.display_images_threaded, args=(folder_path,), daemon=True).start()
-    
-        # Calculate the number of rows based on the number of images and columns
-        images = [f for f in os.listdir(folder_path) if f.endswith(('.png', '.jpg', '.jpeg'))]
-        num_rows = (len(images) + 2) // 3  # Assuming 3 columns, adjust '+ 2' for rounding up
-    
-        # Configure grid columns and rows to not resize
-        for i in range(3):  # Assuming 3 columns
-            self.scrollable_frame.grid_columnconfigure(i, weight=0, uniform="col")
-        for i in range(num_rows):
-            self.scrollable_frame.grid_rowconfigure(i, weight=0, uniform="row")
+        threading.Thread(target=self.display_images_threaded, args=(folder_path, self.load_generation), daemon=True).start()
 
     def _on_mousewheel(self, event):
         if not (event.state & 0x0004):  # Check if Control key is not pressed
@@ -433,158 +1104,192 @@ class ImageGalleryApp:
         if isinstance(self.root.focus_get(), tk.Entry) or isinstance(self.root.focus_get(), tk.Text):
             return  # Do nothing if a text box is focused
 
-        if not self.image_labels:
-            return
-
-        visible_labels = [label for label in self.image_labels if label.winfo_ismapped()]
+        visible_ids = self.gallery.items
 
-        if not visible_labels:
+        if not visible_ids:
             return
 
-        current_index = visible_labels.index(self.selected_label) if self.selected_label in visible_labels else -1
-        row_length = 3  # Adjust based on your column configuration
+        current_index = self.gallery.index_of(self.selected_id)
+        row_length = self.gallery.columns
 
         new_index = current_index
-        while True:
-            if direction == "left" and new_index > 0:
-                new_index -= 1
-            elif direction == "right" and new_index < len(visible_labels) - 1:
-                new_index += 1
-            elif direction == "up" and new_index >= row_length:
-                new_index -= row_length
-            elif direction == "down" and new_index + row_length < len(visible_labels):
-                new_index += row_length
-            else:
-                break  # Stop if no more images in the direction or at the edges
-
-            # Check if the new index points to a visible image
-            if visible_labels[new_index].winfo_ismapped():
-                break
+        if direction == "left" and new_index > 0:
+            new_index -= 1
+        elif direction == "right" and new_index < len(visible_ids) - 1:
+            new_index += 1
+        elif direction == "up" and new_index >= row_length:
+            new_index -= row_length
+        elif direction == "down" and new_index + row_length < len(visible_ids):
+            new_index += row_length
 
         if new_index != current_index:
-            self.select_image(None, visible_labels[new_index])
+            self.select_image(visible_ids[new_index])
 
             # After updating the selection:
-            self.scroll_to_label(self.selected_label)
-
-    def scroll_to_label(self, label):
-        self.scrollable_frame.update_idletasks()  # Update layout
-        if not label.winfo_ismapped():
-            return  # Skip if the label is not visible
-        self.scrollable_frame.update_idletasks()  # Update layout
-        label_x, label_y = label.winfo_x(), label.winfo_y()  # Get label position within frame
-        label_width, label_height = label.winfo_width(), label.winfo_height()  # Get label size
-    
-        # Get the visible area of the canvas
-        canvas_x1 = self.grid_canvas.canvasx(0)
-        canvas_y1 = self.grid_canvas.canvasy(0)
-        canvas_x2 = canvas_x1 + self.grid_canvas.winfo_width()
-        canvas_y2 = canvas_y1 + self.grid_canvas.winfo_height()
-    
-        # Determine if scrolling is needed
-        scroll_x, scroll_y = None, None
-        if label_x < canvas_x1:
-            scroll_x = label_x
-        elif label_x + label_width > canvas_x2:
-            scroll_x = label_x + label_width - self.grid_canvas.winfo_width()
-    
-        if label_y < canvas_y1:
-            scroll_y = label_y
-        elif label_y + label_height > canvas_y2:
-            scroll_y = label_y + label_height - self.grid_canvas.winfo_height()
-    
-        # Perform the scrolling if needed
-        if scroll_x is not None:
-            self.grid_canvas.xview_moveto(scroll_x / self.scrollable_frame.winfo_width())
-        if scroll_y is not None:
-            self.grid_canvas.yview_moveto(scroll_y / self.scrollable_frame.winfo_height())
-
+            self.gallery.scroll_to(self.selected_id)
 
-    def select_image(self, event, image_or_path):
+    def select_image(self, image_id):
         self.clear_text_focus()
 
-        # Clear the highlight from the previously selected image
-        if self.selected_label and self.selected_label in self.image_labels:
-            self.selected_label.config(highlightthickness=2, highlightbackground="black")
-        
-        # Determine the new selected label and image path
-        if event:
-            new_selected_label = event.widget
-            image_path = event.widget.image_path
-        elif isinstance(image_or_path, tk.Label):
-            new_selected_label = image_or_path
-            image_path = image_or_path.image_path
-        else:
-            return
-        
-        # Check if the new selected label is valid and exists in the image_labels list
-        if new_selected_label in self.image_labels:
-            self.selected_label = new_selected_label
-            # Highlight the newly selected label
-            self.selected_label.config(highlightthickness=2, highlightbackground="yellow")
+        # Check if the new selection is valid and still part of the gallery
+        if image_id in self.dataset:
+            self.selected_id = image_id
+            # Highlight the newly selected thumbnail and clear the previous one
+            self.gallery.set_selected(image_id)
     
-            # Resize and display the selected image
-            large_img = Image.open(image_path)
-            large_img.thumbnail((512, 512), Image.Resampling.LANCZOS)
-            large_img = ImageTk.PhotoImage(large_img)
-            self.preview_image_label.config(image=large_img)
-            self.preview_image_label.image = large_img
-        
-            # Bind the context menu to the preview image
-            context_menu = self.create_context_menu(self.selected_label)
-            self.preview_image_label.bind("<Button-3>", lambda e: context_menu.tk_popup(e.x_root, e.y_root))
+            # Resize and display the selected image, decoding happens off the UI thread
+            self.show_preview(image_id)
 
             # Update the tags display
-            self.display_tags(image_path, self.count_tag_frequencies())
+            self.view.mark("tags")
         else:
-            # The selected label is no longer valid, likely due to new folder loading
-            self.selected_label = None
-
-    def process_selection(self, event, image_or_path):
-        with self.selection_lock:
-            # Clear the border from the previously selected image
-            if self.selected_label is not None:
-                self.selected_label.config(borderwidth=0, relief="flat")
-    
-            # Determine the new selected label and image path
-            if event:
-                self.selected_label = event.widget
-                image_path = event.widget.image_path
-            elif isinstance(image_or_path, tk.Label):
-                self.selected_label = image_or_path
-                image_path = image_or_path.image_path
-            else:
-                return
-    
-            # Highlight the newly selected label
-            if self.selected_label:
-                self.selected_label.config(borderwidth=5, relief="solid", highlightbackground="yellow")
-    
-            # Resize and display the selected image
-            large_img = Image.open(image_path)
-            large_img.thumbnail((512, 512), Image.Resampling.LANCZOS)
-            large_img = ImageTk.PhotoImage(large_img)
-            self.preview_image_label.config(image=large_img)
-            self.preview_image_label.image = large_img
-    
-            # Update the tags display
-            self.display_tags(image_path, self.count_tag_frequencies())
+            # The selected image is no longer valid, likely due to new folder loading
+            self.selected_id = None
+            self.gallery.set_selected(None)
+
+    def show_preview(self, image_id):
+        self.preview_generation += 1
+        generation = self.preview_generation
+        image_path = self.dataset.paths[image_id]
+        if self.preview_settle_job:
+            self.root.after_cancel(self.preview_settle_job)
+            self.preview_settle_job = None
+
+        # Usually already decoded by the prefetch
+        img = self.preview_cache.get(image_path)
+        if img is not None:
+            self.set_preview_image(img)
+            self.prefetch_previews(image_id)
+            return
+
+        # Blown up thumbnail right away, then a fast draft decode for JPEGs
+        data = self.thumbnails.get(image_id)
+        if data is not None:
+            from PIL import Image
+            from thumbnail_cache import ThumbnailCache
+            placeholder = ThumbnailCache.decode(data)
+            scale = min(512 / placeholder.width, 512 / placeholder.height)
+            self.set_preview_image(placeholder.resize((max(int(placeholder.width * scale), 1), max(int(placeholder.height * scale), 1)), Image.Resampling.BILINEAR))
+        if image_path.lower().endswith(('.jpg', '.jpeg')):
+            self.preview_cache.request(image_path, generation, self.on_preview_decoded, fast=True)
+
+        # Only the selection the user stops on pays for the LANCZOS decode
+        self.preview_settle_job = self.root.after(self.preview_settle_ms, lambda: self.settle_preview(image_path, generation))
+
+    def settle_preview(self, image_path, generation):
+        self.preview_settle_job = None
+        if generation == self.preview_generation:
+            self.preview_cache.request(image_path, generation, self.on_preview_decoded)
+
+    def on_preview_decoded(self, img, generation, fast):
+        # Called from the preview worker thread
+        self.scheduler.post(self.apply_decoded_preview, img, generation, fast)
+
+    def apply_decoded_preview(self, img, generation, fast):
+        if generation != self.preview_generation:
+            return
+        self.set_preview_image(img)
+        if not fast and self.selected_id is not None:
+            self.prefetch_previews(self.selected_id)
+
+    def set_preview_image(self, img):
+        from PIL import ImageTk
+        large_img = ImageTk.PhotoImage(img)
+        self.preview_image_label.config(image=large_img)
+        self.preview_image_label.image = large_img
+
+    def prefetch_previews(self, image_id):
+        # Decode the next and previous few images of the current gallery order in the background
+        items = self.gallery.items
+        index = self.gallery.index_of(image_id)
+        if index < 0:
+            return
+        neighbours = []
+        for distance in range(1, self.preview_prefetch + 1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < len(items):
+                    neighbours.append(self.dataset.paths[items[neighbour]])
+        # Up/Down jump a whole row, so the images straight above and below are worth having too
+        for neighbour in (index + self.gallery.columns, index - self.gallery.columns):
+            if 0 <= neighbour < len(items) and self.dataset.paths[items[neighbour]] not in neighbours:
+                neighbours.append(self.dataset.paths[items[neighbour]])
+        self.preview_cache.prefetch(neighbours)
 
     def clear_tags_frame(self):
         self.tags_text.config(state='normal')  # Enable editing to clear
         self.tags_text.delete('1.0', 'end')  # Delete all contents
 
     def remove_tag_from_tags_frame(self, image_path, tag_to_remove):
-        if self.selected_label in self.tag_map:
-            tags = self.tag_map[self.selected_label]
+        if self.selected_id in self.dataset:
+            tags = self.dataset.get_tags(self.selected_id)
             tags = [tag for tag in tags if tag != tag_to_remove]
-            self.tag_map[self.selected_label] = tags
-            
-            caption_path = image_path.rsplit('.', 1)[0] + '.txt'
-            if os.path.exists(caption_path):
-                with open(caption_path, 'w') as file:
-                    file.write(', '.join(tags))
-            self.display_tags(image_path, self.count_tag_frequencies())
+            self.set_image_tags(self.selected_id, tags)
+            self.view.mark("tags")
+
+    def set_image_tags(self, image_id, tags):
+        # Every tag change goes through here, the dataset keeps its tag index and frequencies in
+        # sync and the caption journal writes the new caption in the background. Unchanged tags
+        # don't touch the disk, so sorting an image without a caption doesn't create one.
+        if image_id not in self.dataset or self.dataset.get_tags(image_id) == tags:
+            return
+        old_ids = self.dataset.tag_ids(image_id)
+        self.dataset.set_tags(image_id, tags)
+        self.record_edit(image_id, old_ids)
+        self.write_caption(image_id)
+        self.view.mark("frequencies")
+
+    def write_caption(self, image_id):
+        self.manifest_dirty.add(image_id)
+        caption_path = self.dataset.paths[image_id].rsplit('.', 1)[0] + '.txt'
+        self.caption_journal.mark(caption_path, ', '.join(self.dataset.get_tags(image_id)))
+
+    def record_edit(self, image_id, old_ids):
+        # Bulk actions record into their own transaction, anything else is an undo step of its own
+        transaction = self.bulk_transaction
+        if transaction is None:
+            transaction = self.history.begin("Edit Tags")
+            transaction.open = False
+        transaction.record(image_id, old_ids, self.dataset.tag_ids(image_id))
+        if transaction is not self.bulk_transaction:
+            self.update_edit_menu()
+
+    def undo(self):
+        if not self.replaying and self.history.can_undo():
+            self.replay(self.history.undo(), forward=False)
+
+    def redo(self):
+        if not self.replaying and self.history.can_redo():
+            self.replay(self.history.redo(), forward=True)
+
+    def replay(self, transaction, forward):
+        # Applies the recorded deltas to the affected images only, their captions go through
+        # the journal like any other edit
+        generation = self.load_generation
+        total = len(transaction)
+        self.replaying = True
+        self.view.suspend()
+
+        def task():
+            for done, (image_id, delta) in enumerate(transaction.steps(forward), 1):
+                if generation != self.load_generation:
+                    return
+                if image_id in self.dataset:
+                    self.dataset.set_tag_ids(image_id, apply_delta(delta, self.dataset.tag_ids(image_id), forward))
+                    self.write_caption(image_id)
+                self.scheduler.progress(self.set_progress, done, total)
+                yield
+
+        def finish():
+            self.replaying = False
+            self.hide_progress_bar()
+            self.update_edit_menu()
+            if generation == self.load_generation:
+                self.view.mark("frequencies")
+            self.view.resume()
+
+        self.update_edit_menu()
+        self.show_progress_bar()
+        self.scheduler.run_task(task(), finish)
 
     def read_tags(self, image_path):
         caption_path = image_path.rsplit('.', 1)[0] + '.txt'
@@ -594,45 +1299,103 @@ class ImageGalleryApp:
         return []
 
     def display_tags(self, image_path, tag_freq):
-        pos_filter_tags = set(self.pos_filter_entry.get().split(','))
-        
-        tags = self.tag_map.get(self.selected_label, [])
+        # Rebuilds the tag view with a single insert of styled text ranges
+        pos_terms = self.filter_terms(self.pos_filter_entry)
+        neg_terms = self.filter_terms(self.neg_filter_entry)
+        hide_non_filtered = self.hide_non_filtered_tags.get()
+        dark_mode = self.dark_mode_enabled.get()
+
+        tags = self.dataset.get_tags(self.selected_id)
         self.clear_tags_frame()
 
-        tag_labels = []  # Store labels for delayed binding
+        # Tags this image probably lacks and the ones that rarely go with the rest of its
+        # tags. Once a bulk edit made the co-occurrence counts stale they're rebuilt, the
+        # panel shows none until then.
+        suggestions, suspects = [], set()
+        cooccurrence = self.dataset.cooccurrence
+        if cooccurrence is not None and cooccurrence.ready:
+            if cooccurrence.stale:
+                self.build_cooccurrence()
+            else:
+                suggestions, suspect_ids = cooccurrence.suggest(self.dataset.tag_ids(self.selected_id))
+                suspects = {self.dataset.vocabulary[tag_id] for tag_id in suspect_ids}
+
+        self.displayed_tags = []
+        chunks = []  # Alternating text and text tag tuples for Text.insert
         for tag in tags:
-            if self.hide_non_filtered_tags.get():
-                pos_filters = [tag.strip() for tag in self.pos_filter_entry.get().split(',') if tag.strip()]
-                neg_filters = [tag.strip() for tag in self.neg_filter_entry.get().split(',') if tag.strip()]
-                if (pos_filters and tag not in pos_filters) or (neg_filters and tag in neg_filters):
+            in_pos_filter = any(term_matches(term, tag) for term in pos_terms)
+            if hide_non_filtered:
+                if (pos_terms and not in_pos_filter) or any(term_matches(term, tag) for term in neg_terms):
                     continue
 
             normalized_tag = tag.replace('_', ' ')
             freq = tag_freq.get(normalized_tag, 0)
             tag_color = self.tag_colors.get(normalized_tag, "black")
-            btn_fg = "white" if self.dark_mode_enabled.get() and tag_color == "black" else tag_color
-            btn_bg = "gray25" if self.dark_mode_enabled.get() else "SystemButtonFace"
-
-            # Define a bold font
-            bold_font = font.Font(weight="bold", size=12)
-            regular_font = font.Font(size=10)
-            tag_font = bold_font if tag in pos_filter_tags else regular_font
-
-            # Create a frame and label for each tag
-            tag_frame = tk.Frame(self.tags_text, bg=btn_bg)
-            tag_label = tk.Label(tag_frame, text=f"{tag} ({freq})", fg=btn_fg, bg=btn_bg, font=tag_font)
-            tag_label.pack(side="left", padx=2)
-            tag_frame.pack(side="left")
-
-            tag_labels.append((tag_label, tag))
-
-            self.tags_text.window_create("end", window=tag_frame)
-            self.tags_text.insert("end", " ")
-
+            color = "white" if dark_mode and tag_color == "black" else tag_color
+
+            chunks.append(f" {tag} ({freq}) ")
+            chunks.append(("chip", f"chip:{len(self.displayed_tags)}", self.tag_color_style(color), "bold" if in_pos_filter else "regular")
+                          + (("suspect",) if tag in suspects else ()))
+            chunks.append("  ")
+            chunks.append(())
+            self.displayed_tags.append(tag)
+
+        self.suggested_tags = []
+        if suggestions:
+            chunks += ["\n\nSuggested:  ", ("note",)]
+            for tag_id, probability in suggestions:
+                tag = self.dataset.vocabulary[tag_id]
+                chunks += [f" {tag} ({probability:.0%}) ", ("suggestion", f"suggestion:{len(self.suggested_tags)}"), "  ", ()]
+                self.suggested_tags.append(tag)
+        if suspects:
+            chunks += ["\n\nUnderlined tags rarely appear together with the others.", ("note",)]
+
+        if chunks:
+            self.tags_text.insert("end", *chunks)
         self.tags_text.config(state='disabled')
 
-        # Schedule delayed binding
-        self.root.after(250, lambda: self.delayed_tag_binding(image_path, tag_labels))
+    def tag_color_style(self, color):
+        style = "color:" + color
+        if color not in self.tag_color_styles:
+            self.tags_text.tag_configure(style, foreground=color)
+            self.tags_text.tag_raise("hover")  # Hovering still wins over the new color
+            self.tag_color_styles.add(color)
+        return style
+
+    def tag_chip_at(self, event, prefix="chip:"):
+        # Index into displayed_tags (suggested_tags for "suggestion:") of the tag under the
+        # mouse, or None
+        for name in self.tags_text.tag_names(f"@{event.x},{event.y}"):
+            if name.startswith(prefix):
+                return int(name[len(prefix):])
+        return None
+
+    def on_tag_chip(self, event, action, prefix="chip:"):
+        index = self.tag_chip_at(event, prefix)
+        shown = self.suggested_tags if prefix == "suggestion:" else self.displayed_tags
+        if index is not None and index < len(shown):
+            action(shown[index])
+
+    def hover_tag_chip(self, event, prefix="chip:"):
+        index = self.tag_chip_at(event, prefix)
+        self.tags_text.tag_remove("hover", "1.0", "end")
+        if index is not None:
+            self.tags_text.tag_add("hover", *self.tags_text.tag_ranges(f"{prefix}{index}"))
+
+    def add_suggested_tag(self, tag):
+        if self.selected_id in self.dataset:
+            self.add_tags_to_image(self.selected_id, [tag])
+
+    def filter_terms(self, filter_entry):
+        # Tag and wildcard terms of a filter box, a query that doesn't parse has none
+        try:
+            return terms(parse(filter_entry.get()))
+        except QueryError:
+            return []
+
+    def tag_category(self, tag):
+        # Category name of the tag in the current color scheme, for category: filters
+        return self.color_classes.get(self.tag_colors.get(tag.replace('_', ' ')))
 
     def sort_tags_by_danbooru_group(self, tags):
         tag_groups = {
@@ -668,66 +1431,37 @@ class ImageGalleryApp:
         return sorted_tags
 
     def sort_tags_selected(self):
-        if self.selected_label:
-            self.sort_tags(self.selected_label)
+        if self.selected_id is not None:
+            self.sort_tags(self.selected_id)
 
     def sort_tags_visible(self):
-        for label in self.image_labels:
-            if label.winfo_ismapped():
-                self.sort_tags(label)
+        self.run_bulk(self.gallery.items, self.sort_tags, "Sort Visible Tags")
 
     def sort_tags_all(self):
-        for label in self.image_labels:
-            self.sort_tags(label)
+        self.run_bulk(self.dataset.image_ids(), self.sort_tags, "Sort All Tags")
 
-    def sort_tags(self, label):
-        if label in self.tag_map:
-            tags = self.tag_map[label]
+    def sort_tags(self, image_id):
+        if image_id in self.dataset:
+            tags = self.dataset.get_tags(image_id)
             sorted_tags = self.sort_tags_by_danbooru_group(tags)
 
             # Update the tag map
-            self.tag_map[label] = sorted_tags
-
-            # Update the tags file for the image
-            image_path = label.image_path
-            caption_path = image_path.rsplit('.', 1)[0] + '.txt'
-            if os.path.exists(caption_path):
-                with open(caption_path, 'w') as file:
-                    file.write(', '.join(sorted_tags))
+            self.set_image_tags(image_id, sorted_tags)
 
             # Update the tags display if the selected image's tags were changed
-            if label == self.selected_label:
-                self.display_tags(image_path, self.count_tag_frequencies())
-
-    def delayed_tag_binding(self, image_path, tags):
-        if self.selected_label and self.selected_label.image_path == image_path:
-            for tag_label, tag in tags:
-                if tag_label.winfo_ismapped():  # Check if tag label still exists
-                    tag_label.bind("<Button-3>", lambda e, t=tag: self.tag_right_click_menu(e, t))
-                    tag_label.bind("<Button-1>", lambda e, t=tag: self.add_tag_to_filter_and_apply(t))
-                    hover_color = "blue"  # Color to show on mouse hover
-
-                    # Add mouse-over and mouse-leave bindings
-                    tag_label.bind("<Enter>", lambda e, lbl=tag_label, t=tag: lbl.config(fg=hover_color))
-                    tag_label.bind("<Leave>", lambda e, lbl=tag_label, t=tag: lbl.config(fg=self.get_tag_original_color(t)))
-
-    def get_tag_original_color(self, tag):
-        # Determine the original color of the tag based on dark mode setting
-        original_color = self.tag_colors.get(tag, "black")
-        if self.dark_mode_enabled.get() and original_color == "black":
-            return "white"  # White color in dark mode for better visibility
-        return original_color
+            if image_id == self.selected_id and self.bulk_transaction is None:
+                self.view.mark("tags")
 
     def add_tag_to_filter_and_apply(self, tag):
         current_filter = self.pos_filter_entry.get()
         if current_filter:
-            new_filter = f"{current_filter}, {tag}"
+            new_filter = f"{current_filter}, {quote_tag(tag)}"
         else:
-            new_filter = tag
+            new_filter = quote_tag(tag)
         self.pos_filter_entry.delete(0, tk.END)
         self.pos_filter_entry.insert(0, new_filter)
         self.pos_filter_entry.xview_moveto(1)  # Auto-scroll to the right
-        self.apply_filters()
+        self.view.mark("gallery")
 
     def tag_right_click_menu(self, event, tag):
         # Create a context menu for tag options
@@ -738,8 +1472,8 @@ class ImageGalleryApp:
         menu.add_command(label="Add to Positive Filter", command=lambda: self.add_to_filter_and_apply(tag, self.pos_filter_entry))
         menu.add_command(label="Add to Negative Filter", command=lambda: self.add_to_filter_and_apply(tag, self.neg_filter_entry))
         menu.add_separator()
-        menu.add_command(label="Remove Tag From Image", command=lambda: self.remove_tag_from_tags_frame(self.selected_label.image_path, tag))
-        menu.add_command(label="Replace Underscores with Spaces", command=lambda: self.replace_underscores(self.selected_label.image_path, tag))
+        menu.add_command(label="Remove Tag From Image", command=lambda: self.remove_tag_from_tags_frame(self.dataset.paths[self.selected_id], tag))
+        menu.add_command(label="Replace Underscores with Spaces", command=lambda: self.replace_underscores(self.dataset.paths[self.selected_id], tag))
         menu.add_separator()
         menu.add_command(label="Add to Add Tag Box", command=lambda: self.add_to_add_tag_entry(tag))
         menu.add_command(label="Add to Remove Tag Box", command=lambda: self.add_to_remove_tag_entry(tag))
@@ -774,6 +1508,7 @@ class ImageGalleryApp:
         # Read the entire CSV, and modify the entry if the tag exists
         updated = False
         try:
+            import csv
             rows = []
             with open(self.tags_csv_path, 'r', newline='', encoding='utf-8') as csvfile:
                 reader = csv.reader(csvfile)
@@ -797,9 +1532,10 @@ class ImageGalleryApp:
             # Update the tag_colors dictionary
             normalized_tag = tag.replace('_', ' ')  # Normalize the tag for the dictionary
             self.tag_colors[normalized_tag] = color  # Update the tag_colors dictionary
+            self.query_engine.clear()
 
             # Refresh the tags display, if necessary
-            self.display_tags(self.selected_label.image_path, self.count_tag_frequencies())
+            self.view.mark("tags")
 
         except FileNotFoundError:
             print(f"File '{self.tags_csv_path}' not found.")
@@ -811,13 +1547,14 @@ class ImageGalleryApp:
         current_filter = filter_entry.get()
         # Remove the tag from the filter
         filter_tags = [t.strip() for t in current_filter.split(',') if t.strip()]
+        tag = tag if tag in filter_tags else quote_tag(tag)
         if tag in filter_tags:
             filter_tags.remove(tag)
             # Update the filter entry
             new_filter = ', '.join(filter_tags)
             filter_entry.delete(0, tk.END)
             filter_entry.insert(0, new_filter)
-        self.apply_filters()
+        self.view.mark("gallery")
         filter_entry.xview_moveto(1)  # Auto-scroll to the right
 
     def add_to_add_tag_entry(self, tag):
@@ -841,12 +1578,12 @@ class ImageGalleryApp:
     def add_to_filter_and_apply(self, tag, filter_entry):
         current_filter = filter_entry.get()
         if current_filter:
-            new_filter = f"{current_filter}, {tag}"
+            new_filter = f"{current_filter}, {quote_tag(tag)}"
         else:
-            new_filter = tag
+            new_filter = quote_tag(tag)
         filter_entry.delete(0, tk.END)
         filter_entry.insert(0, new_filter)
-        self.apply_filters()
+        self.view.mark("gallery")
 
     def open_tag_menu(self, tag):
         # This function will be triggered when clicking on a tag
@@ -858,11 +1595,12 @@ class ImageGalleryApp:
 
         
     def count_tag_frequencies(self):
-        tag_freq = {}
-        for tags in self.tag_map.values():
-            for tag in tags:
-                tag_freq[tag] = tag_freq.get(tag, 0) + 1
-        return tag_freq
+        # Maintained incrementally, see set_image_tags
+        return self.dataset.frequency_view
+
+    def check_tag_frequencies(self):
+        # Full recount against the live structures, meant for tests and debugging
+        return self.dataset.verify()
 
     def add_filter_boxes(self):
         # Create a frame for filter boxes
@@ -876,9 +1614,9 @@ class ImageGalleryApp:
         self.pos_filter_entry.pack(side="left", fill="x", expand=True)
 
         # Positive filter options (AND/OR) with command binding
-        pos_and_radio = tk.Radiobutton(self.filter_frame, text="AND", variable=self.pos_filter_option, value=0, command=self.apply_filters)
+        pos_and_radio = tk.Radiobutton(self.filter_frame, text="AND", variable=self.pos_filter_option, value=0, command=lambda: self.view.mark("gallery"))
         pos_and_radio.pack(side="left")
-        pos_or_radio = tk.Radiobutton(self.filter_frame, text="OR", variable=self.pos_filter_option, value=1, command=self.apply_filters)
+        pos_or_radio = tk.Radiobutton(self.filter_frame, text="OR", variable=self.pos_filter_option, value=1, command=lambda: self.view.mark("gallery"))
         pos_or_radio.pack(side="left")
 
         # Negative filter
@@ -888,9 +1626,9 @@ class ImageGalleryApp:
         self.neg_filter_entry.pack(side="left", fill="x", expand=True)
 
         # Negative filter options (AND/OR) with command binding
-        neg_and_radio = tk.Radiobutton(self.filter_frame, text="AND", variable=self.neg_filter_option, value=0, command=self.apply_filters)
+        neg_and_radio = tk.Radiobutton(self.filter_frame, text="AND", variable=self.neg_filter_option, value=0, command=lambda: self.view.mark("gallery"))
         neg_and_radio.pack(side="left")
-        neg_or_radio = tk.Radiobutton(self.filter_frame, text="OR", variable=self.neg_filter_option, value=1, command=self.apply_filters)
+        neg_or_radio = tk.Radiobutton(self.filter_frame, text="OR", variable=self.neg_filter_option, value=1, command=lambda: self.view.mark("gallery"))
         neg_or_radio.pack(side="left")
 
         # Add mouse-over and mouse-leave bindings for the filter labels
@@ -903,7 +1641,7 @@ class ImageGalleryApp:
         self.neg_filter_label.bind("<Leave>", lambda e: self.neg_filter_label.config(fg=self.get_filter_label_color()))
 
         # Filter button
-        self.filter_button = tk.Button(self.filter_frame, text="Apply Filter", command=self.apply_filters)
+        self.filter_button = tk.Button(self.filter_frame, text="Apply Filter", command=lambda: self.view.mark("gallery"))
         self.filter_button.pack(side="left", padx=5)
 
         # Clear filter button
@@ -946,10 +1684,7 @@ class ImageGalleryApp:
 
     # Method to find common tags
     def find_common_tags(self):
-        common_tags = set(self.tag_map[next(iter(self.tag_map))]) if self.tag_map else set()
-        for tags in self.tag_map.values():
-            common_tags.intersection_update(tags)
-        return common_tags
+        return self.dataset.common_tags()
 
     # Method to create and display the context menu for positive filter
     def show_pos_filter_context_menu(self, event):
@@ -967,9 +1702,9 @@ class ImageGalleryApp:
     # Method to apply common tags filter
     def apply_common_tags_filter(self, common_tags):
         self.pos_filter_entry.delete(0, tk.END)
-        self.pos_filter_entry.insert(0, ', '.join(common_tags))
+        self.pos_filter_entry.insert(0, ', '.join(quote_tag(tag) for tag in common_tags))
         self.pos_filter_option.set(0)  # Set to AND
-        self.apply_filters()
+        self.view.mark("gallery")
 
     def show_filter_edit_popup(self, event):
         # Get the current mouse position
@@ -1006,7 +1741,7 @@ class ImageGalleryApp:
         filter_entry.delete(0, tk.END)
         filter_entry.insert(0, new_value)
         popup_window.destroy()
-        self.apply_filters()
+        self.view.mark("gallery")
 
     def get_filter_label_color(self):
         # Determine the label color based on dark mode setting
@@ -1028,12 +1763,11 @@ class ImageGalleryApp:
         filter_entry.delete(0, tk.END)
         filter_entry.insert(0, new_filter_text.strip())
         popup_window.destroy()
-        self.apply_filters()
+        self.view.mark("gallery")
 
     def update_tag_visibility(self):
-        if self.selected_label:
-            image_path = self.selected_label.image_path
-            self.display_tags(image_path, self.count_tag_frequencies())
+        if self.selected_id is not None:
+            self.view.mark("tags")
 
     def remove_tag(self):
         tags_to_remove = [tag.strip() for tag in self.remove_tag_entry.get().split(',') if tag.strip()]
@@ -1042,19 +1776,17 @@ class ImageGalleryApp:
 
         scope = self.remove_tag_scope.get()
         if scope == "Current Image":
-            self.remove_tags_from_image(self.selected_label, tags_to_remove)
+            self.remove_tags_from_image(self.selected_id, tags_to_remove)
         elif scope == "Visible Images":
-            for label in [lbl for lbl in self.image_labels if lbl.winfo_ismapped()]:
-                self.remove_tags_from_image(label, tags_to_remove)
+            self.run_bulk(self.gallery.items, lambda image_id: self.remove_tags_from_image(image_id, tags_to_remove), "Remove Tags from Visible Images")
         elif scope == "All Images":
-            for label in self.image_labels:
-                self.remove_tags_from_image(label, tags_to_remove)
+            self.run_bulk(self.dataset.image_ids(), lambda image_id: self.remove_tags_from_image(image_id, tags_to_remove), "Remove Tags from All Images")
 
         self.remove_tag_entry.delete(0, 'end')  # Clear the entry box
 
-    def remove_tags_from_image(self, label, tags):
-        if label:
-            image_tags = self.tag_map.get(label, [])
+    def remove_tags_from_image(self, image_id, tags):
+        if image_id is not None:
+            image_tags = self.dataset.get_tags(image_id)
             updated = False
             for tag_to_remove in tags:
                 if tag_to_remove in image_tags:
@@ -1063,17 +1795,11 @@ class ImageGalleryApp:
 
             if updated:
                 # Update the tag map
-                self.tag_map[label] = image_tags
-
-                # Update the tags file for the image
-                image_path = label.image_path
-                caption_path = image_path.rsplit('.', 1)[0] + '.txt'
-                with open(caption_path, 'w') as file:
-                    file.write(', '.join(image_tags))
+                self.set_image_tags(image_id, image_tags)
 
                 # Update the tags display if the selected image's tags were changed
-                if label == self.selected_label:
-                    self.display_tags(image_path, self.count_tag_frequencies())
+                if image_id == self.selected_id and self.bulk_transaction is None:
+                    self.view.mark("tags")
 
     def clear_filters(self):
         # Clear the filter entries
@@ -1081,54 +1807,48 @@ class ImageGalleryApp:
         self.neg_filter_entry.delete(0, 'end')
 
         # Update the gallery view to show all images
-        self.update_gallery_view([], [], self.pos_filter_option.get(), self.neg_filter_option.get())
+        self.view.mark("gallery")
 
-    def apply_filters(self):
-        pos_filters = [tag.strip() for tag in self.pos_filter_entry.get().split(',') if tag.strip()]
-        neg_filters = [tag.strip() for tag in self.neg_filter_entry.get().split(',') if tag.strip()]
+    def apply_filters(self, on_done=None):
+        # Both boxes take the query language of tag_query, plain comma lists included
+        pos_query = self.pos_filter_entry.get()
+        neg_query = self.neg_filter_entry.get()
 
         # Update the gallery view based on filters
-        self.update_gallery_view(pos_filters, neg_filters, self.pos_filter_option.get(), self.neg_filter_option.get())
-
-    def update_gallery_view(self, pos_filters, neg_filters, pos_option, neg_option):
-        visible_labels = []  # List to keep track of labels that will be visible
-        selected_visible = False  # Flag to check if selected label is visible
-
-        for label in self.image_labels:
-            image_tags = self.tag_map[label]
-
-            # Apply AND/OR logic for positive and negative filters
-            show_image = True
-            if pos_filters:
-                show_image = show_image and (all(tag in image_tags for tag in pos_filters) if pos_option == 0 else any(tag in image_tags for tag in pos_filters))
-            if neg_filters:
-                show_image = show_image and (all(tag not in image_tags for tag in neg_filters) if neg_option == 0 else any(tag not in image_tags for tag in neg_filters))
-
-            if show_image:
-                visible_labels.append(label)
-                if label == self.selected_label:
-                    selected_visible = True
-
-        # Rearrange visible labels in the grid
-        row, col = 0, 0
-        for label in visible_labels:
-            label.grid(row=row, column=col, padx=2, pady=2)
-            col += 1
-            if col >= 3:  # Assuming 3 columns, adjust as needed
-                col = 0
-                row += 1
-
-        # Hide other labels
-        for label in set(self.image_labels) - set(visible_labels):
-            label.grid_remove()
-
-        # Scroll to keep the selected image in view or select the first visible image
-        if selected_visible:
-            self.scroll_to_label(self.selected_label)
-        elif visible_labels:
-            self.select_image(None, visible_labels[0])
-            self.scroll_to_label(visible_labels[0])
+        self.update_gallery_view(pos_query, neg_query, self.pos_filter_option.get(), self.neg_filter_option.get(), on_done)
+
+    def update_gallery_view(self, pos_query, neg_query, pos_option, neg_option, on_done=None):
+        # Filtering goes through the scheduler so it sees the result of any bulk edit queued
+        # before it, a newer filter request supersedes an older one that hasn't run yet
+        self.filter_generation += 1
+        generation = self.filter_generation
+
+        def run_filter():
+            if generation != self.filter_generation:
+                return
+
+            # The queries compile to bitset operations on the tag index, AND/OR is what commas join with
+            try:
+                visible_ids = self.query_engine.match(self.dataset, pos_query, neg_query, pos_option == 0, neg_option == 0, self.metadata)  # Ids are in load order
+            except QueryError as e:
+                messagebox.showerror("Filter", f"Can't read the filter: {e}")
+                return
+            if self.sort_field.get() and self.metadata is not None:
+                visible_ids = self.metadata.sort(visible_ids, self.sort_field.get(), self.sort_descending.get())
 
+            # Rebind the grid to the filtered images
+            self.gallery.set_items(visible_ids)
+
+            # Scroll to keep the selected image in view or select the first visible image
+            if self.selected_id in self.gallery.positions:
+                self.gallery.scroll_to(self.selected_id)
+            elif visible_ids:
+                self.select_image(visible_ids[0])
+                self.gallery.scroll_to(visible_ids[0])
+            if on_done:
+                on_done()
+
+        self.scheduler.post(run_filter)
 
     def add_tag_entry(self):
         # Create a frame for tag entry and options
@@ -1156,19 +1876,17 @@ class ImageGalleryApp:
 
         scope = self.tag_add_scope.get()
         if scope == "Current Image":
-            self.add_tags_to_image(self.selected_label, tags_to_add)
+            self.add_tags_to_image(self.selected_id, tags_to_add)
         elif scope == "Visible Images":
-            for label in [lbl for lbl in self.image_labels if lbl.winfo_ismapped()]:
-                self.add_tags_to_image(label, tags_to_add)
+            self.run_bulk(self.gallery.items, lambda image_id: self.add_tags_to_image(image_id, tags_to_add), "Add Tags to Visible Images")
         elif scope == "All Images":
-            for label in self.image_labels:
-                self.add_tags_to_image(label, tags_to_add)
+            self.run_bulk(self.dataset.image_ids(), lambda image_id: self.add_tags_to_image(image_id, tags_to_add), "Add Tags to All Images")
 
         self.tag_entry.delete(0, 'end')  # Clear the entry box
 
-    def add_tags_to_image(self, label, tags):
-        if label:
-            image_tags = self.tag_map.get(label, [])
+    def add_tags_to_image(self, image_id, tags):
+        if image_id is not None:
+            image_tags = self.dataset.get_tags(image_id)
             updated = False
             for new_tag in tags:
                 if new_tag and new_tag not in image_tags:
@@ -1177,17 +1895,11 @@ class ImageGalleryApp:
 
             if updated:
                 # Update the tag map
-                self.tag_map[label] = image_tags
-
-                # Update the tags file for the image
-                image_path = label.image_path
-                caption_path = image_path.rsplit('.', 1)[0] + '.txt'
-                with open(caption_path, 'w') as file:
-                    file.write(', '.join(image_tags))
+                self.set_image_tags(image_id, image_tags)
 
                 # Update the tags display if the selected image's tags were changed
-                if label == self.selected_label:
-                    self.display_tags(image_path, self.count_tag_frequencies())
+                if image_id == self.selected_id and self.bulk_transaction is None:
+                    self.view.mark("tags")
 
     def save_settings(self, settings):
         with open('settings/app_settings.json', 'w') as f:
@@ -1218,25 +1930,56 @@ class ImageGalleryApp:
             print(f"Color scheme directory '{color_scheme_dir}' not found.")
 
     def change_color_scheme(self, scheme_name):
+        # Parsing or compiling a scheme can take a while, so it's loaded on a worker thread.
+        # Tags keep their current colors until the new table is swapped in.
         selected_scheme = self.color_schemes[scheme_name]
+        self.color_scheme_generation += 1
         if selected_scheme:
-            self.load_tag_colors(selected_scheme)
             self.tags_csv_path = selected_scheme
+            threading.Thread(target=self.load_color_scheme_threaded, args=(scheme_name, selected_scheme, self.color_scheme_generation), daemon=True).start()
         else:
-            self.tag_colors = {}  # Reset to no color coding
+            self.apply_color_scheme(scheme_name, TagColorDB(), self.color_scheme_generation)  # Reset to no color coding
 
         # Update last color scheme in settings
         settings = self.load_settings()
         settings['last_color_scheme'] = scheme_name
         self.save_settings(settings)
 
-        if self.selected_label:
-            image_path = self.selected_label.image_path
-            self.display_tags(image_path, self.count_tag_frequencies())
+    def load_color_scheme_threaded(self, scheme_name, file_path, generation):
+        tag_colors = self.load_tag_colors(file_path)
+        self.scheduler.post(self.apply_color_scheme, scheme_name, tag_colors, generation)
+
+    def apply_color_scheme(self, scheme_name, tag_colors, generation):
+        if generation != self.color_scheme_generation:
+            tag_colors.close()  # Another scheme was picked while this one was loading
+            return
+        self.tag_colors.close()
+        self.tag_colors = tag_colors
+        self.query_engine.clear()  # category: results depend on the scheme
+        if self.startup_profile is not None:
+            self.startup_profile.mark(f"color scheme '{scheme_name}' loaded")
+
+        # Recolor the open tag view
+        if self.selected_id is not None:
+            self.view.mark("tags")
 
     def load_tag_colors(self, file_path):
+        # Schemes are compiled into a memory-mapped lookup table under cache/, the CSV or YAML
+        # source is only parsed again when its mtime or size changed
+        salt = zlib.crc32(json.dumps(self.color_mapping, sort_keys=True).encode('utf-8'))
+        try:
+            return TagColorDB.load(file_path, os.path.join('cache', 'colors'), self.parse_tag_colors, salt)
+        except FileNotFoundError:
+            print(f"File '{file_path}' not found.")
+        except Exception as e:
+            print(f"Error loading file '{file_path}': {e}")
+        return TagColorDB()
+
+    def parse_tag_colors(self, file_path):
+        tag_colors = {}
         try:
             if file_path.endswith('.yaml'):
+                import yaml
                 with open(file_path, 'r', encoding='utf-8') as file:
                     data = yaml.safe_load(file)
                 for category in data:
@@ -1245,25 +1988,56 @@ class ImageGalleryApp:
                         color = self.rgba_to_hex(rgba_color)
                         for tag in group['tags']:
                             normalized_tag = tag.replace('_', ' ')
-                            self.tag_colors[normalized_tag] = color
+                            tag_colors[normalized_tag] = color
             elif file_path.endswith('.csv'):
+                import csv
                 with open(file_path, newline='', encoding='utf-8') as csvfile:
                     reader = csv.reader(csvfile)
+                    scheme = 'danbooru' if 'danbooru' in file_path else 'e621'
                     for row in reader:
                         tag, group_number, _, alt_tags = row
-                        scheme = 'danbooru' if 'danbooru' in file_path else 'e621'
                         color = self.color_mapping[scheme].get(group_number, ["black"])[0]
                         normalized_tag = tag.replace('_', ' ')
-                        self.tag_colors[normalized_tag] = color
+                        tag_colors[normalized_tag] = color
                         # Process alternate tags
                         if alt_tags:
                             for alt_tag in alt_tags.strip('\"').split(','):
                                 normalized_alt_tag = alt_tag.replace('_', ' ')
-                                self.tag_colors[normalized_alt_tag] = color
-        except FileNotFoundError:
-            print(f"File '{file_path}' not found.")
+                                tag_colors[normalized_alt_tag] = color
         except Exception as e:
             print(f"Error loading file '{file_path}': {e}")
+        return tag_colors
+
+    def collect_statistics(self):
+        stats = {}
+        if self.thumbnail_cache:
+            stats["Thumbnail cache"] = self.thumbnail_cache.stats()
+        stats["Preview cache"] = self.preview_cache.stats()
+        stats["Scheduler"] = self.scheduler.stats()
+        stats["Caption journal"] = self.caption_journal.stats()
+        stats["Undo history"] = self.history.stats()
+        stats["Thumbnail queue"] = self.load_queue.stats()
+        stats["Filter queries"] = self.query_engine.stats()
+        stats["Tag completion"] = self.tag_completer.stats()
+        stats["View refreshes"] = self.view.stats()
+        if self.metadata is not None:
+            stats["Image metadata"] = self.metadata.stats()
+        if self.dataset.cooccurrence is not None:
+            stats["Tag suggestions"] = self.dataset.cooccurrence.stats()
+        if self.manifest_stats:
+            stats["Last folder load"] = self.manifest_stats
+        if self.folder_monitor:
+            stats["Folder monitor"] = self.folder_monitor.stats()
+        return stats
+
+    def show_statistics(self):
+        lines = []
+        for section, values in self.collect_statistics().items():
+            lines.append(section)
+            for key, value in values.items():
+                value = f"{value:.1%}" if key.endswith("rate") else value
+                lines.append(f"    {key}: {value}")
+        messagebox.showinfo("Statistics", "\n".join(lines) or "Nothing loaded yet.")
 
     def copy_to_clipboard(self, tag):
         self.root.clipboard_clear()
@@ -1278,9 +2052,8 @@ class ImageGalleryApp:
         settings = self.load_settings()
         settings['dark_mode'] = self.dark_mode_enabled.get()
         self.save_settings(settings)
-        if self.selected_label:
-            image_path = self.selected_label.image_path
-            self.display_tags(image_path, self.count_tag_frequencies())
+        if self.selected_id is not None:
+            self.view.mark("tags")
 
     def apply_dark_mode(self):
         dark_bg = 'gray20'
@@ -1296,7 +2069,7 @@ class ImageGalleryApp:
         self.root.configure(bg=dark_bg)
         self.main_frame.configure(bg=dark_bg)
         self.grid_canvas.configure(bg=dark_canvas, highlightbackground=dark_bg)
-        self.scrollable_frame.configure(bg=dark_bg)
+        self.gallery.set_background(dark_canvas)
         self.right_frame.configure(bg=dark_bg)
         self.preview_frame.configure(bg=dark_bg)
         self.tags_frame.configure(bg=dark_bg)
@@ -1321,9 +2094,8 @@ class ImageGalleryApp:
         self.remove_tag_button.configure(bg=dark_bg, fg=dark_fg)
         self.remove_tag_frame.configure(bg=dark_bg)
 
-        if self.selected_label:
-            image_path = self.selected_label.image_path
-            self.display_tags(image_path, self.count_tag_frequencies())
+        if self.selected_id is not None:
+            self.view.mark("tags")
 
     def apply_light_mode(self):
         light_bg = 'SystemButtonFace'
@@ -1339,7 +2111,7 @@ class ImageGalleryApp:
         self.root.configure(bg=light_bg)
         self.main_frame.configure(bg=light_bg)
         self.grid_canvas.configure(bg=light_canvas, highlightbackground=light_bg)
-        self.scrollable_frame.configure(bg=light_bg)
+        self.gallery.set_background(light_canvas)
         self.right_frame.configure(bg=light_bg)
         self.preview_frame.configure(bg=light_bg)
         self.tags_frame.configure(bg=light_bg)
@@ -1364,43 +2136,38 @@ class ImageGalleryApp:
         self.remove_tag_button .configure(bg=light_bg, fg=light_fg)
         self.remove_tag_frame.configure(bg=light_bg)
 
-        if self.selected_label:
-            image_path = self.selected_label.image_path
-            self.display_tags(image_path, self.count_tag_frequencies())
+        if self.selected_id is not None:
+            self.view.mark("tags")
 
     def remove_duplicates_visible(self):
-        for label in self.image_labels:
-            if label.winfo_ismapped():  # Checks if the label (image) is currently visible
-                self._remove_duplicate_tags(label)
+        self.run_bulk(self.gallery.items, self._remove_duplicate_tags, "Remove Duplicates in Visible Images")  # Images that pass the current filters
 
     def remove_duplicates_all(self):
-        for label in self.image_labels:
-            self._remove_duplicate_tags(label)
+        self.run_bulk(self.dataset.image_ids(), self._remove_duplicate_tags, "Remove Duplicates in All Images")
 
     def remove_duplicate_selected(self):
-        if self.selected_label:
-            self._remove_duplicate_tags(self.selected_label)
+        if self.selected_id is not None:
+            self._remove_duplicate_tags(self.selected_id)
 
-    def _remove_duplicate_tags(self, label):
-        image_path = label.image_path
-        tags = self.tag_map.get(label, [])
+    def _remove_duplicate_tags(self, image_id):
+        tags = self.dataset.get_tags(image_id)
         unique_tags = list(set(tags))  # Remove duplicates
 
         if len(unique_tags) != len(tags):
-            self.tag_map[label] = unique_tags
-
-            # Update the tags file for the image
-            caption_path = image_path.rsplit('.', 1)[0] + '.txt'
-            with open(caption_path, 'w') as file:
-                file.write(', '.join(unique_tags))
+            self.set_image_tags(image_id, unique_tags)
 
-            if label == self.selected_label:
+            if image_id == self.selected_id and self.bulk_transaction is None:
                 # Update the tags display if the selected image's tags were changed
-                self.display_tags(image_path, self.count_tag_frequencies())
+                self.view.mark("tags")
 
 if __name__ == "__main__":
+    startup_profile = None
+    if '--startup-profile' in sys.argv:
+        from startup_profile import StartupProfile
+        startup_profile = StartupProfile(STARTUP_TIME)
+        startup_profile.mark("imports done")
     root = tk.Tk()
     root.geometry("1440x1024")  # Adjust initial window size
-    app = ImageGalleryApp(root)
+    app = ImageGalleryApp(root, startup_profile)
 
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def write_caption(caption_path, text):
+    # Written next to the caption and swapped in, a crash leaves either the old or the new
+    # caption. Returns the (mtime_ns, size) of the file as written.
+    tmp_path = caption_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write(text)
+    stat = os.stat(tmp_path)
+    os.replace(tmp_path, caption_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CaptionJournal:
+    # Write-behind layer for caption files. Tag edits only mark a caption dirty with its new
+    # text, repeated edits of one caption before it's flushed collapse into a single write.
+    # A background thread flushes whatever is dirty once the oldest entry has waited
+    # delay_ms, flush() does the same synchronously (before reloading a folder, on quit).
+    #
+    # Writes happen one batch at a time under write_lock, so a caption marked again while
+    # its previous text is being written always ends up with the newer text. Within a batch
+    # every path is unique and the files are written by a small thread pool, which mostly
+    # waits on the disk or the network share. hold() keeps the background thread from
+    # flushing while a bulk operation is still computing its captions.
+    #
+    # The folder monitor sees these writes like any other change to a caption. version()
+    # and own_write() let it tell them apart: every mark bumps the caption's version, and
+    # the (mtime_ns, size) of every file written is remembered.
+    def __init__(self, delay_ms=250, workers=8):
+        self.delay = delay_ms / 1000.0
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="caption-writer")
+        self.holds = 0
+        self.dirty = {}  # Caption path -> (text, time it was first marked dirty)
+        self.failed = {}  # Caption path -> text, retried on the next explicit flush
+        self.versions = {}  # Caption path -> sequence number of its last mark
+        self.written_stats = {}  # Caption path -> (mtime_ns, size) of the last file written
+        self.in_flight = set()  # Caption paths of the batch being written
+        self.discarded = set()  # Of those, the ones discard() was called for
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.write_lock = threading.Lock()
+        self.closed = False
+        self.marked = 0
+        self.coalesced = 0
+        self.written = 0
+        self.errors = 0
+        self.flushes = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        self.thread = threading.Thread(target=self._run, name="caption-journal", daemon=True)
+        self.thread.start()
+
+    def mark(self, caption_path, text):
+        with self.lock:
+            self.marked += 1
+            self.sequence += 1
+            self.versions[caption_path] = self.sequence
+            entry = self.dirty.get(caption_path)
+            if entry is not None:
+                self.coalesced += 1
+                self.dirty[caption_path] = (text, entry[1])
+            else:
+                if not self.dirty:
+                    self.wake.notify()  # Only the first entry starts the flush countdown
+                self.dirty[caption_path] = (text, time.perf_counter())
+
+    def pending(self, caption_path):
+        # Text that's still waiting to be written, or None
+        with self.lock:
+            entry = self.dirty.get(caption_path)
+            return entry[0] if entry is not None else None
+
+    def version(self, caption_path):
+        # Changes whenever the caption is marked, 0 if it never was. Taken before reading a
+        # caption, a different version afterwards means the text read is out of date.
+        with self.lock:
+            return self.versions.get(caption_path, 0)
+
+    def own_write(self, caption_path, stat):
+        # Whether stat (mtime_ns, size) is the file the journal wrote last
+        with self.lock:
+            return self.written_stats.get(caption_path) == stat
+
+    def discard(self, caption_path):
+        # For captions about to be deleted. Never waits for the disk: a write of this caption
+        # that's in progress removes the file again itself once it's done, see _write_one.
+        with self.lock:
+            self.dirty.pop(caption_path, None)
+            self.failed.pop(caption_path, None)
+            self.written_stats.pop(caption_path, None)
+            if caption_path in self.in_flight:
+                self.discarded.add(caption_path)
+
+    def dirty_count(self):
+        return len(self.dirty)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while (not self.dirty or self.holds) and not self.closed:
+                    self.wake.wait()
+                if self.closed:
+                    return  # close() does the final flush itself
+                oldest = next(iter(self.dirty.values()))[1]  # Insertion order, the first entry is the oldest
+                remaining = oldest + self.delay - time.perf_counter()
+                if remaining > 0:
+                    self.wake.wait(remaining)
+                    continue
+            self._flush_batch()
+
+    def hold(self):
+        with self.lock:
+            self.holds += 1
+
+    def release(self):
+        with self.lock:
+            self.holds -= 1
+            self.wake.notify()
+
+    def _write_one(self, entry):
+        # (mtime_ns, size) of the written file, the OSError, or None if it was discarded
+        caption_path, (text, marked_at) = entry
+        with self.lock:
+            if caption_path in self.discarded:
+                return None
+        try:
+            result = write_caption(caption_path, text)
+        except OSError as e:
+            return e
+        with self.lock:
+            discarded = caption_path in self.discarded
+            if not discarded:
+                self.written_stats[caption_path] = result
+        if discarded:
+            # Discarded while it was being written, the caller may have deleted it already
+            try:
+                os.remove(caption_path)
+            except OSError:
+                pass
+            return None
+        return result
+
+    def _flush_batch(self, retry_failed=False, progress=None, cancelled=None):
+        # Returns False if cancelled() stopped the batch early, the unwritten rest stays dirty
+        with self.write_lock:
+            with self.lock:
+                batch, self.dirty = self.dirty, {}
+                if retry_failed:
+                    retries, self.failed = self.failed, {}
+                    now = time.perf_counter()
+                    for caption_path, text in retries.items():
+                        batch.setdefault(caption_path, (text, now))
+                self.in_flight = set(batch)
+            try:
+                return self._write_batch(batch, progress, cancelled)
+            finally:
+                with self.lock:
+                    self.in_flight = set()
+                    self.discarded = set()
+
+    def _write_batch(self, batch, progress, cancelled):
+        if not batch:
+            return True
+        self.flushes += 1
+        entries = list(batch.items())
+        total = len(entries)
+        chunk_size = self.workers * 8  # Bounds the queued writes and the cancellation delay
+        for start in range(0, total, chunk_size):
+            if cancelled and cancelled():
+                self._requeue(entries[start:])
+                return False
+            chunk = entries[start:start + chunk_size]
+            for (caption_path, (text, marked_at)), result in zip(chunk, self.pool.map(self._write_one, chunk)):
+                if result is None:
+                    continue
+                if isinstance(result, OSError):
+                    print(f"Error writing caption '{caption_path}': {result}")
+                    self.errors += 1
+                    with self.lock:
+                        if caption_path not in self.dirty and caption_path not in self.discarded:
+                            self.failed[caption_path] = text
+                    continue
+                latency = time.perf_counter() - marked_at
+                self.written += 1
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                self.total_latency += latency
+            if progress:
+                progress(min(start + chunk_size, total), total)
+        return True
+
+    def _requeue(self, entries):
+        # Entries marked again in the meantime keep their newer text
+        with self.lock:
+            for caption_path, entry in entries:
+                if caption_path not in self.discarded:
+                    self.dirty.setdefault(caption_path, entry)
+
+    def flush(self, progress=None, cancelled=None):
+        # Writes everything that's dirty before returning. progress(done, total) is called
+        # after every chunk, a cancelled() check that returns True stops the flush early and
+        # makes it return False.
+        return self._flush_batch(True, progress, cancelled)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wake.notify()
+        self.thread.join()
+        self.flush()
+        self.pool.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            "dirty": len(self.dirty),
+            "edits": self.marked,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "flushes": self.flushes,
+            "write errors": self.errors,
+            "failed pending retry": len(self.failed),
+            "last flush latency ms": round(self.last_latency * 1000, 1),
+            "avg flush latency ms": round(self.total_latency / self.written * 1000, 1) if self.written else 0.0,
+            "max flush latency ms": round(self.max_latency * 1000, 1),
+        }
@@ -0,0 +1,125 @@
+import tkinter as tk
+
+from tag_completion import current_term
+
+# Keys that move through or close the list rather than change the typed text
+NAVIGATION_KEYS = {'Up', 'Down', 'Tab', 'Return', 'Escape', 'Shift_L', 'Shift_R', 'Control_L', 'Control_R', 'Alt_L', 'Alt_R'}
+
+
+class CompletionPopup:
+    # Suggestion list under an Entry, refreshed on every keystroke for the tag at the
+    # cursor. Up/Down move through it, Tab takes the highlighted (or first) suggestion,
+    # Return takes it only after Up/Down picked one and otherwise does what it always did,
+    # Escape closes the list. complete(prefix) returns (text to insert, label) pairs, quote
+    # turns an inserted tag into valid entry syntax.
+    def __init__(self, entry, complete, quote=None, rows=8):
+        self.entry = entry
+        self.complete = complete
+        self.quote = quote or (lambda tag: tag)
+        self.rows = rows
+        self.window = None
+        self.listbox = None
+        self.suggestions = []
+        self.term_start = 0
+        self.picked = False  # Up/Down was used since the list was last filled
+
+        entry.bind("<KeyRelease>", self._on_key_release, add="+")
+        entry.bind("<Down>", lambda e: self._move(1))
+        entry.bind("<Up>", lambda e: self._move(-1))
+        entry.bind("<Tab>", self._on_tab)
+        entry.bind("<Return>", self._on_return)
+        entry.bind("<Escape>", self._on_escape)
+        entry.bind("<FocusOut>", lambda e: entry.after(150, self._hide_unless_focused), add="+")
+
+    def _on_key_release(self, event):
+        if event.keysym not in NAVIGATION_KEYS:
+            self.refresh()
+
+    def refresh(self):
+        text = self.entry.get()
+        self.term_start, prefix = current_term(text, self.entry.index(tk.INSERT))
+        self.suggestions = self.complete(prefix) if prefix.strip() else []
+        if not self.suggestions:
+            self.hide()
+            return
+        self._show()
+        self.listbox.delete(0, tk.END)
+        for _, label in self.suggestions:
+            self.listbox.insert(tk.END, label)
+        self.listbox.configure(height=min(len(self.suggestions), self.rows))
+        self.picked = False
+
+    def _show(self):
+        if self.window is None:
+            self.window = tk.Toplevel(self.entry)
+            self.window.overrideredirect(True)
+            self.listbox = tk.Listbox(self.window, activestyle="none", exportselection=False)
+            self.listbox.pack(fill="both", expand=True)
+            self.listbox.bind("<ButtonRelease-1>", self._on_click)
+        self.listbox.configure(bg=self.entry.cget("bg"), fg=self.entry.cget("fg"), width=max(self.entry.winfo_width() // 7, 30))
+        self.window.geometry(f"+{self.entry.winfo_rootx()}+{self.entry.winfo_rooty() + self.entry.winfo_height()}")
+        self.window.deiconify()
+        self.window.lift()
+
+    def hide(self):
+        if self.window is not None:
+            self.window.withdraw()
+        self.suggestions = []
+
+    def is_shown(self):
+        return bool(self.suggestions)
+
+    def _hide_unless_focused(self):
+        if self.entry.focus_get() is not self.entry:
+            self.hide()
+
+    def _move(self, step):
+        if not self.is_shown():
+            return None  # The grid's arrow key navigation
+        selection = self.listbox.curselection()
+        index = (selection[0] + step) if selection else (0 if step > 0 else len(self.suggestions) - 1)
+        index = max(0, min(index, len(self.suggestions) - 1))
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(index)
+        self.listbox.see(index)
+        self.picked = True
+        return "break"
+
+    def _on_tab(self, event):
+        if not self.is_shown():
+            return None
+        selection = self.listbox.curselection()
+        self.accept(selection[0] if selection else 0)
+        return "break"
+
+    def _on_return(self, event):
+        if self.is_shown() and self.picked:
+            self.accept(self.listbox.curselection()[0])
+            return "break"
+        self.hide()
+        return None
+
+    def _on_escape(self, event):
+        if not self.is_shown():
+            return None
+        self.hide()
+        return "break"
+
+    def _on_click(self, event):
+        selection = self.listbox.curselection()
+        if selection:
+            self.accept(selection[0])
+            self.entry.focus_set()
+
+    def accept(self, index):
+        tag = self.suggestions[index][0]
+        text = self.entry.get()
+        cursor = self.entry.index(tk.INSERT)
+        if self.term_start > 0 and text[self.term_start - 1] == '"':
+            value = tag + '"'  # Finish the quote that was already typed
+        else:
+            value = self.quote(tag)
+        self.entry.delete(self.term_start, cursor)
+        self.entry.insert(self.term_start, value)
+        self.entry.icursor(self.term_start + len(value))
+        self.hide()
@@ -0,0 +1,208 @@
+from array import array
+
+from tag_index import TagIndex, TagFrequencies, bitset_to_ids
+
+
+class Vocabulary:
+    # Interns tag strings into dense integer ids, every distinct tag is stored once
+    def __init__(self):
+        self.ids = {}  # Tag -> id
+        self.tags = []  # Id -> tag
+
+    def intern(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = self.ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
+
+    def lookup(self, tag):
+        return self.ids.get(tag)
+
+    def __getitem__(self, tag_id):
+        return self.tags[tag_id]
+
+    def __len__(self):
+        return len(self.tags)
+
+
+class TagStore:
+    # Per-image tag id sequences packed into one contiguous array('I'). Each image owns a
+    # slice [offset, offset + capacity) of which the first `length` entries are used. Edits
+    # that fit are done in place, longer ones move the slice to the end of the buffer, and
+    # the buffer gets compacted once more than half of it is dead space.
+    def __init__(self):
+        self.buffer = array('I')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.capacities = array('I')
+        self.garbage = 0
+
+    def append(self, tag_ids):
+        image_id = len(self.offsets)
+        self.offsets.append(len(self.buffer))
+        self.lengths.append(len(tag_ids))
+        self.capacities.append(len(tag_ids))
+        self.buffer.extend(tag_ids)
+        return image_id
+
+    def get(self, image_id):
+        offset = self.offsets[image_id]
+        return self.buffer[offset:offset + self.lengths[image_id]]
+
+    def set(self, image_id, tag_ids):
+        count = len(tag_ids)
+        offset = self.offsets[image_id]
+        if count <= self.capacities[image_id]:
+            self.buffer[offset:offset + count] = array('I', tag_ids)
+        else:
+            self.garbage += self.capacities[image_id]
+            offset = self.offsets[image_id] = len(self.buffer)
+            self.capacities[image_id] = count
+            self.buffer.extend(tag_ids)
+        self.lengths[image_id] = count
+        if self.garbage > len(self.buffer) // 2:
+            self.compact()
+
+    def release(self, image_id):
+        self.garbage += self.capacities[image_id]
+        self.lengths[image_id] = 0
+        self.capacities[image_id] = 0
+
+    def compact(self):
+        buffer = array('I')
+        for image_id in range(len(self.offsets)):
+            offset, length = self.offsets[image_id], self.lengths[image_id]
+            self.offsets[image_id] = len(buffer)
+            self.capacities[image_id] = length
+            buffer.extend(self.buffer[offset:offset + length])
+        self.buffer = buffer
+        self.garbage = 0
+
+    def memory_bytes(self):
+        return sum(a.buffer_info()[1] * a.itemsize for a in (self.buffer, self.offsets, self.lengths, self.capacities))
+
+
+class FrequencyView:
+    # Tag string lookups on top of the id keyed frequency counter, for the tag panel
+    def __init__(self, vocabulary, frequencies):
+        self.vocabulary = vocabulary
+        self.frequencies = frequencies
+
+    def get(self, tag, default=0):
+        tag_id = self.vocabulary.lookup(tag)
+        return default if tag_id is None else self.frequencies.get(tag_id, default)
+
+
+class Dataset:
+    # The loaded folder without any GUI attached: stable image ids, their paths, and their
+    # tags as interned ids. The tag index and the frequency counter are updated from here,
+    # so every change made through set_tags keeps them consistent. The tag co-occurrence
+    # counts, when the app built them, are told about every change the same way.
+    def __init__(self):
+        self.vocabulary = Vocabulary()
+        self.store = TagStore()
+        self.index = TagIndex()  # Keyed by tag id
+        self.frequencies = TagFrequencies()  # Keyed by tag id
+        self.frequency_view = FrequencyView(self.vocabulary, self.frequencies)
+        self.cooccurrence = None  # tag_cooccurrence.Cooccurrence, built on demand
+        self.paths = []  # Image id -> path, ids are never reused within a dataset
+        self.ids = {}  # Path -> id of the live images
+        self.alive = array('B')
+
+    def __contains__(self, image_id):
+        return image_id is not None and 0 <= image_id < len(self.alive) and self.alive[image_id] == 1
+
+    def __len__(self):
+        return self.index.image_count()
+
+    def image_ids(self):
+        # Live ids in load order
+        return self.index.live
+
+    def path(self, image_id):
+        return self.paths[image_id]
+
+    def image_id(self, path):
+        return self.ids.get(path)
+
+    def _intern(self, tags):
+        intern = self.vocabulary.intern
+        return [intern(tag) for tag in tags]
+
+    def add_image(self, path, tags):
+        tag_ids = self._intern(tags)
+        image_id = self.store.append(tag_ids)
+        self.paths.append(path)
+        self.ids[path] = image_id
+        self.alive.append(1)
+        self.index.add_image(image_id, tag_ids)
+        self.frequencies.add(tag_ids)
+        if self.cooccurrence is not None:
+            self.cooccurrence.update((), tag_ids, 1)
+        return image_id
+
+    def remove_image(self, image_id):
+        if image_id not in self:
+            return
+        tag_ids = self.store.get(image_id)
+        self.index.remove_image(image_id, tag_ids)
+        self.frequencies.remove(tag_ids)
+        if self.cooccurrence is not None:
+            self.cooccurrence.update(tag_ids, (), -1)
+        self.store.release(image_id)
+        self.alive[image_id] = 0
+        self.ids.pop(self.paths[image_id], None)
+
+    def tag_ids(self, image_id):
+        return self.store.get(image_id)
+
+    def get_tags(self, image_id):
+        if image_id not in self:
+            return []
+        tags = self.vocabulary.tags
+        return [tags[tag_id] for tag_id in self.store.get(image_id)]
+
+    def set_tags(self, image_id, tags):
+        self.set_tag_ids(image_id, self._intern(tags))
+
+    def set_tag_ids(self, image_id, new_ids):
+        if image_id not in self:
+            return
+        old_ids = self.store.get(image_id)
+        self.index.update(image_id, old_ids, new_ids)
+        self.frequencies.update(old_ids, new_ids)
+        if self.cooccurrence is not None:
+            self.cooccurrence.update(old_ids, new_ids)
+        self.store.set(image_id, new_ids)
+
+    def _lookup_all(self, tags):
+        # Unknown tags map to an id no image has, so they behave like empty postings
+        ids = self.vocabulary.ids
+        return [ids.get(tag, -1) for tag in tags]
+
+    def match(self, pos_filters, neg_filters, pos_and, neg_and):
+        bits = self.index.match(self._lookup_all(pos_filters), self._lookup_all(neg_filters), pos_and, neg_and)
+        return bitset_to_ids(bits)
+
+    def tag_frequency(self, tag):
+        return self.frequency_view.get(tag)
+
+    def common_tags(self):
+        return {self.vocabulary[tag_id] for tag_id in self.index.common_tags()}
+
+    def verify(self):
+        # Consistency check of the derived structures against the stored tags, for tests and
+        # debugging. Raises AssertionError explicitly, so it still checks under python -O
+        live = [image_id for image_id in range(len(self.alive)) if self.alive[image_id]]
+        if list(self.index.live) != live:
+            raise AssertionError("Live image ids out of sync")
+        self.frequencies.verify(self.store.get(image_id) for image_id in live)
+        postings = {}
+        for image_id in live:
+            for tag_id in set(self.store.get(image_id)):
+                postings.setdefault(tag_id, []).append(image_id)
+        actual = {tag_id: list(ids) for tag_id, ids in self.index.postings.items()}
+        if actual != postings:
+            raise AssertionError("Tag index out of sync")
+        return True
@@ -0,0 +1,97 @@
+import tkinter as tk
+from tkinter import messagebox
+
+
+class DuplicateReview:
+    # Window listing groups of near duplicate images. Picking a group shows its images with
+    # a checkbox each, every image but the first of a group starts out checked (the caller
+    # puts the one worth keeping first). Clicking a thumbnail selects the image in the main
+    # gallery, "Delete Checked" deletes the checked images of every group after asking.
+    #
+    # describe(image_id) gives the text next to a thumbnail, photo(image_id) its PhotoImage
+    # or None, on_select(image_id) and on_delete(image_ids) act on the main window.
+    def __init__(self, root, clusters, describe, photo, on_select, on_delete, title="Duplicate Images"):
+        self.clusters = [list(cluster) for cluster in clusters]
+        self.describe = describe
+        self.photo = photo
+        self.on_select = on_select
+        self.on_delete = on_delete
+        self.checked = {}  # Image id -> BooleanVar, for every image of every group
+        for cluster in self.clusters:
+            for position, image_id in enumerate(cluster):
+                self.checked[image_id] = tk.BooleanVar(value=position > 0)
+        self.photos = []  # The shown group's PhotoImages, Tk drops an image once Python does
+
+        self.window = tk.Toplevel(root)
+        self.window.title(title)
+        self.window.geometry("760x520")
+
+        left = tk.Frame(self.window)
+        left.pack(side="left", fill="y")
+        self.group_list = tk.Listbox(left, width=24, exportselection=False)
+        self.group_list.pack(side="top", fill="y", expand=True)
+        self.group_list.bind("<<ListboxSelect>>", lambda e: self.show_group())
+        self.summary = tk.Label(left, anchor="w")
+        self.summary.pack(side="top", fill="x")
+        tk.Button(left, text="Delete Checked", command=self.delete_checked).pack(side="top", fill="x")
+
+        self.canvas = tk.Canvas(self.window, highlightthickness=0)
+        scrollbar = tk.Scrollbar(self.window, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.members = tk.Frame(self.canvas)
+        self.canvas.create_window((0, 0), window=self.members, anchor="nw")
+        self.members.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+
+        self.fill_groups()
+
+    def fill_groups(self, index=0):
+        self.group_list.delete(0, tk.END)
+        for number, cluster in enumerate(self.clusters, 1):
+            self.group_list.insert(tk.END, f"Group {number}: {len(cluster)} images")
+        self.update_summary()
+        if self.clusters:
+            index = min(index, len(self.clusters) - 1)
+            self.group_list.selection_set(index)
+            self.group_list.see(index)
+        self.show_group()
+
+    def show_group(self):
+        for child in self.members.winfo_children():
+            child.destroy()
+        self.photos = []
+        selection = self.group_list.curselection()
+        if not selection:
+            return
+        for image_id in self.clusters[selection[0]]:
+            row = tk.Frame(self.members)
+            row.pack(side="top", fill="x", padx=4, pady=4)
+            photo = self.photo(image_id)
+            thumbnail = tk.Label(row, image=photo, width=120, height=120) if photo else tk.Label(row, text="…", width=16, height=7)
+            thumbnail.pack(side="left")
+            thumbnail.bind("<Button-1>", lambda e, image_id=image_id: self.on_select(image_id))
+            if photo:
+                self.photos.append(photo)
+            tk.Checkbutton(row, text=self.describe(image_id), variable=self.checked[image_id], anchor="w", justify="left",
+                           command=self.update_summary).pack(side="left", fill="x", expand=True)
+        self.canvas.yview_moveto(0)
+
+    def update_summary(self):
+        checked = sum(var.get() for var in self.checked.values())
+        self.summary.config(text=f"{len(self.clusters)} groups, {checked} checked")
+
+    def delete_checked(self):
+        image_ids = [image_id for image_id, var in self.checked.items() if var.get()]
+        if not image_ids:
+            return
+        if not messagebox.askyesno("Delete Images", f"Delete {len(image_ids)} images and their captions?", parent=self.window):
+            return
+        self.on_delete(image_ids)
+
+        # Groups with a single image left aren't duplicates anymore
+        deleted = set(image_ids)
+        selection = self.group_list.curselection()
+        self.clusters = [kept for kept in ([image_id for image_id in cluster if image_id not in deleted] for cluster in self.clusters) if len(kept) > 1]
+        self.checked = {image_id: self.checked[image_id] for cluster in self.clusters for image_id in cluster}
+        self.fill_groups(selection[0] if selection else 0)
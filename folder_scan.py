@@ -0,0 +1,98 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# Matched case-insensitively
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+# Caption stat of images without a .txt file
+NO_CAPTION = (-1, -1)
+
+
+def _scan_directory(directory, extensions, chunk_size, chunks):
+    # Lists one directory on a worker thread and puts lists of (image_path, size, mtime_ns,
+    # caption_size, caption_mtime_ns) into chunks as they fill up, followed by the list of
+    # subdirectories as a tuple. An image is held back until its caption has shown up in
+    # the listing, or until the listing ends and it's clear there is none.
+    ready, subdirectories = [], []
+    waiting = {}  # Stem -> DirEntry of images whose caption hasn't been seen yet
+    captions = {}  # Stem -> (size, mtime_ns)
+
+    def add(entry, caption):
+        try:
+            stat = entry.stat()
+        except OSError:
+            return
+        ready.append((entry.path, stat.st_size, stat.st_mtime_ns) + caption)
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                        continue
+                    name = entry.name
+                    if name.endswith('.txt'):
+                        stat = entry.stat()
+                        stem = name[:-4]
+                        captions[stem] = (stat.st_size, stat.st_mtime_ns)
+                        image = waiting.pop(stem, None)
+                        if image is not None:
+                            add(image, captions[stem])
+                    elif name.lower().endswith(extensions):
+                        stem = name.rsplit('.', 1)[0]
+                        if stem in captions:
+                            add(entry, captions[stem])
+                        else:
+                            waiting[stem] = entry
+                except OSError:
+                    continue
+                if len(ready) >= chunk_size:
+                    chunks.put(ready)
+                    ready = []
+        for entry in waiting.values():
+            add(entry, NO_CAPTION)
+        if ready:
+            chunks.put(ready)
+    except OSError as e:
+        print(f"Error reading '{directory}': {e}")
+    finally:
+        chunks.put(tuple(sorted(subdirectories)))  # Always sent, the consumer waits for it
+
+
+def iter_folder(folder_path, extensions=IMAGE_EXTENSIONS, workers=4, chunk_size=512):
+    # Streams the images below folder_path as lists of at most chunk_size entries (see
+    # _scan_directory), so callers can start on the first images while the walk goes on.
+    # Directories are listed on a thread pool, which pays off on network shares where every
+    # listing is a round trip. Results still come out in a fixed order: directories depth
+    # first by name, and within a directory in listing order. The caption of each image is
+    # stat'ed from the same listing, DirEntry stat data is free on Windows.
+    extensions = tuple(extension.lower() for extension in extensions)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="folder-scan")
+
+    def start(directory):
+        chunks = queue.Queue()
+        pool.submit(_scan_directory, directory, extensions, chunk_size, chunks)
+        return chunks
+
+    try:
+        stack = [start(folder_path)]
+        while stack:
+            chunks = stack.pop()
+            while True:
+                item = chunks.get()
+                if isinstance(item, tuple):
+                    # Siblings are listed in parallel while the first one is consumed. Started in
+                    # order so the pool works on the ones needed next, pushed reversed so the
+                    # first one is popped first.
+                    stack.extend(reversed([start(directory) for directory in item]))
+                    break
+                yield item
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def scan_folder(folder_path, extensions=IMAGE_EXTENSIONS, workers=4):
+    # The whole folder as one list
+    return [entry for chunk in iter_folder(folder_path, extensions, workers) for entry in chunk]
@@ -0,0 +1,211 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def scan_files(folder_path, extensions):
+    # Path -> (mtime_ns, size) of every matching file below folder_path
+    files = {}
+    pending = [folder_path]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.lower().endswith(extensions):
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return files
+
+
+class FolderMonitor:
+    # Watches a folder tree for created, deleted and rewritten files with the given
+    # extensions. Events are collected on a background thread and reported in debounced
+    # bursts through on_changes(paths), called from that thread once nothing happened for
+    # debounce_ms (or max_delay_ms after the first event of a burst, for folders that never
+    # go quiet). paths is None when events were lost and the caller should rescan.
+    #
+    # Uses inotify on Linux and falls back to comparing mtimes every poll_interval seconds.
+    def __init__(self, folder_path, extensions, on_changes, debounce_ms=400, max_delay_ms=2000, poll_interval=2.0):
+        self.folder_path = folder_path
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self.on_changes = on_changes
+        self.debounce = debounce_ms / 1000.0
+        self.max_delay = max_delay_ms / 1000.0
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.changed = set()
+        self.overflowed = False
+        self.first_event = None
+        self.last_event = None
+        self.backend = None
+        self.events = 0
+        self.bursts = 0
+        self.thread = None
+
+    def start(self):
+        target = self._run_inotify if self._init_inotify() else self._run_polling
+        self.thread = threading.Thread(target=target, name="folder-monitor", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=0.5):
+        # Waits at most timeout seconds for the thread. A burst still being handled is left
+        # to finish on its own, on_changes has to notice itself that its results aren't
+        # wanted anymore.
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def _matches(self, path):
+        return path.lower().endswith(self.extensions)
+
+    def _touch(self):
+        now = time.monotonic()
+        if not self.changed and not self.overflowed:
+            self.first_event = now
+        self.last_event = now
+        self.events += 1
+
+    def _note(self, path):
+        self._touch()
+        self.changed.add(path)
+
+    def _note_overflow(self):
+        self._touch()
+        self.overflowed = True
+
+    def _emit_if_settled(self):
+        if not self.changed and not self.overflowed:
+            return
+        now = time.monotonic()
+        if now - self.last_event < self.debounce and now - self.first_event < self.max_delay:
+            return
+        self._emit()
+
+    def _emit(self):
+        paths = None if self.overflowed else self.changed
+        self.changed, self.overflowed = set(), False
+        self.bursts += 1
+        try:
+            self.on_changes(paths)
+        except Exception as e:
+            print(f"Error handling folder changes: {e}")
+
+    # inotify backend
+
+    def _init_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if self.fd < 0:
+            return False
+        self.watches = {}  # Watch descriptor -> directory
+        self._watch_tree(self.folder_path)
+        self.backend = "inotify"
+        return True
+
+    def _watch_tree(self, directory, report=False):
+        # Adds a watch for directory and everything below it. Files already inside a directory
+        # that just appeared are reported, their own events happened before the watch existed.
+        pending = [directory]
+        while pending:
+            directory = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                continue  # Gone already, or out of watches (fs.inotify.max_user_watches)
+            self.watches[wd] = directory
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif report and self._matches(entry.path):
+                            self._note(entry.path)
+            except OSError:
+                continue
+
+    def _run_inotify(self):
+        try:
+            while not self.stopped.is_set():
+                timeout = self.debounce if self.changed or self.overflowed else 0.5
+                readable, _, _ = select.select([self.fd], [], [], timeout)
+                if readable:
+                    self._read_events()
+                self._emit_if_settled()
+        finally:
+            os.close(self.fd)
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        position = 0
+        while position < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, position)
+            position += EVENT_HEADER.size
+            name = data[position:position + length].rstrip(b'\0')
+            position += length
+            if mask & IN_Q_OVERFLOW:
+                self._note_overflow()
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path, report=True)
+                elif mask & IN_MOVED_FROM:
+                    self._note_overflow()  # A whole subtree left, simplest to rescan
+            elif self._matches(path) and mask & (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE):
+                self._note(path)
+
+    # Polling backend
+
+    def _run_polling(self):
+        self.backend = "polling"
+        snapshot = scan_files(self.folder_path, self.extensions)
+        while not self.stopped.wait(self.poll_interval):
+            current = scan_files(self.folder_path, self.extensions)
+            for path in current.keys() | snapshot.keys():
+                if current.get(path) != snapshot.get(path):
+                    self._note(path)
+            snapshot = current
+            if self.changed:
+                self._emit()  # A poll already spans more than the debounce window
+
+    def stats(self):
+        return {"backend": self.backend, "events": self.events, "bursts": self.bursts, "pending": len(self.changed)}
@@ -0,0 +1,164 @@
+import tkinter as tk
+
+
+class VirtualGrid:
+    # Thumbnail grid drawn on a canvas that only keeps the rows inside the viewport
+    # (plus a little overscan) as live Label widgets. Scrolling rebinds those slots
+    # to other images instead of creating a widget per image.
+    def __init__(self, canvas, scrollbar, photo_provider, on_click, on_context, columns=3, cell_size=132, overscan=1, on_viewport=None):
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.photo_provider = photo_provider  # image id -> PhotoImage or None while it's still loading
+        self.on_click = on_click
+        self.on_context = on_context
+        self.on_viewport = on_viewport  # (bound image ids, items, first index) after every refresh
+        self.columns = columns
+        self.cell_size = cell_size
+        self.overscan = overscan
+
+        self.items = []  # Image ids in display order
+        self.positions = {}  # Image id -> index in self.items
+        self.slots = []  # (label, canvas window id)
+        self.bound = {}  # Slot index -> image id
+        self.selected_id = None
+        self.bg = None
+        self.refresh_pending = False
+
+        self.canvas.configure(yscrollcommand=self._on_yscroll, yscrollincrement=cell_size, width=columns * cell_size)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_refresh())
+        self.update_scrollregion()
+
+    def set_items(self, image_ids):
+        self.items = list(image_ids)
+        self.positions = {image_id: index for index, image_id in enumerate(self.items)}
+        self.bound.clear()
+        self.update_scrollregion()
+        self.refresh()
+
+    def append(self, image_id):
+        self.positions[image_id] = len(self.items)
+        self.items.append(image_id)
+        self.update_scrollregion()
+        # Only touch the widgets if the new item lands inside the live slots
+        if self.is_live_index(len(self.items) - 1) or len(self.slots) == 0:
+            self.schedule_refresh()
+
+    def is_live_index(self, index):
+        # True if an item at this index is (or would be) bound to one of the live slots
+        first_index = self._first_index()
+        return first_index <= index < first_index + len(self.slots)
+
+    def clear(self):
+        self.set_items([])
+
+    def index_of(self, image_id):
+        return self.positions.get(image_id, -1)
+
+    def update_scrollregion(self):
+        rows = (len(self.items) + self.columns - 1) // self.columns
+        self.canvas.configure(scrollregion=(0, 0, self.columns * self.cell_size, max(rows * self.cell_size, 1)))
+
+    def schedule_refresh(self):
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.canvas.after_idle(self.refresh)
+
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_refresh()
+
+    def _first_index(self):
+        top = self.canvas.canvasy(0)
+        first_row = max(int(top // self.cell_size) - self.overscan, 0)
+        return first_row * self.columns
+
+    def _ensure_slots(self, count):
+        while len(self.slots) < count:
+            slot_index = len(self.slots)
+            label = tk.Label(self.canvas, borderwidth=2, relief="flat", highlightthickness=2, highlightbackground="black")
+            if self.bg:
+                label.configure(bg=self.bg)
+            label.bind("<Button-1>", lambda e, s=slot_index: self._slot_event(s, e, self.on_click))
+            label.bind("<Button-3>", lambda e, s=slot_index: self._slot_event(s, e, self.on_context))
+            window = self.canvas.create_window(-self.cell_size, -self.cell_size, window=label, anchor="nw")
+            self.slots.append((label, window))
+
+    def _slot_event(self, slot_index, event, callback):
+        image_id = self.bound.get(slot_index)
+        if image_id is not None:
+            callback(image_id, event)
+
+    def refresh(self):
+        self.refresh_pending = False
+        height = max(self.canvas.winfo_height(), self.cell_size)
+        visible_rows = height // self.cell_size + 2 + 2 * self.overscan
+        self._ensure_slots(visible_rows * self.columns)
+
+        first_index = self._first_index()
+        for slot_index, (label, window) in enumerate(self.slots):
+            index = first_index + slot_index
+            if index >= len(self.items):
+                # Park unused slots outside the scroll region
+                if slot_index in self.bound:
+                    del self.bound[slot_index]
+                    label.config(image="")
+                    label.image = None
+                self.canvas.coords(window, -self.cell_size, -self.cell_size)
+                continue
+
+            image_id = self.items[index]
+            row, col = divmod(index, self.columns)
+            self.canvas.coords(window, col * self.cell_size + 2, row * self.cell_size + 2)
+            if self.bound.get(slot_index) != image_id:
+                self.bound[slot_index] = image_id
+                self._bind_photo(label, image_id)
+            self._highlight(label, image_id)
+
+        if self.on_viewport:
+            self.on_viewport([self.bound[slot_index] for slot_index in sorted(self.bound)], self.items, first_index)
+
+    def _bind_photo(self, label, image_id):
+        photo = self.photo_provider(image_id)
+        label.config(image=photo if photo else "")
+        label.image = photo  # Keep a reference
+
+    def _highlight(self, label, image_id):
+        color = "yellow" if image_id == self.selected_id else "black"
+        if label.cget("highlightbackground") != color:
+            label.config(highlightbackground=color)
+
+    def invalidate(self, image_id):
+        # Rebind the slot showing this image, e.g. once its thumbnail finished loading
+        for slot_index, bound_id in self.bound.items():
+            if bound_id == image_id:
+                self._bind_photo(self.slots[slot_index][0], image_id)
+
+    def set_selected(self, image_id):
+        self.selected_id = image_id
+        for slot_index, bound_id in self.bound.items():
+            self._highlight(self.slots[slot_index][0], bound_id)
+
+    def set_background(self, bg):
+        self.bg = bg
+        for label, _ in self.slots:
+            label.configure(bg=bg)
+
+    def visible_range(self):
+        # Indices into self.items that are currently bound to slots
+        first_index = self._first_index()
+        return first_index, min(first_index + len(self.slots), len(self.items))
+
+    def scroll_to(self, image_id):
+        index = self.index_of(image_id)
+        if index < 0:
+            return
+        row = index // self.columns
+        total_height = max(((len(self.items) + self.columns - 1) // self.columns) * self.cell_size, 1)
+        label_y = row * self.cell_size
+        canvas_y1 = self.canvas.canvasy(0)
+        canvas_y2 = canvas_y1 + self.canvas.winfo_height()
+
+        if label_y < canvas_y1:
+            self.canvas.yview_moveto(label_y / total_height)
+        elif label_y + self.cell_size > canvas_y2:
+            self.canvas.yview_moveto((label_y + self.cell_size - self.canvas.winfo_height()) / total_height)
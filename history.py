@@ -0,0 +1,142 @@
+from array import array
+from collections import deque
+
+# Delta kinds, each one replays in both directions from the tag ids an image has at that point
+APPEND = 0  # Tag ids added at the end
+REMOVE = 1  # Entries dropped at the given positions of the old sequence
+PERMUTE = 2  # Same tags in a new order, new[i] = old[order[i]]
+REPLACE = 3  # Anything else, both sequences are kept
+
+
+def make_delta(old, new):
+    old, new = list(old), list(new)
+    old_count, new_count = len(old), len(new)
+    if new_count > old_count and new[:old_count] == old:
+        return (APPEND, array('I', new[old_count:]))
+    if new_count < old_count:
+        # Greedy subsequence match, finds the removed positions if new is old minus some entries
+        positions = array('I')
+        j = 0
+        for i, tag_id in enumerate(old):
+            if j < new_count and new[j] == tag_id:
+                j += 1
+            else:
+                positions.append(i)
+        if j == new_count:
+            return (REMOVE, positions, array('I', (old[i] for i in positions)))
+    if new_count == old_count and sorted(old) == sorted(new):
+        slots = {}
+        for i, tag_id in enumerate(old):
+            slots.setdefault(tag_id, deque()).append(i)
+        order = array('H' if old_count < 0x10000 else 'I', (slots[tag_id].popleft() for tag_id in new))
+        return (PERMUTE, order)
+    return (REPLACE, array('I', old), array('I', new))
+
+
+def apply_delta(delta, tag_ids, forward=True):
+    # Tag ids after replaying delta forward (redo) or backward (undo) on tag_ids
+    kind = delta[0]
+    tag_ids = list(tag_ids)
+    if kind == APPEND:
+        added = delta[1]
+        return tag_ids + list(added) if forward else tag_ids[:len(tag_ids) - len(added)]
+    if kind == REMOVE:
+        positions, removed = delta[1], delta[2]
+        if forward:
+            dropped = set(positions)
+            return [tag_id for i, tag_id in enumerate(tag_ids) if i not in dropped]
+        for position, tag_id in zip(positions, removed):
+            tag_ids.insert(position, tag_id)
+        return tag_ids
+    if kind == PERMUTE:
+        order = delta[1]
+        if forward:
+            return [tag_ids[i] for i in order]
+        restored = [0] * len(tag_ids)
+        for i, source in enumerate(order):
+            restored[source] = tag_ids[i]
+        return restored
+    return list(delta[2] if forward else delta[1])
+
+
+def delta_bytes(delta):
+    return sum(part.buffer_info()[1] * part.itemsize for part in delta[1:])
+
+
+class Transaction:
+    # The per-image deltas of one operation, in the order the images were changed
+    def __init__(self, label):
+        self.label = label
+        self.image_ids = array('I')
+        self.deltas = []
+        self.open = True  # Bulk operations keep recording until their task finishes
+
+    def record(self, image_id, old_ids, new_ids):
+        self.image_ids.append(image_id)
+        self.deltas.append(make_delta(old_ids, new_ids))
+
+    def steps(self, forward=True):
+        steps = zip(self.image_ids, self.deltas)
+        return steps if forward else reversed(list(steps))
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def memory_bytes(self):
+        return self.image_ids.buffer_info()[1] * 4 + sum(delta_bytes(delta) for delta in self.deltas)
+
+
+class History:
+    # Undo and redo stacks of transactions. Only the last `depth` transactions are kept, and
+    # starting a new one drops everything that could have been redone.
+    def __init__(self, depth=20):
+        self.depth = depth
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+
+    def begin(self, label):
+        transaction = Transaction(label)
+        self.undo_stack.append(transaction)
+        self.redo_stack.clear()
+        while len(self.undo_stack) > self.depth:
+            self.undo_stack.popleft()
+        return transaction
+
+    def discard(self, transaction):
+        if transaction in self.undo_stack:
+            self.undo_stack.remove(transaction)
+
+    def can_undo(self):
+        return bool(self.undo_stack) and not self.undo_stack[-1].open
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        # Transaction to replay backward, or None
+        if not self.can_undo():
+            return None
+        transaction = self.undo_stack.pop()
+        self.redo_stack.append(transaction)
+        return transaction
+
+    def redo(self):
+        if not self.can_redo():
+            return None
+        transaction = self.redo_stack.pop()
+        self.undo_stack.append(transaction)
+        return transaction
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def stats(self):
+        transactions = list(self.undo_stack) + list(self.redo_stack)
+        return {
+            "undo steps": len(self.undo_stack),
+            "redo steps": len(self.redo_stack),
+            "depth": self.depth,
+            "image changes": sum(len(transaction) for transaction in transactions),
+            "bytes": sum(transaction.memory_bytes() for transaction in transactions),
+        }
@@ -0,0 +1,139 @@
+import numpy as np
+from PIL import Image
+
+# Perceptual hashes of the thumbnails, 64 bits each, and a multi-index hash table to find
+# near duplicates among them. Both hashes are computed from the thumbnail while it's still
+# in memory in the decode worker, they survive resizing and recompression of the original.
+HASH_BITS = 64
+CHUNK_BITS = 16  # The multi-index splits each hash into HASH_BITS // CHUNK_BITS chunks
+CHUNKS = HASH_BITS // CHUNK_BITS
+# Highest threshold find_duplicates accepts. Probes flip up to threshold // CHUNKS bits per
+# chunk, from 3 on that's hundreds of masks each hitting a large part of a 16 bit table.
+MAX_THRESHOLD = 3 * CHUNKS - 1
+UINT64_MASK = (1 << 64) - 1
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II basis, coefficients = D @ pixels @ D.T
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT = _dct_matrix(32)
+
+
+def _pack(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def dhash(gray):
+    # Whether each pixel is brighter than its left neighbour, on a 9x8 downscale
+    pixels = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(gray):
+    # Lowest 8x8 DCT frequencies of a 32x32 downscale against their median
+    pixels = np.asarray(gray.resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    low = (DCT @ pixels @ DCT.T)[:8, :8].ravel()
+    return _pack(low > np.median(low[1:]))
+
+
+def image_hashes(img):
+    # (dhash, phash) of a PIL image, as unsigned 64 bit ints
+    gray = img.convert('L')
+    return dhash(gray), phash(gray)
+
+
+def to_signed(value):
+    # SQLite integers are signed 64 bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value & UINT64_MASK
+
+
+def _flip_masks(radius):
+    # Every CHUNK_BITS wide mask with at most radius bits set
+    masks = np.zeros(1, dtype=np.int64)
+    for _ in range(radius):
+        flipped = (masks[:, None] ^ (1 << np.arange(CHUNK_BITS, dtype=np.int64))[None, :]).ravel()
+        masks = np.union1d(masks, flipped)
+    return masks
+
+
+def _labels(count, left, right):
+    # Connected components of the pairs, every node labelled with its smallest member
+    labels = np.arange(count)
+    while True:
+        low = np.minimum(labels[left], labels[right])
+        merged = labels.copy()
+        np.minimum.at(merged, left, low)
+        np.minimum.at(merged, right, low)
+        merged = merged[merged]  # Pointer jumping, a long chain collapses in a few rounds
+        if np.array_equal(merged, labels):
+            return labels
+        labels = merged
+
+
+def find_duplicates(dhashes, phashes, threshold, block_size=1 << 18):
+    # Clusters of near duplicates as lists of positions into the hash arrays, largest
+    # cluster first. Two images are near duplicates when both their pHashes and their
+    # dHashes differ in at most threshold bits, clusters are the connected components.
+    #
+    # Candidates come from a multi-index hash table on the pHash: if two hashes are within
+    # threshold bits, one of their CHUNKS chunks is within threshold // CHUNKS bits, so
+    # probing every chunk's table with all masks of that many bits finds every pair without
+    # comparing all of them. Identical hashes are merged first, a folder with a thousand
+    # copies of one image doesn't turn into a million candidate pairs.
+    if not 0 <= threshold <= MAX_THRESHOLD:
+        raise ValueError(f"Threshold must be between 0 and {MAX_THRESHOLD}")
+    dhashes = np.asarray(dhashes, dtype=np.uint64)
+    phashes = np.asarray(phashes, dtype=np.uint64)
+    if len(phashes) < 2:
+        return []
+    combined = np.stack([phashes, dhashes], axis=1)
+    unique, inverse = np.unique(combined, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    unique_phashes, unique_dhashes = unique[:, 0], unique[:, 1]
+    count = len(unique)
+
+    masks = _flip_masks(threshold // CHUNKS)
+    chunk_mask = np.uint64((1 << CHUNK_BITS) - 1)
+    lefts, rights = [], []
+    for chunk in range(CHUNKS):
+        keys = ((unique_phashes >> np.uint64(chunk * CHUNK_BITS)) & chunk_mask).astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        bounds = np.searchsorted(keys[order], np.arange((1 << CHUNK_BITS) + 1))
+        step = max(1, block_size // len(masks))
+        for start in range(0, count, step):
+            queries = np.arange(start, min(start + step, count))
+            probes = (keys[queries, None] ^ masks[None, :]).ravel()
+            queries = np.repeat(queries, len(masks))
+            lo, sizes = bounds[probes], bounds[probes + 1] - bounds[probes]
+            total = int(sizes.sum())
+            if not total:
+                continue
+            left = np.repeat(queries, sizes)
+            offsets = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            right = order[np.repeat(lo, sizes) + offsets]
+            keep = left < right
+            left, right = left[keep], right[keep]
+            keep = (np.bitwise_count(unique_phashes[left] ^ unique_phashes[right]) <= threshold) & \
+                   (np.bitwise_count(unique_dhashes[left] ^ unique_dhashes[right]) <= threshold)
+            lefts.append(left[keep])
+            rights.append(right[keep])
+
+    # Identical hashes are their own clusters even without a pair
+    left = np.concatenate(lefts) if lefts else np.zeros(0, dtype=np.int64)
+    right = np.concatenate(rights) if rights else np.zeros(0, dtype=np.int64)
+    labels = _labels(count, left, right)[inverse]
+
+    order = np.argsort(labels, kind='stable')
+    groups = np.split(order, np.flatnonzero(np.diff(labels[order])) + 1)
+    clusters = [group.tolist() for group in groups if len(group) > 1]
+    clusters.sort(key=len, reverse=True)
+    return clusters
@@ -0,0 +1,149 @@
+import numpy as np
+
+# Columns filters and sorting can use, see tag_query for the filter syntax
+NUMERIC_FIELDS = ('width', 'height', 'pixels', 'aspect', 'filesize')
+NAME_FIELDS = ('format', 'mode')
+COMPARISONS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '=': np.equal,
+    '!=': np.not_equal,
+}
+FORMAT_ALIASES = {'JPG': 'JPEG', 'TIF': 'TIFF'}
+# Aspect ratio (width / height) bucket edges for the histogram, portrait to landscape
+ASPECT_EDGES = (0.0, 1 / 3, 1 / 2, 2 / 3, 3 / 4, 0.9, 1.1, 4 / 3, 3 / 2, 2.0, 3.0, float('inf'))
+
+
+def mask_to_bitset(mask):
+    # Image id bitset, in the layout of tag_index, of a boolean array indexed by image id
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+
+class ImageMetadata:
+    # Width, height, file size, format and mode of every image of the loaded folder, as numpy
+    # columns indexed by image id. They're filled from the thumbnail pass, or straight from
+    # the thumbnail cache for images that didn't need one, so the images are never opened
+    # just for this. Filters and sorting work on whole columns at once. Formats and modes are
+    # stored as small codes into name lists, 0 means unknown.
+    def __init__(self, capacity=1024):
+        self.width = np.zeros(capacity, np.int32)
+        self.height = np.zeros(capacity, np.int32)
+        self.file_size = np.zeros(capacity, np.int64)
+        self.format = np.zeros(capacity, np.uint8)
+        self.mode = np.zeros(capacity, np.uint8)
+        self.known = np.zeros(capacity, bool)
+        self.names = {'format': [''], 'mode': ['']}
+        self.size = 0  # Highest image id seen + 1
+        self.version = 0  # Bumped on every change, query results depending on it go stale
+
+    def _grow(self, capacity):
+        for column in ('width', 'height', 'file_size', 'format', 'mode', 'known'):
+            old = getattr(self, column)
+            new = np.zeros(capacity, old.dtype)
+            new[:len(old)] = old
+            setattr(self, column, new)
+
+    def _code(self, field, name):
+        names = self.names[field]
+        if name not in names:
+            if len(names) == 256:
+                return 0
+            names.append(name)
+        return names.index(name)
+
+    def set(self, image_id, metadata):
+        # metadata: (width, height, format, mode, file size) as the thumbnail pipeline returns it
+        width, height, image_format, mode, file_size = metadata
+        if image_id >= len(self.known):
+            self._grow(max(image_id + 1, len(self.known) * 2))
+        self.width[image_id] = width
+        self.height[image_id] = height
+        self.file_size[image_id] = file_size
+        self.format[image_id] = self._code('format', image_format or '')
+        self.mode[image_id] = self._code('mode', mode or '')
+        self.known[image_id] = True
+        self.size = max(self.size, image_id + 1)
+        self.version += 1
+
+    def discard(self, image_id):
+        if image_id < self.size and self.known[image_id]:
+            self.known[image_id] = False
+            self.version += 1
+
+    def get(self, image_id):
+        if image_id >= self.size or not self.known[image_id]:
+            return None
+        return (int(self.width[image_id]), int(self.height[image_id]), self.names['format'][self.format[image_id]],
+                self.names['mode'][self.mode[image_id]], int(self.file_size[image_id]))
+
+    def column(self, field):
+        # Values for image ids 0 to size - 1, derived columns are computed on the fly
+        size = self.size
+        if field == 'width':
+            return self.width[:size]
+        if field == 'height':
+            return self.height[:size]
+        if field == 'pixels':
+            return self.width[:size].astype(np.int64) * self.height[:size]
+        if field == 'aspect':
+            height = self.height[:size]
+            return np.divide(self.width[:size], height, out=np.zeros(size), where=height > 0)
+        if field == 'filesize':
+            return self.file_size[:size]
+        if field in NAME_FIELDS:
+            return getattr(self, field)[:size]
+        raise KeyError(field)
+
+    def mask(self, field, op, value):
+        # Boolean array over image ids of the known images matching field op value. Name
+        # fields only compare for equality, 'between' takes a (low, high) pair, both included.
+        column = self.column(field)
+        if field in NAME_FIELDS:
+            name = value.upper()
+            if field == 'format':
+                name = FORMAT_ALIASES.get(name, name)
+            codes = [code for code, known in enumerate(self.names[field]) if code and known.upper() == name]
+            matches = np.isin(column, codes)
+            result = ~matches if op == '!=' else matches
+        elif op == 'between':
+            low, high = value
+            result = (column >= low) & (column <= high)
+        else:
+            result = COMPARISONS[op](column, value)
+        return result & self.known[:self.size]
+
+    def bitset(self, field, op, value):
+        return mask_to_bitset(self.mask(field, op, value))
+
+    def sort(self, image_ids, field, descending=False):
+        # The ids ordered by a numeric column, ties and images without metadata keep their
+        # relative order, the latter always come last
+        ids = np.asarray(image_ids, dtype=np.int64)
+        if not len(ids):
+            return []
+        inside = ids < self.size
+        keys = np.zeros(len(ids))
+        keys[inside] = self.column(field)[ids[inside]]
+        known = np.zeros(len(ids), bool)
+        known[inside] = self.known[ids[inside]]
+        order = np.lexsort((np.arange(len(ids)), -keys if descending else keys, ~known))
+        return ids[order].tolist()
+
+    def histogram(self, image_ids, edges=ASPECT_EDGES):
+        # ([(low, high, count)] of the aspect ratio buckets, number of ids without metadata)
+        ids = np.asarray(image_ids, dtype=np.int64)
+        ids = ids[ids < self.size]
+        ids = ids[self.known[ids]]
+        counts, _ = np.histogram(self.column('aspect')[ids], bins=np.asarray(edges))
+        return [(edges[i], edges[i + 1], int(count)) for i, count in enumerate(counts)], len(image_ids) - len(ids)
+
+    def stats(self):
+        known = self.known[:self.size]
+        return {
+            "images": int(known.sum()),
+            "formats": ", ".join(name for name in self.names['format'] if name) or "-",
+            "modes": ", ".join(name for name in self.names['mode'] if name) or "-",
+            "bytes": sum(getattr(self, column).nbytes for column in ('width', 'height', 'file_size', 'format', 'mode', 'known')),
+        }
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+
+
+class LoadQueue:
+    # Images still waiting for their thumbnail, handed out by priority instead of load order:
+    # the rows on screen first, then the rest of the filtered grid from the viewport down
+    # (wrapping around to the top), then everything else in the order it was queued. The grid
+    # reports every viewport change through focus(), so the next take() already follows it.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()  # Image id -> path, in the order they were queued
+        self.failed = set()  # Ids whose decode failed, not queued again until retry()
+        self.visible = ()  # Ids bound to the grid's live slots, top to bottom
+        self.items = []  # The grid's filtered item list, shared, only ever read here
+        self.first_index = 0
+        self.cursor = 0  # Next index into items, counted from first_index
+        self.taken = [0, 0, 0]  # Handed out as visible, filtered in, the rest
+
+    def add(self, image_id, image_path):
+        with self.lock:
+            if image_id not in self.failed:
+                self.pending[image_id] = image_path
+
+    def discard(self, image_id):
+        with self.lock:
+            self.pending.pop(image_id, None)
+
+    def mark_failed(self, image_id):
+        with self.lock:
+            self.failed.add(image_id)
+
+    def retry(self, image_id):
+        # The file changed, it's worth another decode
+        with self.lock:
+            self.failed.discard(image_id)
+
+    def focus(self, visible_ids, items, first_index):
+        # Called by the grid on the main thread whenever it rebinds its slots
+        with self.lock:
+            self.visible = tuple(visible_ids)
+            self.items = items
+            self.first_index = first_index
+            self.cursor = 0
+
+    def take(self, count):
+        # Up to count (image id, path) pairs, highest priority first
+        taken = []
+        with self.lock:
+            pending = self.pending
+            for image_id in self.visible:
+                if len(taken) == count or not pending:
+                    return taken
+                image_path = pending.pop(image_id, None)
+                if image_path is not None:
+                    taken.append((image_id, image_path))
+                    self.taken[0] += 1
+
+            # The grid grows while a folder loads, so its length is read on every step
+            items = self.items
+            while len(taken) < count and pending and self.cursor < len(items):
+                index = self.first_index + self.cursor
+                if index >= len(items):
+                    index -= len(items)
+                self.cursor += 1
+                image_id = items[index]
+                image_path = pending.pop(image_id, None)
+                if image_path is not None:
+                    taken.append((image_id, image_path))
+                    self.taken[1] += 1
+
+            while len(taken) < count and pending:
+                taken.append(pending.popitem(last=False))
+                self.taken[2] += 1
+        return taken
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+            self.failed.clear()
+            self.visible = ()
+            self.items = []
+            self.cursor = 0
+
+    def __contains__(self, image_id):
+        return image_id in self.pending
+
+    def __len__(self):
+        return len(self.pending)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "failed": len(self.failed),
+            "taken visible": self.taken[0],
+            "taken filtered in": self.taken[1],
+            "taken other": self.taken[2],
+        }
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import pickle
+from array import array
+
+from folder_scan import NO_CAPTION
+
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    # What was on disk the last time a folder was loaded: per image its size and mtime, the
+    # size and mtime of its caption, and the parsed tags. On reopen, images whose stats still
+    # match are served from here without opening their caption. Tags are stored as ids into
+    # the manifest's own tag list, which keeps the file small and quick to unpickle.
+    def __init__(self, folder_path, manifest_path):
+        self.folder_path = os.path.abspath(folder_path)
+        self.prefix = os.path.join(folder_path, '')  # Image paths all start with this, see relative()
+        self.manifest_path = manifest_path
+        self.tags = []  # Id -> tag
+        self.entries = {}  # Path relative to the folder -> (size, mtime_ns, caption size, caption mtime_ns, tag id bytes)
+
+    @classmethod
+    def load(cls, folder_path, cache_dir):
+        key = hashlib.sha1(os.path.abspath(folder_path).encode('utf-8')).hexdigest()[:16]
+        manifest = cls(folder_path, os.path.join(cache_dir, key + '.manifest'))
+        try:
+            with open(manifest.manifest_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == MANIFEST_VERSION and data.get('folder') == manifest.folder_path:
+                manifest.tags = data['tags']
+                manifest.entries = data['entries']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable manifest '{manifest.manifest_path}': {e}")
+        return manifest
+
+    def relative(self, path):
+        # Paths come from walking folder_path, so slicing is enough (and much cheaper than relpath)
+        return path[len(self.prefix):] if path.startswith(self.prefix) else os.path.relpath(path, self.folder_path)
+
+    def lookup(self, image_path, size, mtime_ns, caption_size, caption_mtime_ns):
+        # Tags of an unchanged image, or None if it's new or it or its caption changed
+        entry = self.entries.get(self.relative(image_path))
+        if entry is None or entry[:4] != (size, mtime_ns, caption_size, caption_mtime_ns):
+            return None
+        tags = self.tags
+        return [tags[tag_id] for tag_id in array('I', entry[4])]
+
+    def save(self, images):
+        # images: (image_path, size, mtime_ns, caption_size, caption_mtime_ns, tags) of every
+        # image in the folder, replaces the previous contents
+        tag_ids = {}
+        entries = {}
+        for image_path, size, mtime_ns, caption_size, caption_mtime_ns, tags in images:
+            ids = array('I', (tag_ids.setdefault(tag, len(tag_ids)) for tag in tags))
+            entries[self.relative(image_path)] = (size, mtime_ns, caption_size, caption_mtime_ns, ids.tobytes())
+        self.tags = list(tag_ids)
+        self.entries = entries
+
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': MANIFEST_VERSION, 'folder': self.folder_path, 'tags': self.tags, 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.manifest_path)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def stat_files(image_path):
+    # Current (size, mtime_ns, caption size, caption mtime_ns) of an image, or None if it's gone
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    try:
+        caption = os.stat(image_path.rsplit('.', 1)[0] + '.txt')
+        caption_stat = (caption.st_size, caption.st_mtime_ns)
+    except OSError:
+        caption_stat = NO_CAPTION
+    return (stat.st_size, stat.st_mtime_ns) + caption_stat
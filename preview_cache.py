@@ -0,0 +1,157 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+PREVIEW_SIZE = (512, 512)
+
+
+def decode_preview(image_path):
+    from PIL import Image  # Imported on first use, the cache itself is created at startup
+    img = Image.open(image_path)
+    img.thumbnail(PREVIEW_SIZE, Image.Resampling.LANCZOS)
+    return img
+
+
+def decode_fast_preview(image_path):
+    # Reduced quality stand-in shown while the selection is still moving. JPEGs are decoded
+    # at a reduced scale, everything else gets a cheap box reduce plus bilinear resample.
+    from PIL import Image
+    img = Image.open(image_path)
+    img.draft('RGB', PREVIEW_SIZE)
+    img.thumbnail(PREVIEW_SIZE, Image.Resampling.BILINEAR, reducing_gap=1.0)
+    return img
+
+
+def image_bytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+class PreviewCache:
+    # Bounded LRU of decoded previews. Neighbours of the current selection are decoded on a
+    # couple of background threads (Pillow releases the GIL while decoding and resampling),
+    # so arrow key browsing usually finds the next preview already in memory.
+    #
+    # The selected image itself is decoded on its own single worker. Each request carries a
+    # generation token, and a request whose generation is no longer the latest is dropped
+    # before it starts and its result is discarded if it finishes late.
+    def __init__(self, max_bytes=256 * 1024 * 1024, workers=2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # Image path -> PIL image
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+        self.decoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview-current")
+        self.generation = 0
+        self.in_flight = set()
+        self.wanted = set()  # Paths of the latest prefetch request, stale ones are skipped
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0
+        self.decoded = 0
+        self.dropped = 0
+
+    def get(self, image_path):
+        with self.lock:
+            img = self.entries.get(image_path)
+            if img is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(image_path)
+            self.hits += 1
+            return img
+
+    def request(self, image_path, generation, on_ready, fast=False):
+        # Decodes the preview of the current selection in the background and calls
+        # on_ready(img, generation, fast) from the worker thread, unless a newer request
+        # came in first. Full quality results go into the cache, fast ones don't.
+        self.generation = generation
+        self.decoder.submit(self._decode_current, image_path, generation, on_ready, fast)
+
+    def _decode_current(self, image_path, generation, on_ready, fast):
+        if generation != self.generation:
+            self.dropped += 1
+            return
+        try:
+            if fast:
+                img = decode_fast_preview(image_path)
+            else:
+                with self.lock:
+                    img = self.entries.get(image_path)  # The prefetch may have beaten us to it
+                if img is None:
+                    img = decode_preview(image_path)
+                    self.put(image_path, img)
+            self.decoded += 1
+        except Exception as e:
+            print(f"Error loading preview '{image_path}': {e}")
+            return
+        if generation != self.generation:
+            self.dropped += 1
+            return
+        on_ready(img, generation, fast)
+
+    def put(self, image_path, img):
+        with self.lock:
+            old = self.entries.pop(image_path, None)
+            if old is not None:
+                self.total_bytes -= image_bytes(old)
+            self.entries[image_path] = img
+            self.total_bytes += image_bytes(img)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= image_bytes(evicted)
+                self.evictions += 1
+
+    def discard(self, image_path):
+        with self.lock:
+            old = self.entries.pop(image_path, None)
+            if old is not None:
+                self.total_bytes -= image_bytes(old)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.wanted = set()
+
+    def prefetch(self, image_paths):
+        # Nearest neighbours first, anything from an older request that hasn't started is dropped
+        with self.lock:
+            self.wanted = set(image_paths)
+            todo = [path for path in image_paths if path not in self.entries and path not in self.in_flight]
+            self.in_flight.update(todo)
+        for image_path in todo:
+            self.executor.submit(self._prefetch_one, image_path)
+
+    def _prefetch_one(self, image_path):
+        try:
+            with self.lock:
+                if image_path not in self.wanted or image_path in self.entries:
+                    return
+            img = decode_preview(image_path)
+            self.put(image_path, img)
+            self.prefetched += 1
+        except Exception as e:
+            print(f"Error prefetching preview '{image_path}': {e}")
+        finally:
+            with self.lock:
+                self.in_flight.discard(image_path)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.decoder.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "prefetched": self.prefetched,
+            "decoded on demand": self.decoded,
+            "dropped as stale": self.dropped,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+
+
+class MainThreadScheduler:
+    # Central queue for work that has to run on the Tk thread. Each tick drains the queue for
+    # at most budget_ms and then hands control back to the event loop, so input and redraws
+    # interleave with heavy work instead of waiting for thousands of after(0) callbacks.
+    #
+    # Work items are either plain callables or generators. A generator is a long task that
+    # yields after every small unit of work. Tasks run one after the other in the order they
+    # were started, but while one is running, callables posted meanwhile still get the first
+    # half of every tick instead of waiting for the task to finish.
+    def __init__(self, root, budget_ms=8, interval_ms=1):
+        self.root = root
+        self.budget = budget_ms / 1000.0
+        self.interval_ms = interval_ms
+        self.queue = deque()  # Callables with their args
+        self.tasks = deque()  # Generators with their on_done
+        self.progress_updates = {}  # Callback -> latest args, applied once per tick
+        self.lock = threading.Lock()
+        self.tick_scheduled = False
+        self.ticks = 0
+        self.items_run = 0
+
+    def post(self, callback, *args):
+        # Safe to call from any thread
+        self.queue.append((callback, args))
+        self._wake()
+
+    def run_task(self, generator, on_done=None):
+        self.tasks.append((generator, on_done))
+        self._wake()
+
+    def after_tasks(self, callback, *args):
+        # Runs the callback once every task started so far has finished
+        self.run_task(iter(()), lambda: callback(*args))
+
+    def progress(self, callback, *args):
+        # Only the latest value per callback is applied, at the end of the tick
+        with self.lock:
+            self.progress_updates[callback] = args
+        self._wake()
+
+    def pending(self):
+        return len(self.queue) + len(self.tasks)
+
+    def _wake(self):
+        with self.lock:
+            if self.tick_scheduled:
+                return
+            self.tick_scheduled = True
+        self.root.after(0, self._tick)
+
+    def _tick(self):
+        started = time.perf_counter()
+        deadline = started + self.budget
+        self.ticks += 1
+        self._drain(started + self.budget / 2 if self.tasks else deadline)
+        while self.tasks and time.perf_counter() < deadline:
+            generator, on_done = self.tasks[0]
+            if self._step(generator, deadline):
+                break  # Out of time, the task stays at the front
+            self.tasks.popleft()
+            if on_done:
+                self._run(on_done, ())
+        self._drain(deadline)
+
+        with self.lock:
+            updates, self.progress_updates = self.progress_updates, {}
+        for callback, args in updates.items():
+            self._run(callback, args)
+
+        with self.lock:
+            if self.queue or self.tasks or self.progress_updates:
+                self.root.after(self.interval_ms, self._tick)
+            else:
+                self.tick_scheduled = False
+
+    def _drain(self, deadline):
+        while self.queue and time.perf_counter() < deadline:
+            callback, args = self.queue.popleft()
+            self._run(callback, args)
+
+    def _step(self, generator, deadline):
+        # Advances a task until it finishes (False) or the time slice runs out (True), by
+        # at least one step so a busy queue can't stall it
+        while True:
+            try:
+                next(generator)
+                self.items_run += 1
+            except StopIteration:
+                return False
+            except Exception as e:
+                print(f"Error in scheduled task: {e}")
+                return False
+            if time.perf_counter() >= deadline:
+                return True
+
+    def _run(self, callback, args):
+        try:
+            callback(*args)
+            self.items_run += 1
+        except Exception as e:
+            print(f"Error in scheduled callback: {e}")
+
+    def stats(self):
+        return {"ticks": self.ticks, "items run": self.items_run, "pending": self.pending()}
@@ -0,0 +1,40 @@
+import sys
+import time
+
+# Time from starting app.py until the first frame is drawn and the event loop takes input
+STARTUP_TARGET_MS = 300
+
+# Modules that should only be loaded once they're actually needed
+LAZY_MODULES = ('PIL', 'yaml', 'csv', 'thumbnail_loader')
+
+
+class StartupProfile:
+    # Startup milestones, measured from the first line of app.py and printed as they happen.
+    # The first frame mark is checked against STARTUP_TARGET_MS, together with the list of
+    # heavy modules that got imported before the window was usable.
+    def __init__(self, started, target_ms=STARTUP_TARGET_MS):
+        self.started = started
+        self.target_ms = target_ms
+        self.marks = []
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def mark(self, label):
+        elapsed = self.elapsed_ms()
+        self.marks.append((label, elapsed))
+        print(f"[startup] {label}: {elapsed:.0f} ms")
+        return elapsed
+
+    def watch_first_frame(self, root):
+        # Idle callbacks run after Tk's own pending geometry and redraw work, the timer after
+        # that fires once the loop is back to waiting for events
+        root.after_idle(lambda: root.after(0, self.first_frame))
+
+    def first_frame(self):
+        elapsed = self.mark("window interactive")
+        verdict = "ok" if elapsed <= self.target_ms else "over target"
+        print(f"[startup] target {self.target_ms} ms: {verdict}")
+        loaded = [name for name in LAZY_MODULES if name in sys.modules]
+        if loaded:
+            print(f"[startup] loaded before the window was interactive: {', '.join(loaded)}")
@@ -0,0 +1,129 @@
+import mmap
+import os
+import struct
+from array import array
+
+# File layout, all little endian:
+#   header      MAGIC, source mtime_ns, source size, salt, tag count, color table length
+#   colors      color names, utf-8, newline separated
+#   offsets     (count + 1) uint32 offsets into the string table
+#   categories  count uint16 indices into the color names
+#   strings     tags sorted by their utf-8 bytes, concatenated
+MAGIC = b'TAGCLR01'
+HEADER = struct.Struct('<8sqqIII')
+
+
+def write_color_db(db_path, tag_colors, source_stat, salt):
+    colors = sorted(set(tag_colors.values()))
+    color_index = {color: i for i, color in enumerate(colors)}
+    encoded = sorted((tag.encode('utf-8'), color_index[color]) for tag, color in tag_colors.items())
+
+    offsets = array('I', [0])
+    categories = array('H')
+    strings = bytearray()
+    for tag, category in encoded:
+        strings += tag
+        offsets.append(len(strings))
+        categories.append(category)
+    color_table = '\n'.join(colors).encode('utf-8')
+
+    # Written next to the target and swapped in, so a crash never leaves half a database behind
+    tmp_path = db_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, source_stat.st_mtime_ns, source_stat.st_size, salt, len(encoded), len(color_table)))
+        f.write(color_table)
+        f.write(offsets.tobytes())
+        f.write(categories.tobytes())
+        f.write(strings)
+    os.replace(tmp_path, db_path)
+
+
+class TagColorDB:
+    # Read-only tag -> color lookup backed by a memory-mapped compiled scheme. Opening one is
+    # a header read, lookups binary search the sorted string table. Results are memoized since
+    # a folder only uses a small part of the vocabulary, and colors assigned during the
+    # session live in an override dict until the source is recompiled.
+    def __init__(self, db_path=None):
+        self.overrides = {}
+        self.memo = {}
+        self.count = 0
+        self.file = None
+        self.mm = None
+        if db_path:
+            self._open(db_path)
+
+    def _open(self, db_path):
+        self.file = open(db_path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, _, self.count, colors_length = HEADER.unpack_from(self.mm, 0)
+        position = HEADER.size
+        self.colors = self.mm[position:position + colors_length].decode('utf-8').split('\n')
+        position += colors_length
+        self.offsets = memoryview(self.mm)[position:position + 4 * (self.count + 1)].cast('I')
+        position += 4 * (self.count + 1)
+        self.categories = memoryview(self.mm)[position:position + 2 * self.count].cast('H')
+        self.strings_start = position + 2 * self.count
+
+    @staticmethod
+    def is_fresh(db_path, source_stat, salt):
+        try:
+            with open(db_path, 'rb') as f:
+                header = f.read(HEADER.size)
+            magic, mtime_ns, size, stored_salt, _, _ = HEADER.unpack(header)
+        except (OSError, struct.error):
+            return False
+        return magic == MAGIC and mtime_ns == source_stat.st_mtime_ns and size == source_stat.st_size and stored_salt == salt
+
+    @classmethod
+    def load(cls, source_path, cache_dir, parse, salt=0):
+        # Opens the compiled form of source_path, recompiling it with parse(source_path) -> dict
+        # first if the source changed since it was built
+        source_stat = os.stat(source_path)
+        db_path = os.path.join(cache_dir, os.path.basename(source_path) + '.tagdb')
+        if not cls.is_fresh(db_path, source_stat, salt):
+            os.makedirs(cache_dir, exist_ok=True)
+            write_color_db(db_path, parse(source_path), source_stat, salt)
+        return cls(db_path)
+
+    def _find(self, tag):
+        key = tag.encode('utf-8')
+        offsets, mm, start = self.offsets, self.mm, self.strings_start
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[start + offsets[mid]:start + offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and mm[start + offsets[lo]:start + offsets[lo + 1]] == key:
+            return self.colors[self.categories[lo]]
+        return None
+
+    def get(self, tag, default=None):
+        color = self.overrides.get(tag)
+        if color is not None:
+            return color
+        if tag in self.memo:
+            color = self.memo[tag]
+        else:
+            color = self._find(tag) if self.mm is not None else None
+            self.memo[tag] = color
+        return default if color is None else color
+
+    def __contains__(self, tag):
+        return self.get(tag) is not None
+
+    def __setitem__(self, tag, color):
+        self.overrides[tag] = color
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        # Release the mapping, Windows won't let the file be replaced while it's mapped
+        if self.mm is not None:
+            self.offsets.release()
+            self.categories.release()
+            self.mm.close()
+            self.file.close()
+            self.mm = None
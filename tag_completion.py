@@ -0,0 +1,292 @@
+import heapq
+import mmap
+import os
+import re
+import struct
+import time
+from array import array
+from bisect import bisect_left
+
+# Compiled vocabulary layout, all little endian:
+#   header      MAGIC, source mtime_ns, source size, tag count, key count, prefix count
+#   tags        (tag count + 1) uint32 string offsets, tag count uint32 post counts, strings
+#   keys        (key count + 1) uint32 string offsets, key count uint32 tag ids, strings
+#   prefixes    (prefix count + 1) uint32 string offsets, prefix count * TOP_COUNT uint32 tag ids, strings
+# Tags are sorted by post count, most popular first, so a smaller tag id means a more
+# popular tag. Keys are the normalized tags and aliases, sorted by their utf-8 bytes, each
+# pointing at its canonical tag. Prefixes hold the most popular tags for every tag prefix of
+# up to PREFIX_LENGTH characters, those ranges are too wide to rank on every keystroke.
+MAGIC = b'TAGCMP02'
+HEADER = struct.Struct('<8sqqIII')
+PREFIX_LENGTH = 3
+TOP_COUNT = 12
+NO_TAG = 0xFFFFFFFF
+
+
+def normalize(tag):
+    return tag.strip().lower().replace('_', ' ')
+
+
+def _string_table(strings):
+    offsets = array('I', [0])
+    data = bytearray()
+    for string in strings:
+        data += string
+        offsets.append(len(data))
+    return offsets, data
+
+
+def parse_vocabulary(csv_path):
+    # (tag, post count, aliases) rows of a tagcomplete style CSV
+    import csv
+    rows = []
+    with open(csv_path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) < 3:
+                continue
+            tag, _, count = row[:3]
+            aliases = row[3].strip('"').split(',') if len(row) > 3 and row[3] else []
+            rows.append((tag, int(count) if count.isdigit() else 0, aliases))
+    return rows
+
+
+def write_vocabulary(db_path, rows, source_stat):
+    rows = sorted(rows, key=lambda row: -row[1])
+    keys = {}  # Normalized key -> tag id, the most popular tag wins a shared alias
+    for tag_id, (tag, _, aliases) in enumerate(rows):
+        for name in [tag] + aliases:
+            key = normalize(name).encode('utf-8')
+            if key and key not in keys:
+                keys[key] = tag_id
+    sorted_keys = sorted(keys)
+
+    # Only canonical tags count for the short prefixes, after one to three letters an alias
+    # match would just look like a random suggestion
+    tops = {}  # Prefix -> tag ids
+    for tag_id, (tag, _, _) in enumerate(rows):
+        text = normalize(tag)
+        for length in range(1, min(len(text), PREFIX_LENGTH) + 1):
+            tops.setdefault(text[:length].encode('utf-8'), []).append(tag_id)
+    prefixes = sorted(tops)
+    top_ids = array('I')
+    for prefix in prefixes:
+        best = tops[prefix][:TOP_COUNT]  # Tag ids were appended in popularity order
+        top_ids.extend(best + [NO_TAG] * (TOP_COUNT - len(best)))
+
+    tag_offsets, tag_strings = _string_table(tag.encode('utf-8') for tag, _, _ in rows)
+    counts = array('I', (min(count, NO_TAG) for _, count, _ in rows))
+    key_offsets, key_strings = _string_table(sorted_keys)
+    targets = array('I', (keys[key] for key in sorted_keys))
+    prefix_offsets, prefix_strings = _string_table(prefixes)
+
+    # Written next to the target and swapped in, like the compiled color schemes
+    tmp_path = db_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, source_stat.st_mtime_ns, source_stat.st_size, len(rows), len(sorted_keys), len(prefixes)))
+        for part in (tag_offsets, counts, tag_strings, key_offsets, targets, key_strings, prefix_offsets, top_ids, prefix_strings):
+            f.write(part if isinstance(part, bytearray) else part.tobytes())
+    os.replace(tmp_path, db_path)
+
+
+class StringTable:
+    # Offsets and concatenated utf-8 strings inside a mapped file
+    def __init__(self, mm, position, count, strings_position):
+        self.mm = mm
+        self.offsets = memoryview(mm)[position:position + 4 * (count + 1)].cast('I')
+        self.start = strings_position
+        self.count = count
+
+    def __getitem__(self, index):
+        return self.mm[self.start + self.offsets[index]:self.start + self.offsets[index + 1]]
+
+    def size(self):
+        return self.offsets[self.count]
+
+    def bisect(self, key, prefix=False):
+        # First index whose string is >= key, or whose leading bytes are > key with prefix=True
+        lo, hi = 0, self.count
+        length = len(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self[mid]
+            if (value[:length] <= key) if prefix else (value < key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def release(self):
+        self.offsets.release()
+
+
+class Vocabulary:
+    # Read-only, memory-mapped completion index of one scheme CSV. Opening it only reads the
+    # header, a lookup is a binary search for the prefix range in the sorted keys and a
+    # pass over the tag ids in that range, or a table lookup for very short prefixes.
+    def __init__(self, db_path):
+        self.file = open(db_path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, tag_count, key_count, prefix_count = HEADER.unpack_from(self.mm, 0)
+        position = HEADER.size
+        self.tags = StringTable(self.mm, position, tag_count, position + 8 * tag_count + 4)
+        self.counts = memoryview(self.mm)[position + 4 * (tag_count + 1):position + 8 * tag_count + 4].cast('I')
+        position = self.tags.start + self.tags.size()
+        self.keys = StringTable(self.mm, position, key_count, position + 8 * key_count + 4)
+        self.targets = memoryview(self.mm)[position + 4 * (key_count + 1):position + 8 * key_count + 4].cast('I')
+        position = self.keys.start + self.keys.size()
+        top_position = position + 4 * (prefix_count + 1)
+        self.prefixes = StringTable(self.mm, position, prefix_count, top_position + 4 * TOP_COUNT * prefix_count)
+        self.tops = memoryview(self.mm)[top_position:top_position + 4 * TOP_COUNT * prefix_count].cast('I')
+
+    @staticmethod
+    def is_fresh(db_path, source_stat):
+        try:
+            with open(db_path, 'rb') as f:
+                magic, mtime_ns, size, _, _, _ = HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            return False
+        return magic == MAGIC and mtime_ns == source_stat.st_mtime_ns and size == source_stat.st_size
+
+    @classmethod
+    def load(cls, source_path, cache_dir):
+        source_stat = os.stat(source_path)
+        db_path = os.path.join(cache_dir, os.path.basename(source_path) + '.complete')
+        if not cls.is_fresh(db_path, source_stat):
+            os.makedirs(cache_dir, exist_ok=True)
+            write_vocabulary(db_path, parse_vocabulary(source_path), source_stat)
+        return cls(db_path)
+
+    def complete(self, prefix, limit):
+        # (tag, post count, matched alias or None), most popular first
+        key = normalize(prefix).encode('utf-8')
+        if not key:
+            return []
+        if len(key.decode('utf-8')) <= PREFIX_LENGTH:
+            index = self.prefixes.bisect(key)
+            if index >= self.prefixes.count or self.prefixes[index] != key:
+                return []
+            tag_ids = [tag_id for tag_id in self.tops[index * TOP_COUNT:(index + 1) * TOP_COUNT] if tag_id != NO_TAG]
+            lo = hi = None
+        else:
+            lo, hi = self.keys.bisect(key), self.keys.bisect(key, prefix=True)
+            tag_ids = heapq.nsmallest(limit, set(self.targets[lo:hi]))
+
+        results = []
+        for tag_id in tag_ids[:limit]:
+            tag = self.tags[tag_id].decode('utf-8')
+            alias = None
+            if lo is not None and not normalize(tag).encode('utf-8').startswith(key):
+                alias = self.keys[lo + list(self.targets[lo:hi]).index(tag_id)].decode('utf-8')
+            results.append((tag, self.counts[tag_id], alias))
+        return results
+
+    def close(self):
+        for table in (self.tags, self.keys, self.prefixes):
+            table.release()
+        for view in (self.counts, self.targets, self.tops):
+            view.release()
+        self.mm.close()
+        self.file.close()
+
+
+class DatasetTags:
+    # Sorted normalized tags of the loaded dataset, rebuilt when its vocabulary grew
+    def __init__(self):
+        self.dataset = None
+        self.size = -1
+        self.keys = []
+        self.tag_ids = []
+
+    def complete(self, dataset, prefix, limit):
+        vocabulary = dataset.vocabulary
+        if dataset is not self.dataset or len(vocabulary) != self.size:
+            entries = sorted((normalize(tag), tag_id) for tag_id, tag in enumerate(vocabulary.tags))
+            self.keys = [key for key, _ in entries]
+            self.tag_ids = [tag_id for _, tag_id in entries]
+            self.dataset, self.size = dataset, len(vocabulary)
+        key = normalize(prefix)
+        if not key:
+            return []
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + '\U0010ffff', lo)
+        frequencies = dataset.frequencies
+        best = heapq.nlargest(limit, self.tag_ids[lo:hi], key=lambda tag_id: frequencies.get(tag_id, 0))
+        return [(vocabulary[tag_id], frequencies.get(tag_id, 0)) for tag_id in best if frequencies.get(tag_id, 0)]
+
+
+TERM_START = re.compile(r'.*(?:[,(]|(?:^|\s)(?:AND|OR|NOT)\s)\s*"?', re.S)
+
+
+def current_term(text, cursor):
+    # (start, prefix) of the tag being typed at cursor: everything since the last comma,
+    # opening parenthesis or query operator
+    match = TERM_START.match(text, 0, cursor)
+    start = match.end() if match else len(text[:cursor]) - len(text[:cursor].lstrip())
+    return start, text[start:cursor]
+
+
+class TagCompleter:
+    # Suggestions for a typed prefix: tags of the loaded folder first, by how often they're
+    # used there, then the vocabularies of all scheme CSVs by post count. Aliases complete to
+    # their canonical tag. Scheme tags are written with spaces or underscores to match what
+    # was typed, or the style most of the folder's tags use.
+    def __init__(self):
+        self.vocabularies = []
+        self.dataset_tags = DatasetTags()
+        self.lookups = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+
+    def set_vocabularies(self, vocabularies):
+        old, self.vocabularies = self.vocabularies, vocabularies
+        for vocabulary in old:
+            vocabulary.close()
+
+    def complete(self, dataset, prefix, limit=10):
+        # (tag to insert, label to show) pairs
+        started = time.perf_counter()
+        prefix = prefix.strip()
+        suggestions = []
+        seen = set()
+        for tag, frequency in self.dataset_tags.complete(dataset, prefix, limit):
+            seen.add(normalize(tag))
+            suggestions.append((tag, f"{tag}  ({frequency} here)"))
+
+        if len(suggestions) < limit and self.vocabularies:
+            underscores = self._use_underscores(dataset, prefix)
+            matches = []
+            for vocabulary in self.vocabularies:
+                matches.extend(vocabulary.complete(prefix, limit))
+            matches.sort(key=lambda match: -match[1])
+            for tag, count, alias in matches:
+                key = normalize(tag)
+                if key in seen:
+                    continue
+                seen.add(key)
+                tag = tag.replace(' ', '_') if underscores else tag.replace('_', ' ')
+                label = f"{alias} → {tag}" if alias else tag
+                suggestions.append((tag, f"{label}  ({count:,})"))
+                if len(suggestions) == limit:
+                    break
+
+        self.lookups += 1
+        self.last_ms = (time.perf_counter() - started) * 1000
+        self.max_ms = max(self.max_ms, self.last_ms)
+        return suggestions
+
+    def _use_underscores(self, dataset, prefix):
+        if '_' in prefix:
+            return True
+        if ' ' in prefix:
+            return False
+        tags = dataset.vocabulary.tags[:2000]
+        return sum('_' in tag for tag in tags) > sum(' ' in tag for tag in tags)
+
+    def stats(self):
+        return {
+            "vocabularies": len(self.vocabularies),
+            "keys": sum(vocabulary.keys.count for vocabulary in self.vocabularies),
+            "lookups": self.lookups,
+            "last lookup ms": round(self.last_ms, 2),
+            "max lookup ms": round(self.max_ms, 2),
+        }
@@ -0,0 +1,278 @@
+import time
+
+import numpy as np
+
+
+def snapshot(dataset):
+    # (tag ids of every live image concatenated, their counts, vocabulary size). Copied out
+    # of the tag store on the main thread, so the counting can run on another one.
+    store = dataset.store
+    live = np.array(dataset.index.live, dtype=np.int64)
+    offsets = np.array(store.offsets, dtype=np.int64)[live]
+    lengths = np.array(store.lengths, dtype=np.int64)[live]
+    starts = np.cumsum(lengths) - lengths
+    positions = np.repeat(offsets - starts, lengths) + np.arange(int(lengths.sum()))
+    return np.array(store.buffer, dtype=np.int64)[positions], lengths, len(dataset.vocabulary)
+
+
+def _unique_counts(keys):
+    # np.unique(keys, return_counts=True), sorting is quicker than its hash table here
+    keys = np.sort(keys)
+    starts = np.flatnonzero(np.concatenate(([len(keys) > 0], keys[1:] != keys[:-1])))
+    return keys[starts], np.diff(np.append(starts, len(keys)))
+
+
+def _reduce(keys, weights):
+    # Sums the weights of equal keys, (unique sorted keys, sums)
+    order = np.argsort(keys, kind='stable')
+    keys, weights = keys[order], weights[order]
+    starts = np.flatnonzero(np.concatenate(([len(keys) > 0], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(weights, starts) if len(keys) else weights
+
+
+def count_pairs(flat, lengths, tag_count, chunk_size=1 << 20):
+    # Symmetric co-occurrence matrix of a snapshot as CSR arrays (indptr, indices, counts),
+    # plus the number of images per tag and the number of images. Duplicate tags of an
+    # image count once, the diagonal is left out.
+    image_count = len(lengths)
+    images = np.repeat(np.arange(image_count), lengths)
+    keys, _ = _unique_counts(images * tag_count + flat)  # Sorted by image, then tag
+    images, tags = keys // tag_count, keys % tag_count
+    lengths = np.bincount(images, minlength=image_count)
+    df = np.bincount(tags, minlength=tag_count)
+    try:
+        from scipy import sparse
+    except ImportError:
+        sparse = None
+
+    if sparse is not None:
+        incidence = sparse.csr_matrix((np.ones(len(tags), np.int32), tags, np.concatenate(([0], np.cumsum(lengths)))),
+                                      shape=(image_count, tag_count))
+        matrix = (incidence.T @ incidence).tocsr()
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        return matrix.indptr.astype(np.int64), matrix.indices.astype(np.int32), matrix.data.astype(np.int32), df, image_count
+
+    # Pairs (a, b) with a < b of every image: the tag at each position paired with the one
+    # step positions further on, for every step that stays inside the image. Done a block
+    # of images at a time, the raw pair keys of a block fit in chunk_size and are counted
+    # right away, the block counts are summed whenever they pile up.
+    ends = np.cumsum(lengths)
+    pair_keys, pair_counts = np.zeros(0, np.int64), np.zeros(0, np.int64)
+    block_keys, block_counts, block_size = [], [], 0
+    pairs_before = np.cumsum(lengths * (lengths - 1) // 2)
+    start_image = 0
+    while start_image < image_count:
+        end_image = max(start_image + 1, int(np.searchsorted(pairs_before, pairs_before[start_image] + chunk_size)))
+        first, last = ends[start_image] - lengths[start_image], ends[end_image - 1]
+        block = tags[first:last]
+        remaining = np.repeat(ends[start_image:end_image] - first, lengths[start_image:end_image]) - np.arange(len(block)) - 1
+        positions = np.flatnonzero(remaining > 0)
+        pending = []
+        step = 1
+        while len(positions):
+            pending.append(block[positions] * tag_count + block[positions + step])
+            step += 1
+            positions = positions[remaining[positions] >= step]
+        if pending:
+            keys, counts = _unique_counts(np.concatenate(pending))
+            block_keys.append(keys)
+            block_counts.append(counts)
+            block_size += len(keys)
+        start_image = end_image
+        if block_size >= 4 * chunk_size or (start_image >= image_count and block_keys):
+            pair_keys, pair_counts = _reduce(np.concatenate([pair_keys] + block_keys), np.concatenate([pair_counts] + block_counts))
+            block_keys, block_counts, block_size = [], [], 0
+
+    first, second = pair_keys // tag_count, pair_keys % tag_count
+    rows, columns = np.concatenate((first, second)), np.concatenate((second, first))
+    order = np.lexsort((columns, rows))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=tag_count))))
+    counts = np.concatenate((pair_counts, pair_counts))[order]
+    return indptr, columns[order].astype(np.int32), counts.astype(np.int32), df, image_count
+
+
+class Cooccurrence:
+    # How often tags appear on the same image, for suggesting tags an image probably lacks
+    # and flagging those that don't fit the rest. The counts are built in one vectorized
+    # pass over a snapshot of the dataset (count_pairs, on scipy.sparse when it's installed)
+    # into a CSR matrix whose row a holds every tag seen together with a and on how many
+    # images. The Dataset reports every edit from the snapshot on through update(). Edits
+    # change the matrix counts in place, pairs the matrix has no slot for yet go into the
+    # small new_* arrays, so lookups cost about the same however many edits were made. Once more than
+    # rebuild_after images changed or max_new_pairs new pairs piled up, a bulk edit most
+    # likely, the matrix is stale until it's rebuilt.
+    def __init__(self, rebuild_after=1000, max_new_pairs=4096):
+        self.ready = False  # Set once the counted matrix arrives, see set_matrix
+        self.stale = False
+        self.indptr = np.zeros(1, np.int64)
+        self.indices = np.zeros(0, np.int32)
+        self.counts = np.zeros(0, np.int32)
+        self.df = np.zeros(0, np.int64)  # Images per tag id
+        self.images = 0
+        self.edits = []  # (old ids, new ids, images) reported before the matrix arrived
+        # Pairs missing from the matrix, both ways, the first new_pair_count entries are used
+        self.new_rows = np.zeros(max_new_pairs, np.int64)
+        self.new_columns = np.zeros(max_new_pairs, np.int64)
+        self.new_counts = np.zeros(max_new_pairs, np.int64)
+        self.new_positions = {}  # (row, column) -> position in the new_* arrays
+        self.new_pair_count = 0
+        self.changed = 0
+        self.rebuild_after = rebuild_after
+        self.max_new_pairs = max_new_pairs
+        self.build_ms = 0
+        self.lookups = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+
+    def set_matrix(self, indptr, indices, counts, df, images, build_ms=0):
+        # Called on the main thread with the count_pairs result of the snapshot taken when
+        # this object was created, the edits reported since are applied on top
+        self.indptr, self.indices, self.counts, self.df, self.images = indptr, indices, counts, df, images
+        self.build_ms = build_ms
+        self.ready = True
+        edits, self.edits = self.edits, []
+        for old, new, images in edits:
+            self._apply(old, new, images)
+
+    def _mark_stale(self):
+        self.stale = True
+        self.edits = []
+        self.new_positions.clear()
+
+    def update(self, old_ids, new_ids, images=0):
+        # An image's tags went from old_ids to new_ids, images is 1 or -1 when it was added
+        # or removed
+        if self.stale:
+            return
+        old, new = set(old_ids), set(new_ids)
+        if old == new and not images:
+            return
+        self.changed += 1
+        if self.changed > self.rebuild_after:
+            self._mark_stale()
+        elif not self.ready:
+            self.edits.append((old, new, images))
+        else:
+            self._apply(old, new, images)
+
+    def _apply(self, old, new, images):
+        self.images += images
+        removed, added = old - new, new - old
+        for tag_id in removed:
+            self._grow(tag_id)
+            self.df[tag_id] -= 1
+            self._add_pairs(tag_id, old, removed, -1)
+        for tag_id in added:
+            self._grow(tag_id)
+            self.df[tag_id] += 1
+            self._add_pairs(tag_id, new, added, 1)
+
+    def _grow(self, tag_id):
+        if tag_id >= len(self.df):
+            self.df = np.pad(self.df, (0, max(tag_id + 1 - len(self.df), len(self.df) // 2)))
+
+    def _add_pairs(self, tag_id, others, skip, change):
+        # Pairs of tag_id with the others, once per pair when both are in skip
+        for other in others:
+            if other != tag_id and (other not in skip or other > tag_id):
+                self._add_pair(tag_id, other, change)
+                self._add_pair(other, tag_id, change)
+
+    def _add_pair(self, row, column, change):
+        if self.stale:
+            return
+        if row < len(self.indptr) - 1:
+            start, end = self.indptr[row], self.indptr[row + 1]
+            position = start + int(np.searchsorted(self.indices[start:end], column))
+            if position < end and self.indices[position] == column:
+                self.counts[position] += change
+                return
+        position = self.new_positions.get((row, column))
+        if position is None:
+            if self.new_pair_count == self.max_new_pairs:
+                self._mark_stale()
+                return
+            position = self.new_positions[row, column] = self.new_pair_count
+            self.new_rows[position], self.new_columns[position] = row, column
+            self.new_pair_count += 1
+        self.new_counts[position] += change
+
+    def suggest(self, tag_ids, limit=8, min_support=3, min_probability=0.3, min_lift=1.5, max_suspect_lift=0.25):
+        # ([(tag id, probability)] of likely missing tags, [tag id] of tags that don't fit).
+        # A candidate's probability is the highest P(candidate | tag) over the image's tags,
+        # counting only pairs seen on at least min_support images, and it has to be at least
+        # min_lift times the candidate's overall rate (positive PMI). A tag is suspect when
+        # the mean P(tag | other tag) over the rest is below max_suspect_lift times its
+        # overall rate. Tags on fewer than min_support images aren't suggested or judged.
+        started = time.perf_counter()
+        if not self.ready or self.stale or self.images <= 0:
+            return [], []
+        df = self.df
+        tag_count = len(df)
+        tag_ids = np.unique(np.asarray(tag_ids, dtype=np.int64))
+        tag_ids = tag_ids[tag_ids < tag_count]
+        tag_ids = tag_ids[df[tag_ids] > 0]
+        if len(tag_ids) < 2:
+            return [], []
+
+        # Row by row over the image's tags: the best supported P(candidate | tag) for every
+        # candidate, and P(tag | other tag) summed over the image's own tags for the fit
+        probability = np.zeros(tag_count)
+        fit = np.zeros(len(tag_ids))
+        indptr, indices, counts = self.indptr, self.indices, self.counts
+        for tag_id in tag_ids[tag_ids < len(indptr) - 1].tolist():
+            start, end = indptr[tag_id], indptr[tag_id + 1]
+            if start == end:
+                continue
+            columns, row_counts = indices[start:end], counts[start:end]
+            conditional = row_counts * (1.0 / df[tag_id])
+            keep = row_counts >= min_support
+            supported = columns[keep]
+            probability[supported] = np.maximum(probability[supported], conditional[keep])
+            found = np.minimum(np.searchsorted(columns, tag_ids), len(columns) - 1)
+            fit += np.where(columns[found] == tag_ids, conditional[found], 0)
+
+        # Plus the pairs the matrix has no slot for, at most max_new_pairs of them
+        used = self.new_pair_count
+        if used:
+            new = np.isin(self.new_rows[:used], tag_ids) & (self.new_columns[:used] < tag_count)
+            rows, columns, new_counts = self.new_rows[:used][new], self.new_columns[:used][new], self.new_counts[:used][new]
+            conditional = new_counts / df[rows]
+            supported = new_counts >= min_support
+            np.maximum.at(probability, columns[supported], conditional[supported])
+            own = np.isin(columns, tag_ids)
+            np.add.at(fit, np.searchsorted(tag_ids, columns[own]), conditional[own])
+
+        rate = df / self.images
+        candidates = np.flatnonzero(probability >= min_probability)
+        candidates = candidates[(df[candidates] >= min_support) & (probability[candidates] >= min_lift * rate[candidates])]
+        candidates = candidates[~np.isin(candidates, tag_ids)]
+        best = candidates[np.argsort(-probability[candidates], kind='stable')[:limit]]
+        suggestions = [(tag_id, float(probability[tag_id])) for tag_id in best.tolist()]
+
+        suspects = []
+        if len(tag_ids) >= 4:
+            # Rows leave out the tag itself, the diagonal is empty
+            fit /= len(tag_ids) - 1
+            unfit = (df[tag_ids] >= min_support) & (fit < max_suspect_lift * rate[tag_ids])
+            suspects = tag_ids[unfit].tolist()
+
+        self.lookups += 1
+        self.last_ms = (time.perf_counter() - started) * 1000
+        self.max_ms = max(self.max_ms, self.last_ms)
+        return suggestions, suspects
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "stale": self.stale,
+            "pairs": len(self.indices) // 2,
+            "changed images": self.changed,
+            "new pairs": self.new_pair_count // 2,
+            "build ms": self.build_ms,
+            "lookups": self.lookups,
+            "last lookup ms": round(self.last_ms, 2),
+            "max lookup ms": round(self.max_ms, 2),
+        }
@@ -0,0 +1,211 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Bit positions set in every byte value, used to turn bitsets back into image ids
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def ids_to_bitset(ids):
+    if not ids:
+        return 0
+    buffer = bytearray((max(ids) >> 3) + 1)
+    for image_id in ids:
+        buffer[image_id >> 3] |= 1 << (image_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def bitset_to_ids(bits):
+    # Ascending image ids of all set bits
+    ids = []
+    data = bits.to_bytes((bits.bit_length() + 7) >> 3, 'little')
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index << 3
+            ids.extend(base + bit for bit in _BYTE_BITS[byte])
+    return ids
+
+
+class TagIndex:
+    # Inverted index from tag to the ids of the images that have it. Postings are kept as
+    # sorted array('I') lists (4 bytes per tag instance), filters are evaluated on Python int
+    # bitsets built from them on demand. Recently used bitsets are cached and dropped as soon
+    # as their posting list changes.
+    def __init__(self, bitset_cache_size=512):
+        self.postings = {}  # Tag -> sorted array('I') of image ids
+        self.live = array('I')  # Ids of all indexed images, an image can have no tags at all
+        self.bitset_cache = OrderedDict()
+        self.bitset_cache_size = bitset_cache_size
+        self.live_bits = None
+        self.version = 0  # Bumped on every change, for caches built on top of the index
+
+    def _insert(self, ids, image_id):
+        # Loading appends in id order, so this is almost always the fast path
+        if not ids or ids[-1] < image_id:
+            ids.append(image_id)
+            return True
+        position = bisect_left(ids, image_id)
+        if position < len(ids) and ids[position] == image_id:
+            return False
+        ids.insert(position, image_id)
+        return True
+
+    def _delete(self, ids, image_id):
+        position = bisect_left(ids, image_id)
+        if position < len(ids) and ids[position] == image_id:
+            del ids[position]
+            return True
+        return False
+
+    def add_image(self, image_id, tags):
+        self.version += 1
+        if self._insert(self.live, image_id):
+            self.live_bits = None
+        for tag in set(tags):
+            ids = self.postings.get(tag)
+            if ids is None:
+                ids = self.postings[tag] = array('I')
+            if self._insert(ids, image_id):
+                self.bitset_cache.pop(tag, None)
+
+    def remove_image(self, image_id, tags):
+        self.version += 1
+        if self._delete(self.live, image_id):
+            self.live_bits = None
+        self._remove_tags(image_id, set(tags))
+
+    def update(self, image_id, old_tags, new_tags):
+        old_tags, new_tags = set(old_tags), set(new_tags)
+        if old_tags != new_tags:
+            self.version += 1
+        self._remove_tags(image_id, old_tags - new_tags)
+        for tag in new_tags - old_tags:
+            ids = self.postings.get(tag)
+            if ids is None:
+                ids = self.postings[tag] = array('I')
+            if self._insert(ids, image_id):
+                self.bitset_cache.pop(tag, None)
+
+    def _remove_tags(self, image_id, tags):
+        for tag in tags:
+            ids = self.postings.get(tag)
+            if ids is not None and self._delete(ids, image_id):
+                self.bitset_cache.pop(tag, None)
+                if not ids:
+                    del self.postings[tag]
+
+    def clear(self):
+        self.version += 1
+        self.postings.clear()
+        self.live = array('I')
+        self.bitset_cache.clear()
+        self.live_bits = None
+
+    def count(self, tag):
+        ids = self.postings.get(tag)
+        return len(ids) if ids is not None else 0
+
+    def image_count(self):
+        return len(self.live)
+
+    def bitset(self, tag):
+        bits = self.bitset_cache.get(tag)
+        if bits is not None:
+            self.bitset_cache.move_to_end(tag)
+            return bits
+        bits = ids_to_bitset(self.postings.get(tag, ()))
+        self.bitset_cache[tag] = bits
+        if len(self.bitset_cache) > self.bitset_cache_size:
+            self.bitset_cache.popitem(last=False)
+        return bits
+
+    def all_bits(self):
+        if self.live_bits is None:
+            self.live_bits = ids_to_bitset(self.live)
+        return self.live_bits
+
+    def all_of(self, tags):
+        # Intersect starting from the rarest tag so the working set shrinks fastest
+        tags = sorted(set(tags), key=self.count)
+        if not tags:
+            return self.all_bits()
+        bits = self.bitset(tags[0])
+        for tag in tags[1:]:
+            if not bits:
+                break
+            bits &= self.bitset(tag)
+        return bits
+
+    def any_of(self, tags):
+        bits = 0
+        for tag in set(tags):
+            bits |= self.bitset(tag)
+        return bits
+
+    def match(self, pos_filters, neg_filters, pos_and, neg_and):
+        # Same semantics as the filter boxes: positive AND/OR, negative AND means "none of
+        # these tags", negative OR means "missing at least one of these tags"
+        bits = self.all_bits()
+        if pos_filters:
+            bits &= self.all_of(pos_filters) if pos_and else self.any_of(pos_filters)
+        if neg_filters and bits:
+            bits &= ~(self.any_of(neg_filters) if neg_and else self.all_of(neg_filters))
+        return bits
+
+    def common_tags(self):
+        # Tags every indexed image has
+        total = len(self.live)
+        return {tag for tag, ids in self.postings.items() if total and len(ids) == total}
+
+
+class TagFrequencies:
+    # Live tag -> occurrence count over the whole folder, updated by deltas whenever an
+    # image's tags change instead of rescanning every caption. Duplicate tags within one
+    # caption count once per occurrence, like the old full rescan did.
+    def __init__(self):
+        self.counts = {}
+
+    def get(self, tag, default=0):
+        return self.counts.get(tag, default)
+
+    def __getitem__(self, tag):
+        return self.counts.get(tag, 0)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def items(self):
+        return self.counts.items()
+
+    def add(self, tags):
+        counts = self.counts
+        for tag in tags:
+            counts[tag] = counts.get(tag, 0) + 1
+
+    def remove(self, tags):
+        counts = self.counts
+        for tag in tags:
+            remaining = counts.get(tag, 0) - 1
+            if remaining > 0:
+                counts[tag] = remaining
+            else:
+                counts.pop(tag, None)
+
+    def update(self, old_tags, new_tags):
+        self.remove(old_tags)
+        self.add(new_tags)
+
+    def clear(self):
+        self.counts.clear()
+
+    def verify(self, tag_lists):
+        # Consistency check against a full recount, raises AssertionError listing the first mismatches
+        expected = {}
+        for tags in tag_lists:
+            for tag in tags:
+                expected[tag] = expected.get(tag, 0) + 1
+        if expected != self.counts:
+            mismatches = [(tag, self.counts.get(tag, 0), expected.get(tag, 0))
+                          for tag in set(expected) | set(self.counts) if self.counts.get(tag, 0) != expected.get(tag, 0)]
+            raise AssertionError(f"Tag frequencies out of sync (tag, live, recount): {mismatches[:10]}")
+        return True
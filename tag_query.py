@@ -0,0 +1,435 @@
+import re
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+from tag_index import bitset_to_ids, ids_to_bitset
+
+# Filter box syntax, replacing the old comma separated tag list:
+#   (1girl AND (red_hair OR pink_hair)) AND NOT lowres
+#   score_*              tags matching a wildcard pattern, a term is one when it has a *,
+#                        ? then matches any single character too
+#   tags>40              images by tag count, also >=, <, <=, = and !=
+#   category:artist      images with at least one tag of that color scheme category
+#   width>=1024          image metadata: width, height, pixels, aspect and filesize (kb, mb
+#   aspect:1.5-1.8       and gb suffixes) compare like tags, or take an inclusive range
+#   format:png           format and mode (RGB, RGBA, P, L...) by name
+#   "tags>40"            quotes make anything a plain tag, \" and \\ inside them
+#   tags\>40, a\*b       so does a backslash, it makes the next character literal
+# Operators are upper case, NOT binds tightest, then AND, then OR. Commas join with the
+# AND/OR option next to the box, they bind loosest of all.
+#
+# This isn't fully compatible with the old list: a tag that reads as an operator (NOT),
+# a predicate (tags>3, category:x, width=1) or a pattern (has a *) has to be quoted or
+# escaped now, and so does a tag with a ')' inside parentheses. quote_tag does that for
+# tags put into a box by the app.
+KEYWORDS = ('AND', 'OR', 'NOT')
+COUNT_PATTERN = re.compile(r'tags\s*(>=|<=|!=|>|<|=)\s*(\d+)$')
+COUNT_TESTS = {
+    '>': lambda count, n: count > n,
+    '>=': lambda count, n: count >= n,
+    '<': lambda count, n: count < n,
+    '<=': lambda count, n: count <= n,
+    '=': lambda count, n: count == n,
+    '!=': lambda count, n: count != n,
+}
+CATEGORY_PREFIXES = ('category:', 'cat:')
+METADATA_FIELDS = r'(width|height|pixels|aspect|filesize)'
+NUMBER = r'(\d+(?:\.\d+)?)\s*(kb|mb|gb)?'
+METADATA_PATTERN = re.compile(METADATA_FIELDS + r'\s*(>=|<=|!=|>|<|=)\s*' + NUMBER + '$', re.I)
+METADATA_RANGE_PATTERN = re.compile(METADATA_FIELDS + r':\s*' + NUMBER + r'\s*-\s*' + NUMBER + '$', re.I)
+NAME_PREFIXES = ('format:', 'mode:')
+UNITS = {None: 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3}
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _keyword_at(text, position):
+    for keyword in KEYWORDS:
+        end = position + len(keyword)
+        if text.startswith(keyword, position) and (end == len(text) or text[end].isspace() or text[end] == '('):
+            return keyword
+    return None
+
+
+def tokenize(text):
+    # (kind, value) pairs. Terms can contain spaces and parentheses, "lucy (cyberpunk)" is
+    # one tag: a term only ends at a comma, at a ')' closing a group it's in, or before an
+    # operator keyword. A ')' outside of any group is literal, ";)" is a tag too.
+    tokens = []
+    groups = 0  # Open '(' tokens
+    position, length = 0, len(text)
+    while position < length:
+        char = text[position]
+        if char.isspace():
+            position += 1
+        elif char in '(,' or (char == ')' and groups):
+            groups += {'(': 1, ')': -1}.get(char, 0)
+            tokens.append((char, char))
+            position += 1
+        elif char == '"':
+            start, chars = position, []
+            position += 1
+            while position < length and text[position] != '"':
+                if text[position] == '\\' and position + 1 < length:
+                    position += 1
+                chars.append(text[position])
+                position += 1
+            if position >= length:
+                raise QueryError(f"Unclosed quote at {start + 1}")
+            tokens.append(('TAG', ''.join(chars)))
+            position += 1
+        elif _keyword_at(text, position):
+            keyword = _keyword_at(text, position)
+            tokens.append((keyword, keyword))
+            position += len(keyword)
+        else:
+            start, depth = position, 0
+            while position < length:
+                char = text[position]
+                if char == '\\':
+                    position += 2  # Escaped, whatever it is
+                    continue
+                if char == ',':
+                    break
+                if char == '(':
+                    depth += 1
+                elif char == ')':
+                    if depth == 0 and groups:
+                        break
+                    depth = max(depth - 1, 0)
+                elif char.isspace():
+                    following = position + 1
+                    while following < length and text[following].isspace():
+                        following += 1
+                    if _keyword_at(text, following):
+                        break
+                position += 1
+            tokens.append(('TERM', text[start:position].strip()))
+    return tokens
+
+
+def _unescape(value):
+    # (value with backslash escapes resolved, fnmatch pattern if it has an unescaped *
+    # or None). Escaped wildcards and [ are bracketed in the pattern, so they match only
+    # themselves.
+    text, pattern, wildcard = [], [], False
+    chars = iter(value)
+    for char in chars:
+        escaped = char == '\\'
+        if escaped:
+            char = next(chars, '\\')
+        text.append(char)
+        if char in '*?' and not escaped:
+            wildcard = wildcard or char == '*'
+            pattern.append(char)
+        else:
+            pattern.append('[' + char + ']' if char in '*?[' else char)
+    return ''.join(text), ''.join(pattern) if wildcard else None
+
+
+def _number(digits, unit):
+    number = float(digits) * UNITS[unit and unit.lower()]
+    return int(number) if number.is_integer() else number
+
+
+def _term(value):
+    text, pattern = _unescape(value)
+    if pattern is not None:
+        return ('glob', pattern)
+    if text != value:
+        return ('tag', text)  # Escapes make it a tag, whatever it looks like
+    match = COUNT_PATTERN.match(value)
+    if match:
+        return ('count', match.group(1), int(match.group(2)))
+    match = METADATA_PATTERN.match(value)
+    if match:
+        field, op, digits, unit = match.groups()
+        return ('metadata', field.lower(), op, _number(digits, unit))
+    match = METADATA_RANGE_PATTERN.match(value)
+    if match:
+        field, low, low_unit, high, high_unit = match.groups()
+        return ('metadata', field.lower(), 'between', (_number(low, low_unit), _number(high, high_unit or low_unit)))
+    for prefix in NAME_PREFIXES:
+        if value.lower().startswith(prefix):
+            return ('metadata', prefix[:-1], '=', value[len(prefix):].strip())
+    for prefix in CATEGORY_PREFIXES:
+        if value.startswith(prefix):
+            return ('category', value[len(prefix):].strip())
+    return ('tag', value)
+
+
+class _Parser:
+    def __init__(self, tokens, comma):
+        self.tokens = tokens
+        self.position = 0
+        self.comma = comma  # 'and' or 'or'
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.sequence()
+        if self.peek() is not None:
+            raise QueryError(f"Unexpected '{self.tokens[self.position][1]}'")
+        return node
+
+    def sequence(self):
+        # Empty items are skipped, like the old comma split did with "a, , b,"
+        items = []
+        while True:
+            if self.peek() not in (',', ')', None):
+                items.append(self.either())
+            if self.peek() != ',':
+                break
+            self.next()
+        if not items:
+            return None
+        return items[0] if len(items) == 1 else (self.comma, tuple(items))
+
+    def either(self):
+        items = [self.both()]
+        while self.peek() == 'OR':
+            self.next()
+            items.append(self.both())
+        return items[0] if len(items) == 1 else ('or', tuple(items))
+
+    def both(self):
+        items = [self.unary()]
+        while self.peek() == 'AND':
+            self.next()
+            items.append(self.unary())
+        return items[0] if len(items) == 1 else ('and', tuple(items))
+
+    def unary(self):
+        if self.peek() == 'NOT':
+            self.next()
+            return ('not', self.unary())
+        return self.primary()
+
+    def primary(self):
+        kind = self.peek()
+        if kind is None:
+            raise QueryError("Query ends where a tag was expected")
+        kind, value = self.next()
+        if kind == '(':
+            node = self.sequence()
+            if self.peek() != ')':
+                raise QueryError("Missing ')'")
+            self.next()
+            if node is None:
+                raise QueryError("Empty parentheses")
+            return node
+        if kind == 'TAG':
+            return ('tag', value)
+        if kind == 'TERM':
+            return _term(value)
+        raise QueryError(f"Unexpected '{value}'")
+
+
+def parse(text, comma='and'):
+    # Syntax tree of nested tuples, or None for an empty query
+    return _Parser(tokenize(text), comma).parse()
+
+
+def terms(node):
+    # Tag and wildcard terms of a query that aren't negated, for highlighting matching tags
+    if node is None:
+        return []
+    kind = node[0]
+    if kind in ('tag', 'glob'):
+        return [node]
+    if kind in ('and', 'or'):
+        return [term for child in node[1] for term in terms(child)]
+    return []
+
+
+def term_matches(term, tag):
+    return tag == term[1] if term[0] == 'tag' else fnmatchcase(tag, term[1])
+
+
+def quote_tag(tag):
+    # The tag as a filter term, quoted if it would otherwise read as an operator or predicate,
+    # or close a group it's put into (";)" works bare, but not in "(a, ;))")
+    try:
+        if parse(tag) == ('tag', tag) and parse('(' + tag + ')') == ('tag', tag):
+            return tag
+    except QueryError:
+        pass
+    return '"' + tag.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class QueryEngine:
+    # Evaluates parsed queries against a Dataset's tag index. Tags are resolved to ids and
+    # the tree is flattened into a canonical form, so the same subexpression written twice
+    # (or in another order) shares one cache entry. AND nodes intersect their children
+    # from the smallest estimated result up and stop as soon as the result is empty, NOT
+    # children of an AND are subtracted instead of being complemented on their own.
+    #
+    # Results of compound nodes, wildcards, categories, tag counts and metadata predicates
+    # are kept in an LRU cache that's dropped whenever the index or the image metadata
+    # changes. Single tags use the index's own bitset cache. Metadata predicates are whole
+    # column comparisons on ImageMetadata, images without metadata never match them.
+    def __init__(self, category_of=None, cache_size=256):
+        self.category_of = category_of  # Tag -> category name or None
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.matched_tags = {}  # Wildcard or category node -> tag ids
+        self.dataset = None
+        self.metadata = None
+        self.version = None
+        self.queries = 0
+        self.hits = 0
+        self.misses = 0
+        self.last_ms = 0.0
+        self.last_plan = None
+
+    def clear(self):
+        # Call when something outside the index changes, e.g. the color scheme
+        self.cache.clear()
+        self.matched_tags.clear()
+
+    def match(self, dataset, pos_query, neg_query, pos_and=True, neg_and=True, metadata=None):
+        # Image ids in load order, same box semantics as before: negative AND hides images
+        # that match any item, negative OR only those that match all of them
+        started = time.perf_counter()
+        positive = parse(pos_query, 'and' if pos_and else 'or')
+        negative = parse(neg_query, 'or' if neg_and else 'and')
+        if negative is not None:
+            negative = ('not', negative)
+        query = ('and', tuple(node for node in (positive, negative) if node is not None))
+
+        self._sync(dataset, metadata)
+        node = self._canonical(query)
+        self.last_plan = node
+        bits = self._evaluate(node)
+        self.queries += 1
+        self.last_ms = (time.perf_counter() - started) * 1000
+        return bitset_to_ids(bits)
+
+    def _sync(self, dataset, metadata):
+        version = (dataset.index.version, metadata.version if metadata is not None else None)
+        if dataset is not self.dataset or metadata is not self.metadata or version != self.version:
+            self.dataset, self.metadata, self.version = dataset, metadata, version
+            self.clear()
+
+    def _canonical(self, node):
+        kind = node[0]
+        if kind == 'tag':
+            tag_id = self.dataset.vocabulary.lookup(node[1])
+            return ('tag', -1 if tag_id is None else tag_id)  # Unknown tags match nothing
+        if kind == 'not':
+            child = self._canonical(node[1])
+            return child[1] if child[0] == 'not' else ('not', child)
+        if kind in ('and', 'or'):
+            children = set()
+            for child in node[1]:
+                child = self._canonical(child)
+                children.update(child[1] if child[0] == kind else (child,))
+            if len(children) == 1:
+                return children.pop()
+            return (kind, tuple(sorted(children, key=repr)))
+        return node
+
+    def _evaluate(self, node):
+        kind = node[0]
+        if kind == 'tag':
+            return self.dataset.index.bitset(node[1])
+        bits = self.cache.get(node)
+        if bits is not None:
+            self.cache.move_to_end(node)
+            self.hits += 1
+            return bits
+        self.misses += 1
+
+        index = self.dataset.index
+        if kind == 'and':
+            included = sorted((child for child in node[1] if child[0] != 'not'), key=self._estimate)
+            excluded = sorted((child[1] for child in node[1] if child[0] == 'not'), key=self._estimate, reverse=True)
+            bits = self._evaluate(included[0]) if included else index.all_bits()
+            for child in included[1:]:
+                if not bits:
+                    break
+                bits &= self._evaluate(child)
+            for child in excluded:
+                if not bits:
+                    break
+                bits &= ~self._evaluate(child)
+        elif kind == 'or':
+            bits = 0
+            for child in node[1]:
+                bits |= self._evaluate(child)
+        elif kind == 'not':
+            bits = index.all_bits() & ~self._evaluate(node[1])
+        elif kind in ('glob', 'category'):
+            bits = 0
+            for tag_id in self._matched_tags(node):
+                bits |= index.bitset(tag_id)
+        elif kind == 'count':
+            test, n = COUNT_TESTS[node[1]], node[2]
+            lengths = self.dataset.store.lengths
+            bits = ids_to_bitset([image_id for image_id in index.live if test(lengths[image_id], n)])
+        elif kind == 'metadata':
+            bits = self.metadata.bitset(*node[1:]) & index.all_bits() if self.metadata is not None else 0
+        else:
+            raise QueryError(f"Unknown query node {kind}")
+
+        self.cache[node] = bits
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return bits
+
+    def _matched_tags(self, node):
+        tag_ids = self.matched_tags.get(node)
+        if tag_ids is None:
+            tags = self.dataset.vocabulary.tags
+            postings = self.dataset.index.postings
+            if node[0] == 'glob':
+                pattern = node[1]
+                if pattern.endswith('*') and '*' not in pattern[:-1] and '?' not in pattern:
+                    prefix = pattern[:-1]
+                    tag_ids = [tag_id for tag_id in postings if tags[tag_id].startswith(prefix)]
+                else:
+                    tag_ids = [tag_id for tag_id in postings if fnmatchcase(tags[tag_id], pattern)]
+            else:
+                category_of = self.category_of or (lambda tag: None)
+                tag_ids = [tag_id for tag_id in postings if category_of(tags[tag_id]) == node[1]]
+            self.matched_tags[node] = tag_ids
+        return tag_ids
+
+    def _estimate(self, node):
+        # Expected number of matches, exact for cached results
+        index = self.dataset.index
+        kind = node[0]
+        if kind == 'tag':
+            return index.count(node[1])
+        bits = self.cache.get(node)
+        if bits is not None:
+            return bits.bit_count()
+        total = index.image_count()
+        if kind == 'and':
+            return min(self._estimate(child) for child in node[1])
+        if kind == 'or':
+            return min(sum(self._estimate(child) for child in node[1]), total)
+        if kind == 'not':
+            return total - self._estimate(node[1])
+        if kind in ('glob', 'category'):
+            return min(sum(index.count(tag_id) for tag_id in self._matched_tags(node)), total)
+        return total  # Tag counts and metadata are only known after a full pass
+
+    def stats(self):
+        return {
+            "queries": self.queries,
+            "cache hits": self.hits,
+            "cache misses": self.misses,
+            "cached results": len(self.cache),
+            "last query ms": round(self.last_ms, 2),
+        }
+
@@ -0,0 +1,170 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from image_hash import to_signed, to_unsigned
+
+
+class ThumbnailCache:
+    # Persistent thumbnail store shared by every folder. Entries are keyed on the image
+    # path and only count as a hit while the file's mtime and size are unchanged, so an
+    # edited image is simply re-thumbnailed and overwritten. The total blob size is capped,
+    # the least recently used entries are evicted first. The perceptual hashes of a thumbnail
+    # (see image_hash) and the original's width, height, format and mode are stored in its
+    # row, they're NULL for entries cached before those existed.
+    def __init__(self, db_path, max_bytes=512 * 1024 * 1024, commit_every=200):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.touched = set()  # Paths that were read since the last flush, their last_used gets bumped
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS thumbnails (
+                                path TEXT PRIMARY KEY,
+                                mtime_ns INTEGER NOT NULL,
+                                size INTEGER NOT NULL,
+                                data BLOB NOT NULL,
+                                last_used INTEGER NOT NULL,
+                                dhash INTEGER,
+                                phash INTEGER,
+                                width INTEGER,
+                                height INTEGER,
+                                format TEXT,
+                                mode TEXT)""")
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(thumbnails)")}
+        for column, kind in (('dhash', 'INTEGER'), ('phash', 'INTEGER'), ('width', 'INTEGER'), ('height', 'INTEGER'), ('format', 'TEXT'), ('mode', 'TEXT')):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE thumbnails ADD COLUMN {column} {kind}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails(last_used)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM thumbnails").fetchone()[0]
+
+    @staticmethod
+    def encode(img):
+        # JPEG for opaque thumbnails, PNG when there's transparency to keep
+        buffer = io.BytesIO()
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img.save(buffer, format='PNG', compress_level=1)
+        else:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(buffer, format='JPEG', quality=90)
+        return buffer.getvalue()
+
+    @staticmethod
+    def decode(data):
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return img
+
+    def get(self, path, mtime_ns, size, need_info=False):
+        # need_info=True counts entries without hashes or image info as misses, so they're decoded again
+        with self.lock:
+            row = self.conn.execute("SELECT mtime_ns, size, data, phash, width FROM thumbnails WHERE path = ?", (path,)).fetchone()
+            if row is None or row[0] != mtime_ns or row[1] != size or (need_info and (row[3] is None or row[4] is None)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.touched.add(path)
+            return row[2]
+
+    def put(self, path, mtime_ns, size, data, hashes=None, metadata=None):
+        # metadata: (width, height, format, mode, file size), see ImageMetadata
+        dhash, phash = (to_signed(value) for value in hashes) if hashes else (None, None)
+        width, height, image_format, mode = metadata[:4] if metadata else (None, None, None, None)
+        with self.lock:
+            old = self.conn.execute("SELECT LENGTH(data) FROM thumbnails WHERE path = ?", (path,)).fetchone()
+            if old:
+                self.total_bytes -= old[0]
+            self.conn.execute("INSERT OR REPLACE INTO thumbnails (path, mtime_ns, size, data, last_used, dhash, phash, width, height, format, mode) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (path, mtime_ns, size, data, int(time.time()), dhash, phash, width, height, image_format, mode))
+            self.total_bytes += len(data)
+            self.pending_writes += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            if self.pending_writes >= self.commit_every:
+                self._commit()
+
+    def _select_fresh(self, columns, entries, chunk_size=500):
+        # Rows of columns by path for the (path, mtime_ns, size) entries that are still fresh,
+        # skipping rows where the first column is NULL
+        found = {}
+        entries = list(entries)
+        with self.lock:
+            for start in range(0, len(entries), chunk_size):
+                chunk = entries[start:start + chunk_size]
+                expected = {path: (mtime_ns, size) for path, mtime_ns, size in chunk}
+                rows = self.conn.execute(f"SELECT path, mtime_ns, size, {', '.join(columns)} FROM thumbnails "
+                                         f"WHERE {columns[0]} IS NOT NULL AND path IN ({','.join('?' * len(expected))})",
+                                         list(expected)).fetchall()
+                for path, mtime_ns, size, *values in rows:
+                    if expected[path] == (mtime_ns, size):
+                        found[path] = values
+        return found
+
+    def get_hashes(self, entries):
+        # (dhash, phash) by path for the (path, mtime_ns, size) entries that have fresh hashes
+        return {path: (to_unsigned(dhash), to_unsigned(phash)) for path, (phash, dhash) in self._select_fresh(('phash', 'dhash'), entries).items()}
+
+    def get_metadata(self, entries):
+        # (width, height, format, mode, file size) by path for the entries that have fresh ones
+        return {path: tuple(values) for path, values in self._select_fresh(('width', 'height', 'format', 'mode', 'size'), entries).items()}
+
+    def _evict(self):
+        # Drop least recently used entries until we're back under 90% of the cap
+        target = self.max_bytes * 0.9
+        while self.total_bytes > target:
+            rows = self.conn.execute("SELECT path, LENGTH(data) FROM thumbnails ORDER BY last_used LIMIT 256").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for path, length in rows:
+                self.conn.execute("DELETE FROM thumbnails WHERE path = ?", (path,))
+                self.total_bytes -= length
+                self.evictions += 1
+                if self.total_bytes <= target:
+                    break
+
+    def _commit(self):
+        if self.touched:
+            now = int(time.time())
+            self.conn.executemany("UPDATE thumbnails SET last_used = ? WHERE path = ?", [(now, path) for path in self.touched])
+            self.touched.clear()
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.conn.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM thumbnails").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+        }
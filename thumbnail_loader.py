@@ -0,0 +1,146 @@
+import os
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from image_hash import image_hashes
+from thumbnail_cache import ThumbnailCache
+
+THUMBNAIL_SIZE = (120, 120)
+
+
+def decode_thumbnail(image_path):
+    # Runs inside the worker processes. JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale
+    # with draft() so the full resolution image never exists, everything else goes through
+    # reduce() before the final resample. The perceptual hashes are taken from the thumbnail,
+    # the metadata (see ImageMetadata) from the original before draft() scales it down.
+    with Image.open(image_path) as img:
+        metadata = img.size + (img.format, img.mode)
+        img.draft('RGB', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+        img.thumbnail(THUMBNAIL_SIZE, reducing_gap=2.0)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        mode = 'RGBA' if has_alpha else 'RGB'
+        thumb = img.convert(mode)
+    return mode, thumb.size, thumb.tobytes(), ThumbnailCache.encode(thumb), image_hashes(thumb), metadata
+
+
+def decode_thumbnail_batch(image_paths):
+    results = []
+    for image_path in image_paths:
+        try:
+            results.append((image_path,) + decode_thumbnail(image_path))
+        except Exception as e:
+            results.append((image_path, None, None, None, str(e), None, None))
+    return results
+
+
+def buffer_to_image(mode, size, raw):
+    return Image.frombuffer(mode, size, raw, 'raw', mode, 0, 1)
+
+
+class ThumbnailPipeline:
+    # Feeds cache misses to a process pool in fixed size batches and hands results back in
+    # the original order. Only a bounded number of batches is in flight at once, so memory
+    # stays flat no matter how many images the folder has.
+    def __init__(self, cache, workers=None, batch_size=32):
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_in_flight = self.workers * 2
+        self.executor = None
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def _decode_misses(self, misses):
+        try:
+            return self._get_executor().submit(decode_thumbnail_batch, misses)
+        except Exception as e:
+            # No usable process pool (e.g. a broken pool after a worker crashed), decode here
+            print(f"Thumbnail process pool unavailable, decoding in-process: {e}")
+            self.executor = None
+            return decode_thumbnail_batch(misses)
+
+    def run(self, image_paths, cancelled=lambda: False, batch_size=None, max_in_flight=None, need_info=False):
+        # Yields one list per batch of batch_size paths: (image_path, mode, size, raw, blob,
+        # hashes, metadata). Cache hits come back with only the blob set, images that failed
+        # are left out. need_info=True decodes cached thumbnails without hashes or metadata
+        # again, and returns the stored ones of cache hits.
+        # image_paths can be any iterable, e.g. a generator fed by a folder walk in progress.
+        # It's only read when a batch is submitted, smaller batches and fewer of them in
+        # flight let a generator that picks paths by priority react sooner.
+        batch_size = batch_size or self.batch_size
+        max_in_flight = max_in_flight or self.max_in_flight
+        in_flight = deque()
+        image_paths = iter(image_paths)
+        while True:
+            if cancelled():
+                return
+            batch = list(islice(image_paths, batch_size))
+            if not batch:
+                break
+            hits, misses, stats = {}, [], {}
+            for image_path in batch:
+                try:
+                    stat = os.stat(image_path)
+                except OSError as e:
+                    print(f"Error reading '{image_path}': {e}")
+                    continue
+                stats[image_path] = stat
+                data = self.cache.get(image_path, stat.st_mtime_ns, stat.st_size, need_info)
+                if data is not None:
+                    hashes = metadata = None
+                    if need_info:
+                        entry = [(image_path, stat.st_mtime_ns, stat.st_size)]
+                        hashes, metadata = self.cache.get_hashes(entry).get(image_path), self.cache.get_metadata(entry).get(image_path)
+                    hits[image_path] = (data, hashes, metadata)
+                else:
+                    misses.append(image_path)
+            future = self._decode_misses(misses) if misses else None
+            in_flight.append((batch, hits, stats, future))
+
+            while len(in_flight) >= max_in_flight:
+                yield self._collect(*in_flight.popleft())
+
+        while in_flight:
+            if cancelled():
+                return
+            yield self._collect(*in_flight.popleft())
+
+    def _collect(self, batch, hits, stats, future):
+        decoded = {}
+        if future is not None:
+            if isinstance(future, list):
+                results = future
+            else:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Thumbnail worker failed, decoding in-process: {e}")
+                    self.executor = None
+                    results = decode_thumbnail_batch([image_path for image_path in batch if image_path in stats and image_path not in hits])
+            for image_path, mode, size, raw, blob, hashes, metadata in results:
+                if mode is None:
+                    print(f"Error loading image '{image_path}': {blob}")
+                    continue
+                stat = stats[image_path]
+                metadata += (stat.st_size,)
+                self.cache.put(image_path, stat.st_mtime_ns, stat.st_size, blob, hashes, metadata)
+                decoded[image_path] = (mode, size, raw, blob, hashes, metadata)
+
+        results = []
+        for image_path in batch:
+            if image_path in hits:
+                results.append((image_path, None, None, None) + hits[image_path])
+            elif image_path in decoded:
+                results.append((image_path,) + decoded[image_path])
+        return results
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,60 @@
+class ViewModel:
+    # Dirty flags for the parts of the window that are derived from the dataset. Handlers
+    # only mark what their change invalidated, and one render pass at idle time repaints
+    # every dirty part once, however often it was marked in between. Parts without a
+    # renderer only pass the mark on to the parts that depend on them.
+    #
+    # suspend()/resume() hold the render pass back while a long task keeps changing things,
+    # the pass runs once when the last hold is released.
+    def __init__(self, root):
+        self.root = root
+        self.renderers = {}  # Part -> callable, rendered in registration order
+        self.dependents = {}  # Part -> parts that have to be repainted along with it
+        self.dirty = set()
+        self.holds = 0
+        self.scheduled = False
+        self.requested = {}
+        self.executed = {}
+
+    def register(self, part, renderer=None, dependents=()):
+        self.renderers[part] = renderer
+        self.dependents[part] = tuple(dependents)
+        self.requested[part] = 0
+        self.executed[part] = 0
+
+    def mark(self, *parts):
+        for part in parts:
+            self.requested[part] += 1
+            self.dirty.add(part)
+            self.dirty.update(self.dependents[part])
+        self._schedule()
+
+    def suspend(self):
+        self.holds += 1
+
+    def resume(self):
+        self.holds -= 1
+        self._schedule()
+
+    def _schedule(self):
+        if self.dirty and not self.holds and not self.scheduled:
+            self.scheduled = True
+            self.root.after_idle(self.render)
+
+    def render(self):
+        self.scheduled = False
+        if self.holds:
+            return  # resume() schedules the pass again
+        dirty, self.dirty = self.dirty, set()
+        for part, renderer in self.renderers.items():
+            if part not in dirty:
+                continue
+            self.executed[part] += 1
+            if renderer is not None:
+                try:
+                    renderer()
+                except Exception as e:
+                    print(f"Error rendering {part}: {e}")
+
+    def stats(self):
+        return {f"{part} requested/executed": f"{self.requested[part]}/{self.executed[part]}" for part in self.renderers}